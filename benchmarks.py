@@ -0,0 +1,183 @@
+"""
+Benchmarks for the headless drawing engine.
+
+Each workload is a fixed, seeded list of engine commands (see engine.py), so
+runs are reproducible and comparable between changes. Setup commands run first
+and aren't timed; the timed commands are replayed and throughput and peak
+memory are reported. Peak memory comes from tracemalloc, which sees Python and
+NumPy allocations (history tiles, fill masks) but not pygame's own surfaces.
+
+    python benchmarks.py                # every workload
+    python benchmarks.py fill undo      # just some of them
+    python benchmarks.py --repeat 5     # best of 5 runs
+    python benchmarks.py --profile      # plus time per engine step (see profiler.py)
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+
+import pygame
+
+from engine import DrawingEngine
+from profiler import Profiler
+
+CANVAS_SIZE = (1000, 658) # Same as the app's canvas
+TILED_SIZE = (20000, 20000)
+VIEW_SIZE = (1000, 658)
+COLORS = [(0, 0, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (128, 0, 128), (255, 165, 0), (0, 255, 255)]
+
+
+def pen_workload(rng, _):
+    """Long pen strokes: 20 wavy strokes of 500 samples each, flushed every 8 samples like a 60 FPS frame."""
+    setup = [["mode", "pen"], ["size", 12]]
+    timed = []
+    samples = 0
+    for _ in range(20):
+        x, y = rng.randrange(100, 900), rng.randrange(100, 558)
+        angle = rng.uniform(0, math.tau)
+        timed.append(["color", list(rng.choice(COLORS))])
+        timed.append(["press", x, y])
+        for i in range(500):
+            angle += rng.uniform(-0.3, 0.3)
+            x = min(max(x + math.cos(angle) * 3, 0), CANVAS_SIZE[0] - 1)
+            y = min(max(y + math.sin(angle) * 3, 1), CANVAS_SIZE[1] - 1)
+            timed.append(["drag", round(x), round(y)])
+            if i % 8 == 7:
+                timed.append(["flush"])
+        timed.append(["release", round(x), round(y)])
+        samples += 500
+    return setup, timed, samples, "samples"
+
+
+def brush_workload(rng, folder):
+    """Soft brush: the pen workload's strokes with a 20 px, fully soft brush at half opacity."""
+    _, timed, samples, unit_name = pen_workload(rng, folder)
+    setup = [["mode", "brush"], ["size", 20], ["hardness", 0], ["brush_opacity", 128]]
+    return setup, timed, samples, unit_name
+
+
+def fill_workload(rng, _):
+    """Full-canvas fills: 20 fills that each recolour the whole (single colour) canvas."""
+    setup = [["mode", "fill"]]
+    timed = []
+    for i in range(20):
+        timed.append(["color", list(COLORS[i % len(COLORS)])])
+        timed.append(["press", rng.randrange(CANVAS_SIZE[0]), rng.randrange(CANVAS_SIZE[1])])
+    return setup, timed, 20, "fills"
+
+
+def undo_workload(rng, _):
+    """50-deep undo chain: 50 random shapes, then 50 undos and 50 redos."""
+    setup = [["size", 4]]
+    for _ in range(50):
+        setup.append(["mode", rng.choice(["line", "rect", "circle"])])
+        setup.append(["fill_mode", rng.choice(["outline", "fill"])])
+        setup.append(["color", list(rng.choice(COLORS))])
+        setup.append(["press", rng.randrange(CANVAS_SIZE[0]), rng.randrange(CANVAS_SIZE[1])])
+        setup.append(["release", rng.randrange(CANVAS_SIZE[0]), rng.randrange(CANVAS_SIZE[1])])
+    timed = [["undo"]] * 50 + [["redo"]] * 50
+    return setup, timed, 100, "undo/redo"
+
+
+def save_workload(rng, folder):
+    """Saving: 10 PNG saves of a canvas with 30 filled shapes on it."""
+    setup = [["fill_mode", "fill"]]
+    for _ in range(30):
+        setup.append(["mode", rng.choice(["rect", "circle"])])
+        setup.append(["color", list(rng.choice(COLORS))])
+        setup.append(["press", rng.randrange(CANVAS_SIZE[0]), rng.randrange(CANVAS_SIZE[1])])
+        setup.append(["release", rng.randrange(CANVAS_SIZE[0]), rng.randrange(CANVAS_SIZE[1])])
+    timed = [["save", os.path.join(folder, f"bench_{i}.png")] for i in range(10)]
+    return setup, timed, 10, "saves"
+
+
+def tiled_workload(rng, _):
+    """Big tiled canvas: 100 pen strokes of 100 samples, each in a different spot so the window moves every time."""
+    setup = [["mode", "pen"], ["size", 12]]
+    timed = []
+    for _ in range(100):
+        left, top = rng.randrange(TILED_SIZE[0] - VIEW_SIZE[0]), rng.randrange(TILED_SIZE[1] - VIEW_SIZE[1])
+        timed.append(["window", left, top, *VIEW_SIZE]) # What panning there does in the app
+        x, y = left + VIEW_SIZE[0] // 2, top + VIEW_SIZE[1] // 2
+        timed.append(["press", x, y])
+        for i in range(100):
+            x += rng.randrange(-8, 9)
+            y += rng.randrange(-8, 9)
+            timed.append(["drag", x, y])
+            if i % 8 == 7:
+                timed.append(["flush"])
+        timed.append(["release", x, y])
+    return setup, timed, 100, "strokes"
+
+
+WORKLOADS = {
+    "pen": pen_workload,
+    "brush": brush_workload,
+    "fill": fill_workload,
+    "undo": undo_workload,
+    "save": save_workload,
+    "tiled": tiled_workload,
+}
+
+# Engine settings per workload, the default is a canvas the size of the app's
+ENGINE_OPTIONS = {
+    "tiled": {"size": TILED_SIZE, "window_size": (VIEW_SIZE[0] + 512, VIEW_SIZE[1] + 512)},
+}
+
+
+def run_workload(name, repeat, seed=1234, profiler=None):
+    """
+    Returns (best seconds, units, unit name, peak traced bytes, history bytes) for one workload.
+    A profiler, if given, times the engine's steps over all the runs.
+    """
+    best = None
+    peak = 0
+    with tempfile.TemporaryDirectory() as folder:
+        for _ in range(repeat):
+            setup, timed, units, unit_name = WORKLOADS[name](random.Random(seed), folder)
+            engine = DrawingEngine(**ENGINE_OPTIONS.get(name, {"size": CANVAS_SIZE}))
+            engine.replay(setup)
+            if profiler:
+                engine.profiler = profiler
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            engine.replay(timed)
+            elapsed = time.perf_counter() - start
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+            best = elapsed if best is None else min(best, elapsed)
+    return best, units, unit_name, peak, engine.history.bytes_used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the drawing engine on fixed workloads.")
+    parser.add_argument("workloads", nargs="*", help=f"workloads to run: {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per workload; the fastest is reported")
+    parser.add_argument("--profile", action="store_true", help="also show where each workload's time goes")
+    args = parser.parse_args()
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"unknown workload(s): {', '.join(unknown)}")
+
+    pygame.init()
+    print(f"{'workload':<10}{'units':>18}{'best time':>12}{'throughput':>22}{'peak mem':>12}{'history':>12}")
+    for name in args.workloads or WORKLOADS:
+        profiler = Profiler(enabled=True) if args.profile else None
+        seconds, units, unit_name, peak, history_bytes = run_workload(name, args.repeat, profiler=profiler)
+        print(f"{name:<10}{f'{units} {unit_name}':>18}{seconds:>10.3f} s{f'{units / seconds:,.0f} {unit_name}/s':>22}"
+              f"{peak / 2**20:>9.1f} MB{history_bytes / 2**20:>9.1f} MB")
+        if profiler:
+            print(profiler.summary() + "\n")
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
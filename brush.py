@@ -0,0 +1,130 @@
+"""
+Soft, antialiased brush strokes stamped from cached alpha masks.
+
+A stroke is a row of dabs spaced along the path. Each dab is a precomputed
+alpha mask for the brush's (diameter, hardness), cached with lru_cache. The
+dabs of one frame are merged into a per-stroke coverage buffer with a single
+np.maximum.at. The layer is then blended from its pixels as they were before
+the stroke, in one NumPy operation over the frame's bounding box. Since
+coverage takes the maximum instead of adding up, overlapping dabs don't build
+up, and opacity caps the whole stroke, the way it does in paint programs.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+import pygame
+
+
+@lru_cache(maxsize=64)
+def stamp_mask(diameter, hardness):
+    """
+    Returns the alpha (0..1) of one dab as a read-only float32 array, square with an odd side so it centres on a
+    pixel. hardness 1 is a solid disc with an antialiased edge, 0 fades out from the centre.
+    """
+    radius = diameter / 2
+    half = math.ceil(radius + 0.5)
+    y, x = np.ogrid[-half:half + 1, -half:half + 1]
+    distance = np.sqrt(x * x + y * y)
+    falloff = max((1 - hardness) * radius, 1.0) # At least a pixel wide, which antialiases the edge
+    t = np.clip((radius + 0.5 - distance) / falloff, 0, 1)
+    mask = (t * t * (3 - 2 * t)).astype(np.float32) # Smoothstep, so soft edges have no visible rim
+    mask.flags.writeable = False
+    return mask
+
+
+class Brush:
+    def __init__(self, spacing=0.15):
+        self.spacing = spacing # Distance between dabs, as a fraction of the diameter
+        self._surface = None
+        self._coverage = None # Stroke coverage (0..1) per pixel of the surface, indexed [y, x]
+        self._before = None # The surface's mapped pixels as they were when the stroke began, indexed [x, y]
+        self._touched = None # Area of the coverage buffer that isn't zero
+
+    def begin(self, surface, diameter, hardness, color, opacity):
+        """Starts a stroke on surface. hardness is 0..1, opacity 0..255."""
+        width, height = surface.get_size()
+        if self._coverage is None or self._coverage.shape != (height, width):
+            self._coverage = np.zeros((height, width), np.float32)
+        elif self._touched:
+            self._coverage[self._touched.top:self._touched.bottom, self._touched.left:self._touched.right] = 0
+
+        # Dabs may land anywhere, so keep all the old pixels; as mapped 32-bit values that is a plain copy
+        self._surface = surface
+        self._before = np.array(pygame.surfarray.pixels2d(surface))
+        self._has_alpha = bool(surface.get_flags() & pygame.SRCALPHA)
+        self._mask = stamp_mask(max(int(diameter), 1), round(hardness, 2))
+        self._step = max(diameter * self.spacing, 1.0)
+        self._color = np.array(color[:3], np.float32)
+        self._opacity = opacity / 255
+        self._carry = 0.0 # Path length left to go before the next dab
+        self._touched = None
+
+    def stamp(self, points):
+        """
+        Stamps dabs along the polyline points (surface coordinates), continuing the spacing from the last call.
+        A single point is one dab. Returns the changed Rect, or None.
+        """
+        centres = self._dab_centres(points)
+        if not centres:
+            return None
+        height, width = self._coverage.shape
+        half = self._mask.shape[0] // 2
+        offset_y, offset_x = np.mgrid[-half:half + 1, -half:half + 1]
+        centres = np.array(centres, np.int64)
+        xs = (centres[:, 0, None, None] + offset_x).ravel()
+        ys = (centres[:, 1, None, None] + offset_y).ravel()
+        values = np.broadcast_to(self._mask, (len(centres),) + self._mask.shape).ravel()
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        if not inside.any():
+            return None
+        xs, ys, values = xs[inside], ys[inside], values[inside]
+        np.maximum.at(self._coverage.ravel(), ys * width + xs, values) # All of this frame's dabs in one call
+
+        rect = pygame.Rect(int(xs.min()), int(ys.min()), int(xs.max()) - int(xs.min()) + 1, int(ys.max()) - int(ys.min()) + 1)
+        self._touched = rect if self._touched is None else self._touched.union(rect)
+        self._blend(rect)
+        return rect
+
+    def _dab_centres(self, points):
+        if len(points) == 1:
+            return [(round(points[0][0]), round(points[0][1]))]
+        centres = []
+        for start, end in zip(points, points[1:]):
+            length = math.hypot(end[0] - start[0], end[1] - start[1])
+            if length == 0:
+                continue
+            distance = self._carry
+            while distance <= length:
+                t = distance / length
+                centres.append((round(start[0] + (end[0] - start[0]) * t), round(start[1] + (end[1] - start[1]) * t)))
+                distance += self._step
+            self._carry = distance - length
+        return centres
+
+    def _blend(self, rect):
+        """Repaints rect of the surface from the pixels before the stroke and the coverage so far."""
+        area = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+        alpha = self._coverage[rect.top:rect.bottom, rect.left:rect.right].T[..., None] * self._opacity
+        before = self._before[area]
+        red, green, blue, alpha_shift = self._surface.get_shifts()
+        below = np.stack([(before >> shift) & 0xFF for shift in (red, green, blue)], axis=-1).astype(np.float32)
+
+        if self._has_alpha:
+            # Painting "over" a layer that may be transparent; colours are kept unpremultiplied like the surface
+            below_alpha = ((before >> alpha_shift) & 0xFF)[..., None] / np.float32(255)
+            out_alpha = alpha + below_alpha * (1 - alpha)
+            rgb = (self._color * alpha + below * below_alpha * (1 - alpha)) / np.maximum(out_alpha, 1e-6)
+            kept = (out_alpha[..., 0] * 255 + 0.5).astype(np.uint32) << alpha_shift
+        else:
+            rgb = below + (self._color - below) * alpha
+            kept = before & ~np.uint32(sum(self._surface.get_masks()[:3])) # Whatever the unused byte holds
+        rgb = (rgb + 0.5).astype(np.uint32)
+        target = pygame.surfarray.pixels2d(self._surface)
+        target[area] = kept | rgb[..., 0] << red | rgb[..., 1] << green | rgb[..., 2] << blue
+        del target # Release the surface lock
+
+    def end(self):
+        """Finishes the stroke and lets go of the copied pixels."""
+        self._surface = None
+        self._before = None
@@ -0,0 +1,423 @@
+"""
+A shared canvas: a localhost server, and the client that lets several app
+windows draw on the same picture.
+
+Every change to a layer ends up in the undo history (see history.py), and
+what it changed is what gets shared: once per frame the app sends, per tile,
+a mask of the pixels its commits, undos and redos changed and their new
+values, zlib-compressed, in one message. Pixel deltas apply the same way
+everywhere, whatever tool another user has selected or is in the middle of
+using, and two users drawing on the same tile don't wipe out each other's
+work.
+
+The server (asyncio, plain TCP with length-prefixed messages) keeps the
+latest pixels every tile was given and merges what arrives during a tick, per
+pixel: where two deltas change the same pixel, the one the server took in
+later wins. Once per tick it sends every client a single update, each tile
+encoded once for all of them. Reading from a client is rate limited by a
+token bucket, so a client that sends too much is slowed down by TCP itself. A
+client too slow to take its updates stops getting them, and gets a snapshot
+once its backlog has drained. A new client gets a cached snapshot of every
+tile plus the updates since it was taken, so nobody joining makes the server
+re-encode the canvas.
+
+Clients show their own changes straight away. A client ignores updates to
+pixels it changed until the server has acknowledged its message, since those
+are older than its own, so everyone ends up with the same pixels. Undo
+restores only the pixels its action changed. Layers are matched by index;
+adding, removing or reordering them isn't shared.
+
+    python collab.py                            # serves a 1000x658 canvas on 127.0.0.1:8765
+    COLLAB_SERVER = "127.0.0.1:8765"            # in drawingApp.py, for every window that joins
+"""
+import argparse
+import asyncio
+import queue
+import struct
+import threading
+import zlib
+from collections import deque
+
+import numpy as np
+import pygame
+
+CANVAS_SIZE = (1000, 658) # The app's canvas, which fits its window
+TILE_SIZE = 64 # The app's history tile size; clients must use the server's
+PORT = 8765
+
+# Every message is a FRAME_HEADER (length of what follows it, message type) and a body
+FRAME_HEADER = struct.Struct("<IB")
+HELLO = 1 # Server to a new client: HELLO_BODY
+TILES = 2 # Client to server: a SEQ, then a DELTA record per tile, each followed by its payload (see encode_delta)
+UPDATE = 3 # Server to client: ACK, then DELTA records (plus payloads)
+HELLO_BODY = struct.Struct("<HIIH") # Client id, canvas width, height, tile size
+SEQ = struct.Struct("<I") # Sequence number of a client's message
+DELTA = struct.Struct("<HiiHHI") # Layer index, x, y, width, height, payload length
+ACK = struct.Struct("<I") # Sequence number of the last message taken in from the client the update goes to
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def frame(kind, body):
+    return FRAME_HEADER.pack(len(body), kind) + body
+
+
+async def read_frame(reader):
+    """Returns (message type, body) of the next message; raises ValueError if it is too big to be one."""
+    length, kind = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if length > MAX_FRAME:
+        raise ValueError("message too big")
+    return kind, await reader.readexactly(length)
+
+
+def encode_delta(mask, pixels):
+    """Payload of a tile's delta: its mask (bool, height x width) as bits, then the pixels in it, row by row."""
+    return zlib.compress(np.packbits(mask).tobytes() + pixels[mask].astype("<u4").tobytes(), 1)
+
+
+def inflate_delta(payload, width, height):
+    """Decompresses a delta's payload; raises ValueError if it doesn't hold a width x height tile."""
+    mask_length = (width * height + 7) // 8
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, mask_length + width * height * 4)
+    if (len(data) < mask_length or decompressor.unconsumed_tail
+            or len(data) != mask_length + int.from_bytes(data[:mask_length], "little").bit_count() * 4):
+        raise ValueError("tile has the wrong size")
+    return data
+
+
+def unpack_delta(data, width, height):
+    """Returns (mask, pixels) from a decompressed payload; pixels outside the mask are 0."""
+    mask_length = (width * height + 7) // 8
+    mask = np.unpackbits(np.frombuffer(data, np.uint8, mask_length), count=width * height).reshape(height, width)
+    mask = mask.astype(bool)
+    pixels = np.zeros((height, width), np.uint32)
+    pixels[mask] = np.frombuffer(data, "<u4", offset=mask_length)
+    return mask, pixels
+
+
+def read_deltas(body, size, tile_size):
+    """
+    Yields (layer, x, y, width, height, record, decompressed payload) of every DELTA record in body, where record
+    is the DELTA and its payload as they are. Raises ValueError if a tile doesn't fit the canvas or is cut off.
+    """
+    offset = 0
+    while offset < len(body):
+        layer, x, y, width, height, length = DELTA.unpack_from(body, offset)
+        end = offset + DELTA.size + length
+        if end > len(body) or not _fits(x, y, width, height, size, tile_size):
+            raise ValueError("bad tile")
+        yield layer, x, y, width, height, body[offset:end], inflate_delta(body[offset + DELTA.size:end], width, height)
+        offset = end
+
+
+def decode_deltas(body, size, tile_size):
+    """Yields (layer, x, y, mask, pixels) of every DELTA record in body; raises ValueError as read_deltas does."""
+    for layer, x, y, width, height, _, data in read_deltas(body, size, tile_size):
+        yield (layer, x, y) + unpack_delta(data, width, height)
+
+
+def encode_deltas(deltas):
+    """DELTA records from (layer, x, y, mask, pixels) tiles."""
+    records = []
+    for layer, x, y, mask, pixels in deltas:
+        payload = encode_delta(mask, pixels)
+        records.append(DELTA.pack(layer, x, y, mask.shape[1], mask.shape[0], len(payload)) + payload)
+    return b"".join(records)
+
+
+def merge_delta(deltas, key, mask, pixels):
+    """Adds a delta to a dict of (layer, x, y) -> (mask, pixels), in place; where both change a pixel, the new one wins."""
+    if key in deltas:
+        old_mask, old_pixels = deltas[key]
+        old_mask |= mask
+        np.copyto(old_pixels, pixels, where=mask)
+    else:
+        deltas[key] = (mask.copy(), pixels.copy())
+
+
+def _fits(x, y, width, height, size, tile_size):
+    """True if this is one of the canvas's tiles, as the history cuts them."""
+    return (0 <= x < size[0] and 0 <= y < size[1] and x % tile_size == 0 and y % tile_size == 0
+            and width == min(tile_size, size[0] - x) and height == min(tile_size, size[1] - y))
+
+
+class _Client:
+    """What the server keeps per connection."""
+
+    def __init__(self, id, writer, tokens):
+        self.id = id
+        self.writer = writer
+        self.tokens = tokens # Rate limit: bytes it may still send right away
+        self.refilled = 0.0 # Loop time the tokens were last topped up
+        self.ack = 0 # Sequence number of the last message taken in from it
+        self.stale = False # Fell behind; gets a snapshot instead of updates once it catches up
+
+
+class CollabServer:
+    def __init__(self, size=CANVAS_SIZE, tile_size=TILE_SIZE, tick=1 / 60, rate=8 * 1024 * 1024,
+                 burst=4 * 1024 * 1024, max_backlog=8 * 1024 * 1024, snapshot_bytes=4 * 1024 * 1024):
+        self.size = tuple(size)
+        self.tile_size = tile_size
+        self.tick = tick # Seconds between updates; deltas arriving in between are merged
+        self.rate = rate # Bytes per second each client may send...
+        self.burst = burst # ...and how far ahead of that it may get
+        self.max_backlog = max_backlog # Unsent bytes past which a client counts as too slow
+        self.snapshot_bytes = snapshot_bytes # Updates since the snapshot past which it is taken again (if bigger than it)
+        self.stats = {"clients": 0, "tiles_in": 0, "tiles_out": 0, "updates": 0, "resyncs": 0, "throttled_s": 0.0}
+        self._clients = {} # id -> _Client
+        self._next_id = 1
+        self._tiles = {} # (layer, x, y) -> (mask of the pixels ever given, their latest values)
+        self._pending = {} # (layer, x, y) -> (record, decompressed delta) of each delta since the last tick, in order
+        self._snapshot = b"" # Records of every tile as of when it was taken
+        self._recent = [] # Records of each update sent since the snapshot
+        self._recent_bytes = 0
+        self._server = None
+        self._ticker = None
+
+    async def start(self, host="127.0.0.1", port=PORT):
+        """Starts listening (port 0 picks a free one) and sending updates; returns the port."""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self._ticker = asyncio.create_task(self._tick())
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._ticker.cancel()
+        self._server.close()
+        for client in list(self._clients.values()):
+            client.writer.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        client = _Client(self._next_id, writer, self.burst)
+        client.refilled = asyncio.get_running_loop().time()
+        self._next_id = self._next_id % 0xFFFF + 1
+        writer.write(frame(HELLO, HELLO_BODY.pack(client.id, *self.size, self.tile_size)))
+        self._send_state(client)
+        self._clients[client.id] = client
+        self.stats["clients"] += 1
+        try:
+            while True:
+                kind, body = await read_frame(reader)
+                if kind != TILES:
+                    break
+                self._take(client, body)
+                await self._throttle(client, FRAME_HEADER.size + len(body))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error, zlib.error):
+            pass # Gone, or talking nonsense; either way the connection is dropped
+        finally:
+            del self._clients[client.id]
+            writer.close()
+
+    def _take(self, client, body):
+        """Adds the deltas of a TILES message to the next update."""
+        seq, = SEQ.unpack_from(body)
+        # Check them all first, so a bad message changes nothing
+        deltas = list(read_deltas(body[SEQ.size:], self.size, self.tile_size))
+        for layer, x, y, _, _, record, data in deltas:
+            self._pending.setdefault((layer, x, y), []).append((record, data))
+        client.ack = seq
+        self.stats["tiles_in"] += len(deltas)
+
+    def _merge(self, key, deltas):
+        """
+        Merges a tile's deltas, as (record, decompressed delta) in the order they arrived, into the tile. Returns
+        one record for all of them.
+        """
+        shape = self._tile_shape(key)
+        if len(deltas) == 1:
+            record, data = deltas[0]
+            merge_delta(self._tiles, key, *unpack_delta(data, *shape))
+            return record # Passed on as it came
+        merged = {}
+        for _, data in deltas:
+            merge_delta(merged, key, *unpack_delta(data, *shape))
+        merge_delta(self._tiles, key, *merged[key])
+        return encode_deltas([key + merged[key]])
+
+    def _tile_shape(self, key):
+        """Width and height of a tile, smaller at the right and bottom edges."""
+        _, x, y = key
+        return min(self.tile_size, self.size[0] - x), min(self.tile_size, self.size[1] - y)
+
+    async def _throttle(self, client, size):
+        """Token bucket: once a client has used up its bytes, stop reading from it until they have built up again."""
+        now = asyncio.get_running_loop().time()
+        client.tokens = min(self.burst, client.tokens + (now - client.refilled) * self.rate) - size
+        client.refilled = now
+        if client.tokens < 0:
+            delay = -client.tokens / self.rate
+            self.stats["throttled_s"] += delay
+            await asyncio.sleep(delay)
+
+    def _send_update(self, client, records):
+        client.writer.write(FRAME_HEADER.pack(ACK.size + len(records), UPDATE) + ACK.pack(client.ack))
+        client.writer.write(records) # The same bytes object for every client
+
+    def _send_state(self, client):
+        """Brings a client up to date: the snapshot, then every update since."""
+        self._send_update(client, self._snapshot)
+        for records in self._recent:
+            self._send_update(client, records)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            self.broadcast()
+
+    def broadcast(self):
+        """Sends every client one update with the deltas that arrived since the last one (called every tick)."""
+        records = b"".join(self._merge(key, deltas) for key, deltas in self._pending.items())
+        if records:
+            self.stats["tiles_out"] += len(self._pending)
+            self.stats["updates"] += 1
+            self._pending = {}
+            self._recent.append(records)
+            self._recent_bytes += len(records)
+
+        for client in list(self._clients.values()):
+            backlog = client.writer.transport.get_write_buffer_size()
+            if client.stale:
+                if backlog <= self.max_backlog // 4:
+                    client.stale = False
+                    self.stats["resyncs"] += 1
+                    self._send_state(client) # Includes this tick's deltas
+            elif backlog > self.max_backlog:
+                client.stale = True # Skip its updates from now on, they would only pile up
+            elif records:
+                self._send_update(client, records)
+
+        if self._recent_bytes > max(len(self._snapshot), self.snapshot_bytes):
+            # Joining would mean sending more updates than tiles; take a new snapshot instead
+            self._snapshot = encode_deltas(key + tile for key, tile in self._tiles.items())
+            self._recent = []
+            self._recent_bytes = 0
+
+
+class CollabClient:
+    """
+    A connection to a CollabServer for a pygame app. The network runs on its own thread; send() and receive() are
+    called from the main loop, once per frame.
+    """
+
+    def __init__(self, host, port, size, tile_size, notify_event=None, timeout=5):
+        self.notify_event = notify_event # Posted when an update arrives, to wake up an idle main loop
+        self.id = None
+        self.error = None # Why the connection failed or ended; None while it is up
+        self._size = tuple(size)
+        self._tile_size = tile_size
+        self._seq = 0
+        self._unacknowledged = deque() # (sequence number, {(layer, x, y): mask}) of each message sent, oldest first
+        self._updates = queue.Queue() # Decoded updates from the network thread, in order
+        self._loop = None
+        self._writer = None
+        self._connected = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(host, port),), name="collab", daemon=True)
+        self._thread.start()
+        if not self._connected.wait(timeout) and self.error is None:
+            self.error = "timed out"
+
+    async def _run(self, host, port):
+        try:
+            reader, self._writer = await asyncio.open_connection(host, port)
+            kind, body = await read_frame(reader)
+            if kind != HELLO:
+                raise ValueError("not a drawing server")
+            self.id, width, height, tile_size = HELLO_BODY.unpack(body)
+            if (width, height) != self._size or tile_size != self._tile_size:
+                raise ValueError(f"the server's canvas is {width}x{height} with {tile_size} px tiles")
+            self._loop = asyncio.get_running_loop()
+            self._connected.set()
+            while True:
+                kind, body = await read_frame(reader)
+                if kind == UPDATE:
+                    ack, = ACK.unpack_from(body)
+                    self._updates.put((ack, list(decode_deltas(body[ACK.size:], self._size, self._tile_size))))
+                    if self.notify_event is not None and pygame.display.get_init():
+                        pygame.event.post(pygame.event.Event(self.notify_event))
+        except asyncio.IncompleteReadError:
+            self.error = self.error or "the server closed the connection"
+        except (OSError, ValueError, struct.error, zlib.error) as e:
+            self.error = self.error or str(e)
+        finally:
+            self._loop = None
+            self._connected.set()
+            if self._writer:
+                self._writer.close()
+
+    def send(self, changes):
+        """Sends changes as from DrawingEngine.take_changes (all of one frame, in one message)."""
+        loop = self._loop
+        if not changes or loop is None:
+            return
+        deltas = {}
+        for layer, x, y, mask, pixels in changes:
+            merge_delta(deltas, (layer, x, y), mask, pixels) # A tile changed twice goes once
+        self._seq += 1
+        self._unacknowledged.append((self._seq, {key: mask for key, (mask, _) in deltas.items()}))
+        try:
+            loop.call_soon_threadsafe(self._write, self._seq, deltas)
+        except RuntimeError:
+            pass # Disconnected just now; error says why
+
+    def _write(self, seq, deltas):
+        """On the network thread: compresses and sends the deltas."""
+        self._writer.write(frame(TILES, SEQ.pack(seq) + encode_deltas(key + delta for key, delta in deltas.items())))
+
+    def has_updates(self):
+        """True if others' changes are waiting for receive()."""
+        return not self._updates.empty()
+
+    def receive(self):
+        """Returns the changes others made since the last call, for DrawingEngine.write_tiles."""
+        changes = []
+        while True:
+            try:
+                ack, update = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            # Messages sent up to ack have had their turn; from here on the server's pixels are the ones to show
+            while self._unacknowledged and self._unacknowledged[0][0] <= ack:
+                self._unacknowledged.popleft()
+            for layer, x, y, mask, pixels in update:
+                key = (layer, x, y)
+                for _, masks in self._unacknowledged:
+                    if key in masks:
+                        mask = mask & ~masks[key] # Our newer pixels there will win
+                if mask.any():
+                    changes.append((layer, x, y, mask, pixels))
+        return changes
+
+    def close(self):
+        self.error = self.error or "closed"
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._writer.close)
+            except RuntimeError:
+                pass # Already closed
+        self._thread.join(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a canvas that several drawing app windows share.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--size", type=int, nargs=2, default=CANVAS_SIZE, metavar=("WIDTH", "HEIGHT"),
+                        help="canvas size; it has to match the app's")
+    args = parser.parse_args()
+
+    server = CollabServer(args.size)
+
+    async def serve():
+        port = await server.start(args.host, args.port)
+        print(f"Sharing a {args.size[0]}x{args.size[1]} canvas on {args.host}:{port}")
+        await asyncio.Event().wait() # Until interrupted
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(", ".join(f"{name} {value:g}" for name, value in server.stats.items()))
+
+
+if __name__ == "__main__":
+    main()
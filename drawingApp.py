@@ -1,13 +1,23 @@
 import pygame
 import sys
 import os 
-
-pygame.init()
+import json
+
+from collab import CollabClient
+from engine import DrawingEngine, MIN_BRUSH_SIZE, MAX_BRUSH_SIZE, SELECT_MODES, STROKE_MODES
+from exporter import DEFAULT_OUTPUTS, Exporter
+from journal import Journal
+from layers import BLEND_MODES
+from renderer import DirtyRectRenderer
+from scheduler import FrameScheduler
+from toolbar import ToolbarCache, render_text
+from overlay import PreviewOverlay
+from profiler import Profiler
+from saver import AutoSaver, BackgroundSaver
+from viewport import Viewport
 
 SCREEN_WIDTH = 1000  
 SCREEN_HEIGHT = 800  
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Drawing App")
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -22,51 +32,49 @@ DARK_GRAY = (50, 50, 50)
 LIGHT_GRAY = (200, 200, 200)
 TOOLBAR_BACKGROUND = (60, 60, 60) 
 
-drawing_color = BLACK
-drawing_mode = "pen" 
-drawing = False
-start_pos = None  
-current_pos = None 
-
-brush_size = 2 
-min_brush_size = 1
-max_brush_size = 20
-
-fill_mode = "outline" 
+# Fill tool settings
+FILL_TOLERANCE = 0 # Max per-channel colour difference that still gets filled
+FILL_CONNECTIVITY = 4 # 4 = edges only, 8 = also spread through corners
 
 # Toolbar height definition
 BUTTON_WIDTH = 70
 BUTTON_HEIGHT = 30
 BUTTON_MARGIN = 8
 TOOLBAR_HEIGHT = 3 * BUTTON_HEIGHT + 4 * BUTTON_MARGIN + 20 # Added extra 20px for text clarity
-
-drawing_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT - TOOLBAR_HEIGHT))
-drawing_surface.fill(WHITE) 
-
-history = []
-history_index = -1
-MAX_HISTORY_SIZE = 50 # Needs work
-
-def add_to_history():
-    """Saves the current state of the drawing_surface to history."""
-    global history, history_index
-
-    if history_index < len(history) - 1:
-        history = history[:history_index + 1]
-
-    history.append(drawing_surface.copy())
-    history_index = len(history) - 1
-
-    if len(history) > MAX_HISTORY_SIZE:
-        history.pop(0) 
-        history_index -= 1 
-
-add_to_history()
+TOOLBAR_RECT = pygame.Rect(0, 0, SCREEN_WIDTH, TOOLBAR_HEIGHT)
+VIEW_RECT = pygame.Rect(0, TOOLBAR_HEIGHT, SCREEN_WIDTH, SCREEN_HEIGHT - TOOLBAR_HEIGHT) # Where the canvas is shown
+
+FULL_REDRAW = False # True repaints and flips the whole window every frame instead of only changed areas
+TARGET_FPS = 60 # Frame rate cap while drawing or previewing; the loop sleeps when idle
+SHOW_FRAME_STATS = False # Show the measured frame time and FPS in the window title
+PROFILE = False # Time event handling, the tools, history, toolbar, compositing and presenting; prints a table on exit
+SHOW_HUD = False # Show FPS, p50/p99 frame time and history memory over the canvas (turns on PROFILE)
+TRACE_FILE = None # File name to write a Chrome trace of the session to on exit, e.g. "trace.json" (turns on PROFILE)
+
+HISTORY_TILE_SIZE = 64
+HISTORY_MAX_BYTES = 32 * 1024 * 1024 # Memory budget for undo/redo, oldest actions are dropped past it
+STROKE_SPACING = 2 # Pen/eraser samples closer than this many pixels are merged
+STROKE_SMOOTHING = False # Smooth pen/eraser strokes with a Catmull-Rom spline
+SAVE_NAME = "my_drawing" # Saved as my_drawing.png (plus a suffix depending on SAVE_NAMING)
+SAVE_NAMING = "overwrite" # "overwrite", "timestamp" (my_drawing_20250101-120000.png) or "versioned" (my_drawing_001.png)
+AUTOSAVE_INTERVAL = 0 # Seconds between autosaves to my_drawing_autosave.png; 0 turns autosave off
+EXPORT_OUTPUTS = DEFAULT_OUTPUTS # Files Save writes, in parallel (see exporter.py): full PNG, previews, thumbnails. None writes just the PNG
+CANVAS_SIZE = None # (width, height) of the drawing; None fits it to the window. Bigger, e.g. (20000, 20000), uses a tiled canvas
+TILE_SIZE = 256 # Tiled canvas: tile edge in pixels
+MAX_RESIDENT_TILES = 64 # Tiled canvas: tiles kept in memory, the rest are compressed into a temporary file
+LAYER_OPACITY_STEPS = (255, 191, 128, 64) # The Opacity button cycles the active layer through these
+BRUSH_HARDNESS_STEPS = (100, 50, 0) # The Hard button cycles the soft brush through these (percent)
+BRUSH_OPACITY_STEPS = (255, 128, 64) # The Alpha button cycles the soft brush's stroke opacity through these
+JOURNAL_FILE = "my_drawing.journal" # Every action is logged here and the drawing is restored from it on start; None turns it off
+JOURNAL_CHECKPOINT_EVERY = 100 # Actions between full checkpoints in the journal; restoring replays at most this many
+RECORD_SESSION = None # File name to write the session's input commands to on exit (JSON), for replay/benchmarks
+COLLAB_SERVER = None # "127.0.0.1:8765" shares the canvas with every window connected there (start it with python collab.py); no journal then
 
 class Button:
-    def __init__(self, x, y, width, height, text, color, text_color=BLACK, action=None, mode=None):
+    def __init__(self, x, y, width, height, text, color, text_color=BLACK, action=None, mode=None, text_size=24):
         self.rect = pygame.Rect(x, y, width, height)
         self.text = text
+        self.text_size = text_size
         self.color = color
         self.text_color = text_color
         self.action = action
@@ -89,345 +97,553 @@ class Button:
         pygame.draw.rect(surface, self.color, self.rect, border_radius=5)
         
         if self.text:
-            font = pygame.font.Font(None, 24)
-            text_surf = font.render(self.text, True, self.text_color)
+            text_surf = render_text(self.text, self.text_color, self.text_size)
             text_rect = text_surf.get_rect(center=self.rect.center)
             surface.blit(text_surf, text_rect)
 
     def is_clicked(self, pos):
         return self.rect.collidepoint(pos)
 
-# Create Buttons 
-
-#Row 1
-color_buttons = []
-colors = [BLACK, WHITE, RED, GREEN, BLUE, YELLOW, PURPLE, ORANGE, CYAN]
-start_x_colors = BUTTON_MARGIN
-for i, color in enumerate(colors):
-    btn = Button(start_x_colors + i * (BUTTON_WIDTH + BUTTON_MARGIN),
-                 BUTTON_MARGIN, # Y position for first row
-                 BUTTON_WIDTH, BUTTON_HEIGHT,
-                 "", color, action="set_color")
-    color_buttons.append(btn)
-
-#Row 2: Tool buttons
-tool_buttons = []
-tool_names = ["Pen", "Line", "Rect", "Circle", "Eraser", "Fill"]
-modes = ["pen", "line", "rect", "circle", "eraser", "fill"]
-start_x_tools = BUTTON_MARGIN
-for i, (name, mode) in enumerate(zip(tool_names, modes)):
-    btn = Button(start_x_tools + i * (BUTTON_WIDTH + BUTTON_MARGIN),
-                 BUTTON_MARGIN * 2 + BUTTON_HEIGHT, # Y position for second row
-                 BUTTON_WIDTH, BUTTON_HEIGHT,
-                 name, LIGHT_GRAY, BLACK, action="set_mode", mode=mode)
-    tool_buttons.append(btn)
-
-#Row 3: Utility buttons (Size, Fill, Undo, Redo, Save, Clear)
-utility_buttons = []
-# Size Down
-utility_buttons.append(Button(BUTTON_MARGIN,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Size -", LIGHT_GRAY, BLACK, action="decrease_size"))
-# Size Up
-utility_buttons.append(Button(BUTTON_MARGIN * 2 + BUTTON_WIDTH,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Size +", LIGHT_GRAY, BLACK, action="increase_size"))
-
-# Fill/Outline Toggle - now two separate buttons for clarity
-utility_buttons.append(Button(BUTTON_MARGIN * 3 + BUTTON_WIDTH * 2,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Outline", LIGHT_GRAY, BLACK, action="set_fill_outline", mode="outline"))
-utility_buttons.append(Button(BUTTON_MARGIN * 4 + BUTTON_WIDTH * 3,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Fill", LIGHT_GRAY, BLACK, action="set_fill_outline", mode="fill"))
-
-# Undo button
-utility_buttons.append(Button(BUTTON_MARGIN * 5 + BUTTON_WIDTH * 4,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Undo", LIGHT_GRAY, BLACK, action="undo"))
-# Redo button
-utility_buttons.append(Button(BUTTON_MARGIN * 6 + BUTTON_WIDTH * 5,
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Redo", LIGHT_GRAY, BLACK, action="redo"))
-# Save button
-utility_buttons.append(Button(BUTTON_MARGIN * 7 + BUTTON_WIDTH * 6, # Adjusted X for Save
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Save", GREEN, WHITE, action="save_drawing"))
-# Clear button
-utility_buttons.append(Button(SCREEN_WIDTH - BUTTON_WIDTH - BUTTON_MARGIN, # Align to right
-                              BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
-                              BUTTON_WIDTH, BUTTON_HEIGHT,
-                              "Clear", RED, WHITE, action="clear_canvas"))
-
-
-all_buttons = color_buttons + tool_buttons + utility_buttons
-
-def save_drawing():
-    """Saves the current drawing_surface to a PNG file."""
-    filename = "my_drawing.png" 
-    try:
-        # Create a temporary surface to draw the canvas content only
-        # This prevents saving the toolbar background as part of the drawing
-        temp_save_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT - TOOLBAR_HEIGHT))
-        temp_save_surface.blit(drawing_surface, (0, 0)) 
-        pygame.image.save(temp_save_surface, filename)
-        print(f"Drawing saved as {filename}")
-    except Exception as e:
-        print(f"Error saving drawing: {e}")
+
+def save_drawing(filename=None, export=True):
+    """
+    Saves the canvas to a PNG file, plus the other EXPORT_OUTPUTS if export is True; the files are written in the
+    background. A tiled canvas is only saved as the PNG.
+    """
+    if filename is None:
+        filename = saver.make_filename(SAVE_NAME, SAVE_NAMING)
+    # Only the canvas, not the toolbar. The snapshot is taken now, later drawing doesn't end up in the file
+    if export and exporter and not engine.tiles:
+        saver.save(exporter.snapshot(engine.image), filename, atomic=False) # Each output is written atomically
+    else:
+        saver.save(engine.snapshot(), filename)
+    autosaver.mark_saved(engine.history.version)
 
 def undo():
-    """Reverts the drawing_surface to the previous state in history."""
-    global drawing_surface, history_index
-    if history_index > 0:
-        history_index -= 1
-        drawing_surface.blit(history[history_index], (0, 0)) # Load previous state
-        print(f"Undo: Current history index {history_index}")
+    """Reverts the canvas to the previous state in history."""
+    restored_rect = engine.undo()
+    if restored_rect:
+        renderer.invalidate(canvas_to_screen(restored_rect))
+        print(f"Undo: Current history index {engine.history.index}")
     else:
         print("Nothing to undo.")
 
 def redo():
-    """Reapplies the drawing_surface to the next state in history."""
-    global drawing_surface, history_index
-    if history_index < len(history) - 1:
-        history_index += 1
-        drawing_surface.blit(history[history_index], (0, 0)) # Load next state
-        print(f"Redo: Current history index {history_index}")
+    """Reapplies the canvas to the next state in history."""
+    restored_rect = engine.redo()
+    if restored_rect:
+        renderer.invalidate(canvas_to_screen(restored_rect))
+        print(f"Redo: Current history index {engine.history.index}")
     else:
         print("Nothing to redo.")
 
-def flood_fill(start_point_screen, target_color, fill_color):
-    """
-    Performs an iterative flood fill algorithm on the drawing_surface.
-    start_point_screen: (x, y) tuple (screen coordinates) where the fill starts.
-    target_color: The color of the area to be filled (RGB tuple).
-    fill_color: The new color to fill with (RGB tuple).
-    """
-    # Convert screen coordinates to drawing_surface coordinates
-    start_point_canvas = (start_point_screen[0], start_point_screen[1] - TOOLBAR_HEIGHT)
-
-    # Ensure the start point is within the canvas bounds
-    if not (0 <= start_point_canvas[0] < drawing_surface.get_width() and \
-            0 <= start_point_canvas[1] < drawing_surface.get_height()):
-        return
-
-    # Get pixel color at start_point_canvas to determine actual target_color
-    try:
-        current_target_color_at_start = drawing_surface.get_at(start_point_canvas)[:3] # Get RGB
-    except IndexError: # Should not happen with bounds check, but good for robustness
-        return
-
-    # If the clicked color is already the fill color, do nothing
-    if current_target_color_at_start == fill_color:
-        return 
-
-    stack = [start_point_canvas] # Use canvas coordinates for the stack
-    
-    # The actual target color for the fill is the color at the starting pixel
-    actual_target_color = current_target_color_at_start
-
-    canvas_width, canvas_height = drawing_surface.get_size()
-
-    while stack:
-        x, y = stack.pop()
-
-        # Check bounds and if the pixel is the actual target color
-        if 0 <= x < canvas_width and 0 <= y < canvas_height and \
-           drawing_surface.get_at((x, y))[:3] == actual_target_color: # Compare RGB
-            
-            drawing_surface.set_at((x, y), fill_color)
-
-            # Add neighbors to stack
-            stack.append((x + 1, y))
-            stack.append((x - 1, y))
-            stack.append((x, y + 1))
-            stack.append((x, y - 1))
-
-
-running = True
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-        # Mouse button down event
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1:  # Left click
-                mouse_x, mouse_y = event.pos
-
-                # Check if a button was clicked
-                button_clicked = False
-                for button in all_buttons:
-                    if button.is_clicked(event.pos):
-                        button_clicked = True
-                        if button.action == "set_color":
-                            drawing_color = button.color
-                        elif button.action == "set_mode":
-                            drawing_mode = button.mode
-                        elif button.action == "clear_canvas":
-                            drawing_surface.fill(WHITE) # Clear the drawing surface
-                            add_to_history() # Save clear action to history
-                        elif button.action == "increase_size":
-                            brush_size = min(brush_size + 1, max_brush_size)
-                        elif button.action == "decrease_size":
-                            brush_size = max(brush_size - 1, min_brush_size)
-                        elif button.action == "set_fill_outline":
-                            fill_mode = button.mode
-                        elif button.action == "save_drawing":
-                            save_drawing()
-                        elif button.action == "undo":
-                            undo()
-                        elif button.action == "redo":
-                            redo()
-                        break # Only one button can be clicked at a time
-
-                # If no button was clicked and click is on canvas area
-                if not button_clicked and mouse_y > TOOLBAR_HEIGHT:
-                    drawing = True
-                    start_pos = event.pos # Store screen-relative start position
-                    current_pos = event.pos # Store screen-relative current position
-                    
-                    # Convert screen Y to canvas Y for drawing operations
-                    canvas_y = mouse_y - TOOLBAR_HEIGHT
-
-                    if drawing_mode == "pen":
-                        pygame.draw.circle(drawing_surface, drawing_color, (mouse_x, canvas_y), brush_size // 2) # Initial dot
-                    elif drawing_mode == "eraser":
-                        pygame.draw.circle(drawing_surface, WHITE, (mouse_x, canvas_y), brush_size // 2) # Initial dot for eraser
-                    elif drawing_mode == "fill":
-                        flood_fill(event.pos, drawing_color, drawing_color) # Pass screen coordinates for start_point
-                        add_to_history() # Save fill action to history
-                        drawing = False # Fill is a single click action
-
-
-        # Mouse motion event (dragging)
-        if event.type == pygame.MOUSEMOTION:
-            # Only draw if drawing is active and left mouse button is pressed
-            if drawing and pygame.mouse.get_pressed()[0]:
-                current_pos = event.pos # Update screen-relative current position
-                
-                # Ensure drawing only on canvas area
-                if current_pos[1] > TOOLBAR_HEIGHT: 
-                    # Convert screen coordinates to canvas coordinates for drawing
-                    prev_canvas_pos = (event.pos[0] - event.rel[0], event.pos[1] - event.rel[1] - TOOLBAR_HEIGHT)
-                    current_canvas_pos = (current_pos[0], current_pos[1] - TOOLBAR_HEIGHT)
-
-                    if drawing_mode == "pen":
-                        pygame.draw.line(drawing_surface, drawing_color, prev_canvas_pos, current_canvas_pos, brush_size)
-                    elif drawing_mode == "eraser":
-                        pygame.draw.line(drawing_surface, WHITE, prev_canvas_pos, current_canvas_pos, brush_size)
-
-        # Mouse button up event
-        if event.type == pygame.MOUSEBUTTONUP:
-            if event.button == 1:  # Left click release
-                if drawing and drawing_mode not in ["pen", "eraser", "fill"]: # Shapes are finalized on mouse up
-                    end_pos = event.pos # Screen-relative end position
-                    
-                    # Clamp end_pos to canvas boundaries if released in toolbar or outside screen
-                    if end_pos[1] < TOOLBAR_HEIGHT: end_pos = (end_pos[0], TOOLBAR_HEIGHT)
-                    if end_pos[0] < 0: end_pos = (0, end_pos[1])
-                    if end_pos[0] > SCREEN_WIDTH: end_pos = (SCREEN_WIDTH, end_pos[1])
-                    if end_pos[1] > SCREEN_HEIGHT: end_pos = (end_pos[0], SCREEN_HEIGHT)
-
-                    # Convert screen coordinates to canvas coordinates for drawing
-                    start_canvas_pos = (start_pos[0], start_pos[1] - TOOLBAR_HEIGHT)
-                    end_canvas_pos = (end_pos[0], end_pos[1] - TOOLBAR_HEIGHT)
-
-                    thickness = brush_size if fill_mode == "outline" else 0 # 0 for filled shapes
-
-                    if drawing_mode == "line":
-                        pygame.draw.line(drawing_surface, drawing_color, start_canvas_pos, end_canvas_pos, brush_size)
-                    elif drawing_mode == "rect":
-                        rect_x = min(start_canvas_pos[0], end_canvas_pos[0])
-                        rect_y = min(start_canvas_pos[1], end_canvas_pos[1])
-                        rect_width = abs(start_canvas_pos[0] - end_canvas_pos[0])
-                        rect_height = abs(start_canvas_pos[1] - end_canvas_pos[1])
-                        pygame.draw.rect(drawing_surface, drawing_color, (rect_x, rect_y, rect_width, rect_height), thickness)
-                    elif drawing_mode == "circle":
-                        center_x = (start_canvas_pos[0] + end_canvas_pos[0]) // 2
-                        center_y = (start_canvas_pos[1] + end_canvas_pos[1]) // 2
-                        radius = int(max(abs(end_canvas_pos[0] - center_x), abs(end_canvas_pos[1] - center_y)))
-                        if radius > 0: # Avoid drawing zero-radius circles
-                            pygame.draw.circle(drawing_surface, drawing_color, (center_x, center_y), radius, thickness)
-                    
-                    add_to_history() # Save shape action to history
-                    
-                # Reset drawing state for all modes after mouse up
-                drawing = False
-                start_pos = None
-                current_pos = None
-
-    screen.fill(DARK_GRAY) # Background for the entire window
-
-    # Draw the toolbar background
-    pygame.draw.rect(screen, TOOLBAR_BACKGROUND, (0, 0, SCREEN_WIDTH, TOOLBAR_HEIGHT))
-
-    # Blit the drawing surface onto the main screen (below the toolbar)
-    screen.blit(drawing_surface, (0, TOOLBAR_HEIGHT))
-
-    # Draw live preview for line, rect, circle modes
-    if drawing and start_pos and current_pos and drawing_mode not in ["pen", "eraser", "fill"]:
-        temp_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA) # Transparent surface for preview
-        temp_surface.fill((0,0,0,0)) # Ensure it's fully transparent
-        
-        preview_color = drawing_color + (100,) # Add alpha for semi-transparency
-        thickness = brush_size if fill_mode == "outline" else 0
-
-        # Convert screen-relative positions to canvas-relative for preview drawing
-        start_canvas_pos_preview = (start_pos[0], start_pos[1] - TOOLBAR_HEIGHT)
-        current_canvas_pos_preview = (current_pos[0], current_pos[1] - TOOLBAR_HEIGHT)
-
-        if drawing_mode == "line":
-            pygame.draw.line(temp_surface, preview_color, start_canvas_pos_preview, current_canvas_pos_preview, brush_size)
-        elif drawing_mode == "rect":
-            rect_x = min(start_canvas_pos_preview[0], current_canvas_pos_preview[0])
-            rect_y = min(start_canvas_pos_preview[1], current_canvas_pos_preview[1])
-            rect_width = abs(start_canvas_pos_preview[0] - current_canvas_pos_preview[0])
-            rect_height = abs(start_canvas_pos_preview[1] - current_canvas_pos_preview[1])
-            pygame.draw.rect(temp_surface, preview_color, (rect_x, rect_y, rect_width, rect_height), thickness)
-        elif drawing_mode == "circle":
-            center_x = (start_canvas_pos_preview[0] + current_canvas_pos_preview[0]) // 2
-            center_y = (start_canvas_pos_preview[1] + current_canvas_pos_preview[1]) // 2
-            radius = int(max(abs(current_canvas_pos_preview[0] - center_x), abs(current_canvas_pos_preview[1] - center_y)))
-            if radius > 0:
-                pygame.draw.circle(temp_surface, preview_color, (center_x, center_y), radius, thickness)
-        
-        screen.blit(temp_surface, (0, TOOLBAR_HEIGHT))
+def layer_index():
+    """Position of the active layer in the stack, 0 = bottom."""
+    return engine.layers.layers.index(engine.layer)
+
+def canvas_to_screen(rect):
+    """Converts a rect in canvas coordinates to the screen area showing it."""
+    return viewport.rect_to_screen(rect).clip(VIEW_RECT)
+
+def canvas_to_screen_pos(pos):
+    """Converts a canvas position to screen coordinates (the middle of the pixel when zoomed in)."""
+    x, y = viewport.to_screen(pos)
+    half_pixel = (1 << viewport.level) // 2 if viewport.level > 0 else 0
+    return (x + half_pixel, y + half_pixel)
+
+def screen_to_canvas(pos):
+    """Converts a screen position to canvas coordinates."""
+    return viewport.to_canvas(pos)
+
+def scale_to_screen(length):
+    """Converts a brush size in canvas pixels to screen pixels at the current zoom."""
+    return max(1, int(length * viewport.zoom)) if length else 0
+
+def view_changed():
+    """After panning or zooming: loads the part of a tiled canvas now in view and repaints the canvas area."""
+    if viewport.level >= 0:
+        engine.move_window(viewport.visible_rect())
+    renderer.invalidate(VIEW_RECT)
+
+def invalidate_canvas(rect):
+    """Marks a changed canvas area (as returned by the engine) for redrawing."""
+    if rect:
+        renderer.invalidate(canvas_to_screen(rect))
+
+def brush_cursor_rect(mouse_pos):
+    """Returns the screen area of the brush size preview under the mouse, or None if it isn't shown."""
+    if VIEW_RECT.collidepoint(mouse_pos) and viewport.level >= 0 and engine.mode in STROKE_MODES:
+        radius = scale_to_screen(engine.brush_size // 2)
+        return pygame.Rect(mouse_pos[0] - radius - 1, mouse_pos[1] - radius - 1, radius * 2 + 3, radius * 2 + 3)
+    return None
+
+def draw_toolbar(surface):
+    """Draws the toolbar background, buttons and the size/fill labels."""
+    pygame.draw.rect(surface, TOOLBAR_BACKGROUND, TOOLBAR_RECT)
+    for button in layer_buttons:
+        if button.action == "toggle_layer":
+            button.text = "Hide" if engine.layer.visible else "Show"
+    for button in brush_buttons:
+        if button.action == "brush_hardness":
+            button.text = f"Hard {engine.brush_hardness}"
+        elif button.action == "brush_opacity":
+            button.text = f"Alpha {round(engine.brush_opacity * 100 / 255)}"
 
     # Draw UI elements on top of everything
     for button in all_buttons:
-        button.draw(screen, drawing_mode, drawing_color, fill_mode) # Pass current drawing mode, color, and fill mode
+        button.draw(surface, engine.mode, engine.color, engine.fill_mode) # Pass current drawing mode, color, and fill mode
 
     # Draw current brush size display
-    font = pygame.font.Font(None, 24)
-    size_text = font.render(f"Size: {brush_size}", True, WHITE)
+    size_text = render_text(f"Size: {engine.brush_size}", WHITE)
     # Positioned relative to the right side of the toolbar
-    screen.blit(size_text, (SCREEN_WIDTH - size_text.get_width() - BUTTON_MARGIN, BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2 + 5))
+    surface.blit(size_text, (SCREEN_WIDTH - size_text.get_width() - BUTTON_MARGIN, BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2 + 5))
 
     # Draw current fill mode display (for shapes)
-    fill_mode_text = font.render(f"Fill: {fill_mode.capitalize()}", True, WHITE)
+    fill_mode_text = render_text(f"Fill: {engine.fill_mode.capitalize()}", WHITE)
     # Positioned below size text
-    screen.blit(fill_mode_text, (SCREEN_WIDTH - fill_mode_text.get_width() - BUTTON_MARGIN, BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2 + 5 + size_text.get_height() + 5))
-
-
-    # Draw live brush size preview on the canvas (when pen/eraser is active)
-    mouse_x, mouse_y = pygame.mouse.get_pos()
-    if mouse_y > TOOLBAR_HEIGHT and (drawing_mode == "pen" or drawing_mode == "eraser"):
-        preview_color = drawing_color if drawing_mode == "pen" else WHITE
+    surface.blit(fill_mode_text, (SCREEN_WIDTH - fill_mode_text.get_width() - BUTTON_MARGIN, BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2 + 5 + size_text.get_height() + 5))
+
+    # Active layer, in the strip below the buttons, under the selection tools
+    if engine.layers:
+        layer = engine.layer
+        layer_text = render_text(f"{layer.name} ({layer_index() + 1}/{len(engine.layers.layers)}), "
+                                 f"{round(layer.opacity * 100 / 255)}%, {layer.blend.capitalize()}", WHITE, 20)
+        surface.blit(layer_text, layer_text.get_rect(left=BUTTON_MARGIN * 8 + BUTTON_WIDTH * 7, centery=BUTTON_MARGIN * 4 + BUTTON_HEIGHT * 3 + 8))
+
+    # Save progress/result, in the strip below the buttons
+    save_status = saver.status_text()
+    if save_status:
+        status_text = render_text(save_status, WHITE, 20)
+        surface.blit(status_text, status_text.get_rect(left=BUTTON_MARGIN, centery=BUTTON_MARGIN * 4 + BUTTON_HEIGHT * 3 + 8))
+
+def toolbar_state():
+    """Everything the toolbar shows; it only needs redrawing when this changes."""
+    layer_state = None
+    if engine.layers:
+        layer_state = (layer_index(), len(engine.layers.layers), engine.layer.name, engine.layer.visible,
+                       engine.layer.opacity, engine.layer.blend)
+    return (engine.mode, engine.color, engine.fill_mode, engine.brush_size, engine.brush_hardness, engine.brush_opacity,
+            saver.status_text(), layer_state)
+
+
+def selection_look():
+    """
+    Returns (screen area, details) of what the selection tools show: the area being selected, the selection's
+    outline or the pixels being dragged. None when there is nothing to show.
+    """
+    if engine.floating is not None and engine.current_pos:
+        offset = (engine.current_pos[0] - engine.start_pos[0], engine.current_pos[1] - engine.start_pos[1])
+        rect = engine.selection.rect.move(offset)
+    elif engine.drawing and engine.mode == "select":
+        rect = pygame.Rect(engine.start_pos, (0, 0)).union(pygame.Rect(engine.current_pos, (1, 1)))
+        offset = engine.current_pos
+    elif engine.drawing and engine.mode == "lasso":
+        rect = pygame.Rect(engine.lasso[0], (1, 1)).unionall([pygame.Rect(pos, (1, 1)) for pos in engine.lasso + [engine.current_pos]])
+        offset = len(engine.lasso)
+    elif engine.selection:
+        rect = engine.selection.rect
+        offset = None
+    else:
+        return None
+    return viewport.rect_to_screen(rect).inflate(2, 2), offset
+
+def draw_selection():
+    """Draws the selection outline, the area being selected or the dragged pixels over the canvas."""
+    if engine.floating is not None and engine.current_pos:
+        screen_rect = selection_look()[0].inflate(-2, -2)
+        pixels = engine.floating if viewport.level == 0 else pygame.transform.scale(engine.floating, screen_rect.size)
+        screen.blit(pixels, screen_rect)
+        pygame.draw.rect(screen, BLACK, screen_rect.inflate(2, 2), 1)
+    elif engine.drawing and engine.mode == "lasso":
+        points = [canvas_to_screen_pos(pos) for pos in engine.lasso + [engine.current_pos]]
+        if len(points) > 1:
+            pygame.draw.lines(screen, BLACK, False, points)
+    elif engine.drawing and engine.mode == "select":
+        pygame.draw.rect(screen, BLACK, selection_look()[0], 1)
+    elif engine.selection and engine.selection.outline:
+        left, top = engine.selection.rect.topleft
+        points = [canvas_to_screen_pos((left + x, top + y)) for x, y in engine.selection.outline]
+        pygame.draw.lines(screen, BLACK, True, points)
+    elif engine.selection:
+        outline = selection_look()[0]
+        pygame.draw.rect(screen, BLACK, outline, 1)
+        pygame.draw.rect(screen, WHITE, outline.inflate(-2, -2), 1) # Shows on dark pixels too
+
+def draw_frame(area):
+    """Redraws everything inside area of the screen; the renderer has already clipped the screen to it."""
+    screen.fill(DARK_GRAY, area) # Background for the entire window
+
+    if area.colliderect(TOOLBAR_RECT):
+        with profiler.span("toolbar"):
+            screen.blit(toolbar.get(toolbar_state()), TOOLBAR_RECT)
+
+    # Draw the visible part of the canvas onto the main screen (below the toolbar)
+    canvas_area = viewport.rect_to_canvas(area.clip(VIEW_RECT)).clip((0, 0) + engine.size)
+    if canvas_area.width and canvas_area.height:
+        dest = viewport.rect_to_screen(canvas_area)
+        if viewport.level < 0:
+            engine.tiles.draw_zoomed(screen, dest.topleft, canvas_area, -viewport.level)
+        else:
+            # Zoomed in (or 1:1) the view is always inside the window being edited
+            window_area = canvas_area.move(-engine.origin[0], -engine.origin[1])
+            if viewport.level == 0:
+                screen.blit(engine.image, dest, window_area)
+            else:
+                screen.blit(pygame.transform.scale(engine.image.subsurface(window_area), dest.size), dest)
+
+    if preview.rect and area.colliderect(preview.rect):
+        with profiler.span("preview"):
+            preview.draw(screen)
+
+    if last_selection_look and area.colliderect(last_selection_look[0]):
+        screen.set_clip(area.clip(VIEW_RECT)) # Dragged pixels may stick out of the canvas area
+        draw_selection()
+        screen.set_clip(area)
+
+    # Draw live brush size preview on the canvas (when pen/eraser/brush is active)
+    if last_cursor_rect and area.colliderect(last_cursor_rect):
+        mouse_x, mouse_y = last_cursor_rect.center
+        preview_color = engine.background if engine.mode == "eraser" else engine.color
         # Draw a semi-transparent circle for the preview
-        pygame.draw.circle(screen, preview_color + (150,), (mouse_x, mouse_y), brush_size // 2, 0)
-
-
-    pygame.display.flip() # Update the full display surface
-
-pygame.quit()
-sys.exit()
+        pygame.draw.circle(screen, preview_color + (150,), (mouse_x, mouse_y), scale_to_screen(engine.brush_size // 2), 0)
+
+    if hud_lines and area.colliderect(HUD_RECT):
+        screen.fill(DARK_GRAY, HUD_RECT)
+        for i, line in enumerate(hud_lines):
+            screen.blit(render_text(line, WHITE, 20), (HUD_RECT.x + 8, HUD_RECT.y + 6 + i * 19))
+
+if __name__ == "__main__": # Not when a worker process imports this file, e.g. for the exporter's pool
+    pygame.init()
+
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("Drawing App")
+
+    # The canvas, tools and history live in the engine; this file is the window around it
+    # With a tiled canvas only a window of it, the view plus a tile around it, is edited at a time
+    engine = DrawingEngine(CANVAS_SIZE or VIEW_RECT.size, WHITE, HISTORY_TILE_SIZE, HISTORY_MAX_BYTES,
+                           FILL_TOLERANCE, FILL_CONNECTIVITY, STROKE_SPACING, STROKE_SMOOTHING, record=bool(RECORD_SESSION),
+                           window_size=(VIEW_RECT.width + 2 * TILE_SIZE, VIEW_RECT.height + 2 * TILE_SIZE),
+                           tile_size=TILE_SIZE, max_resident_tiles=MAX_RESIDENT_TILES)
+    # Mouse wheel zooms, dragging with the middle button pans. Zoomed out (tiled canvas only) is for looking around, not drawing
+    viewport = Viewport(VIEW_RECT, engine.size, min_level=-6 if engine.tiles else 0)
+    # Joins a shared canvas; the server has the drawing, so it replaces the journal. Not for tiled canvases
+    COLLAB_UPDATE = pygame.event.custom_type() # Posted by the network thread so an idle loop wakes up to show others' changes
+    collab = None
+    if COLLAB_SERVER and not engine.tiles:
+        host, port = COLLAB_SERVER.rsplit(":", 1)
+        collab = CollabClient(host, int(port), engine.size, HISTORY_TILE_SIZE, COLLAB_UPDATE)
+        if collab.error:
+            print(f"Couldn't join {COLLAB_SERVER}: {collab.error}")
+            collab = None
+        else:
+            engine.take_changes() # Start collecting
+    # Picks up the drawing, layers and undo history where the last session (or crash) left them. Not for tiled canvases
+    journal = Journal(JOURNAL_FILE, engine, JOURNAL_CHECKPOINT_EVERY) if JOURNAL_FILE and not engine.tiles and not collab else None
+    engine.journal = journal
+    if journal and journal.error:
+        print(f"Couldn't restore the drawing from {JOURNAL_FILE} ({journal.error}); it was moved to {JOURNAL_FILE}.old")
+    elif journal and journal.recovered:
+        print(f"Restored the drawing from {JOURNAL_FILE}, replaying {journal.recovered} commands after its last checkpoint")
+
+    # Off, the spans in the engine, renderer and main loop cost next to nothing
+    profiler = Profiler(PROFILE or SHOW_HUD or bool(TRACE_FILE), trace=bool(TRACE_FILE))
+    engine.profiler = profiler
+    renderer = DirtyRectRenderer(screen, FULL_REDRAW, profiler=profiler)
+    preview = PreviewOverlay(VIEW_RECT) # Shape previews stay over the canvas
+    last_cursor_rect = None # Screen area of the brush cursor as last drawn
+    last_selection_look = None # What the selection outline looked like, and where, as last drawn
+    scheduler = FrameScheduler(TARGET_FPS)
+    last_stats_update = 0
+    HUD_RECT = pygame.Rect(VIEW_RECT.right - 268, VIEW_RECT.top + 8, 260, 66) # Top right corner of the canvas area
+    hud_lines = [] # What the HUD shows, updated once a second
+    SAVE_DONE = pygame.event.custom_type() # Posted by the save thread so an idle loop wakes up to show the result
+    saver = BackgroundSaver(SAVE_DONE)
+    exporter = Exporter(EXPORT_OUTPUTS) if EXPORT_OUTPUTS else None
+    autosaver = AutoSaver(AUTOSAVE_INTERVAL, engine.history.version)
+
+    # Create Buttons 
+
+    #Row 1
+    color_buttons = []
+    colors = [BLACK, WHITE, RED, GREEN, BLUE, YELLOW, PURPLE, ORANGE, CYAN]
+    start_x_colors = BUTTON_MARGIN
+    for i, color in enumerate(colors):
+        btn = Button(start_x_colors + i * (BUTTON_WIDTH + BUTTON_MARGIN),
+                     BUTTON_MARGIN, # Y position for first row
+                     BUTTON_WIDTH, BUTTON_HEIGHT,
+                     "", color, action="set_color")
+        color_buttons.append(btn)
+
+    #Row 2: Tool buttons
+    tool_buttons = []
+    tool_names = ["Pen", "Line", "Rect", "Circle", "Eraser", "Fill"]
+    modes = ["pen", "line", "rect", "circle", "eraser", "fill"]
+    start_x_tools = BUTTON_MARGIN
+    for i, (name, mode) in enumerate(zip(tool_names, modes)):
+        btn = Button(start_x_tools + i * (BUTTON_WIDTH + BUTTON_MARGIN),
+                     BUTTON_MARGIN * 2 + BUTTON_HEIGHT, # Y position for second row
+                     BUTTON_WIDTH, BUTTON_HEIGHT,
+                     name, LIGHT_GRAY, BLACK, action="set_mode", mode=mode)
+        tool_buttons.append(btn)
+
+    #Row 3: Utility buttons (Size, Fill, Undo, Redo, Save, Clear)
+    utility_buttons = []
+    # Size Down
+    utility_buttons.append(Button(BUTTON_MARGIN,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Size -", LIGHT_GRAY, BLACK, action="decrease_size"))
+    # Size Up
+    utility_buttons.append(Button(BUTTON_MARGIN * 2 + BUTTON_WIDTH,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Size +", LIGHT_GRAY, BLACK, action="increase_size"))
+
+    # Fill/Outline Toggle - now two separate buttons for clarity
+    utility_buttons.append(Button(BUTTON_MARGIN * 3 + BUTTON_WIDTH * 2,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Outline", LIGHT_GRAY, BLACK, action="set_fill_outline", mode="outline"))
+    utility_buttons.append(Button(BUTTON_MARGIN * 4 + BUTTON_WIDTH * 3,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Fill", LIGHT_GRAY, BLACK, action="set_fill_outline", mode="fill"))
+
+    # Undo button
+    utility_buttons.append(Button(BUTTON_MARGIN * 5 + BUTTON_WIDTH * 4,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Undo", LIGHT_GRAY, BLACK, action="undo"))
+    # Redo button
+    utility_buttons.append(Button(BUTTON_MARGIN * 6 + BUTTON_WIDTH * 5,
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Redo", LIGHT_GRAY, BLACK, action="redo"))
+    # Save button
+    utility_buttons.append(Button(BUTTON_MARGIN * 7 + BUTTON_WIDTH * 6, # Adjusted X for Save
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Save", GREEN, WHITE, action="save_drawing"))
+    # Clear button
+    utility_buttons.append(Button(SCREEN_WIDTH - BUTTON_WIDTH - BUTTON_MARGIN, # Align to right
+                                  BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                                  BUTTON_WIDTH, BUTTON_HEIGHT,
+                                  "Clear", RED, WHITE, action="clear_canvas"))
+
+    #Row 2, after the tools: Layer buttons (a tiled canvas has a single layer, so none there)
+    layer_buttons = []
+    layer_names = ["+ Layer", "- Layer", "Next", "Hide", "Opacity", "Blend"]
+    layer_actions = ["add_layer", "delete_layer", "next_layer", "toggle_layer", "layer_opacity", "layer_blend"]
+    if engine.layers:
+        for i, (name, action) in enumerate(zip(layer_names, layer_actions)):
+            btn = Button(start_x_tools + (len(tool_buttons) + i) * (BUTTON_WIDTH + BUTTON_MARGIN),
+                         BUTTON_MARGIN * 2 + BUTTON_HEIGHT, # Y position for second row
+                         BUTTON_WIDTH, BUTTON_HEIGHT,
+                         name, LIGHT_GRAY, BLACK, action=action, text_size=20)
+            layer_buttons.append(btn)
+
+    #Row 1, after the colors: Soft brush tool and its hardness and opacity
+    brush_buttons = []
+    brush_names = ["Brush", "Hard", "Alpha"]
+    brush_actions = ["set_mode", "brush_hardness", "brush_opacity"]
+    for i, (name, action) in enumerate(zip(brush_names, brush_actions)):
+        btn = Button(start_x_colors + (len(color_buttons) + i) * (BUTTON_WIDTH + BUTTON_MARGIN),
+                     BUTTON_MARGIN, # Y position for first row
+                     BUTTON_WIDTH, BUTTON_HEIGHT,
+                     name, LIGHT_GRAY, BLACK, action=action, mode="brush" if action == "set_mode" else None, text_size=20)
+        brush_buttons.append(btn)
+
+    #Row 3, after Save: Selection tools. Drag inside a selection to move it
+    select_buttons = []
+    for i, (name, mode) in enumerate(zip(["Select", "Lasso"], SELECT_MODES)):
+        btn = Button(BUTTON_MARGIN * (8 + i) + BUTTON_WIDTH * (7 + i),
+                     BUTTON_MARGIN * 3 + BUTTON_HEIGHT * 2, # Y position for third row
+                     BUTTON_WIDTH, BUTTON_HEIGHT,
+                     name, LIGHT_GRAY, BLACK, action="set_mode", mode=mode)
+        select_buttons.append(btn)
+
+    all_buttons = color_buttons + tool_buttons + utility_buttons + layer_buttons + brush_buttons + select_buttons
+
+    toolbar = ToolbarCache(TOOLBAR_RECT.size, draw_toolbar)
+    last_toolbar_state = toolbar_state()
+
+    running = True
+    while running:
+        # Blocks while idle; with changes waiting, only until the next frame is due
+        events = scheduler.wait_events(renderer.has_damage() or engine.stroke.has_pending()
+                                       or (collab and not engine.drawing and collab.has_updates()))
+        events_start = profiler.now()
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+
+            # The window was uncovered or restored, its contents may be gone
+            if event.type in (pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED):
+                renderer.invalidate()
+
+            # Mouse button down event
+            if event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 1:  # Left click
+                    mouse_x, mouse_y = event.pos
+
+                    # Check if a button was clicked
+                    button_clicked = False
+                    for button in all_buttons:
+                        if button.is_clicked(event.pos):
+                            button_clicked = True
+                            if button.action == "set_color":
+                                engine.set_color(button.color)
+                            elif button.action == "set_mode":
+                                engine.set_mode(button.mode)
+                            elif button.action == "clear_canvas":
+                                invalidate_canvas(engine.clear()) # Clear the drawing surface
+                            elif button.action == "increase_size":
+                                engine.set_brush_size(min(engine.brush_size + 1, MAX_BRUSH_SIZE))
+                            elif button.action == "decrease_size":
+                                engine.set_brush_size(max(engine.brush_size - 1, MIN_BRUSH_SIZE))
+                            elif button.action == "set_fill_outline":
+                                engine.set_fill_mode(button.mode)
+                            elif button.action == "save_drawing":
+                                save_drawing()
+                            elif button.action == "undo":
+                                undo()
+                            elif button.action == "redo":
+                                redo()
+                            elif button.action == "add_layer":
+                                engine.add_layer()
+                            elif button.action == "delete_layer":
+                                invalidate_canvas(engine.delete_layer())
+                            elif button.action == "next_layer":
+                                engine.select_layer((layer_index() + 1) % len(engine.layers.layers))
+                            elif button.action == "toggle_layer":
+                                invalidate_canvas(engine.set_layer_visible(layer_index(), not engine.layer.visible))
+                            elif button.action == "layer_opacity":
+                                steps = LAYER_OPACITY_STEPS
+                                next_opacity = steps[(steps.index(engine.layer.opacity) + 1) % len(steps)] if engine.layer.opacity in steps else steps[0]
+                                invalidate_canvas(engine.set_layer_opacity(layer_index(), next_opacity))
+                            elif button.action == "brush_hardness":
+                                steps = BRUSH_HARDNESS_STEPS
+                                engine.set_brush_hardness(steps[(steps.index(engine.brush_hardness) + 1) % len(steps)] if engine.brush_hardness in steps else steps[0])
+                            elif button.action == "brush_opacity":
+                                steps = BRUSH_OPACITY_STEPS
+                                engine.set_brush_opacity(steps[(steps.index(engine.brush_opacity) + 1) % len(steps)] if engine.brush_opacity in steps else steps[0])
+                            elif button.action == "layer_blend":
+                                next_blend = BLEND_MODES[(BLEND_MODES.index(engine.layer.blend) + 1) % len(BLEND_MODES)]
+                                invalidate_canvas(engine.set_layer_blend(layer_index(), next_blend))
+                            break # Only one button can be clicked at a time
+
+                    # If no button was clicked and click is on canvas area
+                    if not button_clicked and mouse_y > TOOLBAR_HEIGHT and viewport.level >= 0:
+                        invalidate_canvas(engine.press(screen_to_canvas(event.pos)))
+
+            if event.type == pygame.MOUSEWHEEL and not engine.drawing:
+                if VIEW_RECT.collidepoint(pygame.mouse.get_pos()) and viewport.zoom_at(pygame.mouse.get_pos(), event.y):
+                    view_changed()
+
+            # Mouse motion event (dragging)
+            if event.type == pygame.MOUSEMOTION:
+                # Only draw if drawing is active and left mouse button is pressed
+                if engine.drawing and pygame.mouse.get_pressed()[0]:
+                    engine.drag(screen_to_canvas(event.pos))
+                elif not engine.drawing and event.buttons[1] and viewport.pan(*event.rel): # Middle button held
+                    view_changed()
+
+            # Mouse button up event
+            if event.type == pygame.MOUSEBUTTONUP:
+                if event.button == 1:  # Left click release
+                    # Shapes are finalized and strokes saved to history on mouse up
+                    invalidate_canvas(engine.release(screen_to_canvas(event.pos)))
+
+            # Selection keys: Delete erases it, Escape drops it, Ctrl+C copies it, Ctrl+V pastes at the mouse
+            if event.type == pygame.KEYDOWN and not engine.drawing:
+                if event.key in (pygame.K_DELETE, pygame.K_BACKSPACE):
+                    invalidate_canvas(engine.delete_selection())
+                elif event.key == pygame.K_ESCAPE and engine.selection:
+                    engine.deselect()
+                elif event.key == pygame.K_c and event.mod & pygame.KMOD_CTRL:
+                    engine.copy_selection()
+                elif event.key == pygame.K_v and event.mod & pygame.KMOD_CTRL and engine.clipboard and viewport.level >= 0:
+                    mouse_pos = pygame.mouse.get_pos()
+                    if engine.mode not in SELECT_MODES:
+                        engine.set_mode("select") # So the pasted pixels can be dragged into place
+                    paste_pos = screen_to_canvas(mouse_pos) if VIEW_RECT.collidepoint(mouse_pos) else viewport.visible_rect().topleft
+                    invalidate_canvas(engine.paste(paste_pos))
+        profiler.add("events", events_start)
+
+        # Work out which parts of the window changed this frame
+        if toolbar_state() != last_toolbar_state: # Highlights or labels changed
+            renderer.invalidate(TOOLBAR_RECT)
+            last_toolbar_state = toolbar_state()
+
+        # Live preview for line, rect, circle modes; draw_selection shows selecting and moving
+        if engine.drawing and engine.mode not in STROKE_MODES + SELECT_MODES + ("fill",):
+            preview_color = engine.color + (100,) # Add alpha for semi-transparency
+            preview_damage = preview.show(engine.mode, canvas_to_screen_pos(engine.start_pos), canvas_to_screen_pos(engine.current_pos),
+                                          preview_color, scale_to_screen(engine.brush_size), scale_to_screen(engine.thickness))
+        else:
+            preview_damage = preview.hide()
+        if preview_damage: # Covers both where the old preview was and where the new one is
+            renderer.invalidate(preview_damage)
+
+        cursor_rect = brush_cursor_rect(pygame.mouse.get_pos())
+        if cursor_rect != last_cursor_rect:
+            for rect in (last_cursor_rect, cursor_rect):
+                if rect:
+                    renderer.invalidate(rect)
+            last_cursor_rect = cursor_rect
+
+        look = selection_look()
+        if look != last_selection_look:
+            for shown in (last_selection_look, look):
+                if shown:
+                    renderer.invalidate(shown[0])
+            last_selection_look = look
+
+        if scheduler.frame_due():
+            invalidate_canvas(engine.flush()) # One batched stroke draw for all the motion since the last frame
+            if collab:
+                collab.send(engine.take_changes()) # Everything this frame changed, the stroke in progress too, in one message
+                if not engine.drawing: # Others' changes wait for the stroke in progress, which would paint over them
+                    invalidate_canvas(engine.write_tiles(collab.receive()))
+            if renderer.present(draw_frame): # Redraw and update only the damaged areas
+                scheduler.presented()
+                profiler.frame(scheduler.last_frame_ms)
+
+        if not engine.drawing and autosaver.due(engine.history.version): # Not in the middle of a stroke
+            save_drawing(f"{SAVE_NAME}_autosave.png", export=False)
+
+        if journal and not engine.drawing and journal.checkpoint_due():
+            with profiler.span("checkpoint"):
+                journal.checkpoint(engine)
+
+        if (SHOW_FRAME_STATS or SHOW_HUD) and pygame.time.get_ticks() - last_stats_update >= 1000:
+            if SHOW_FRAME_STATS:
+                pygame.display.set_caption(f"Drawing App - {scheduler.frame_time_ms:.1f} ms/frame, {scheduler.fps:.0f} FPS")
+            if SHOW_HUD and profiler.hud_lines(scheduler.fps, engine.history.bytes_used) != hud_lines:
+                hud_lines = profiler.hud_lines(scheduler.fps, engine.history.bytes_used)
+                renderer.invalidate(HUD_RECT)
+            last_stats_update = pygame.time.get_ticks()
+
+    saver.wait() # Let saves still in progress finish before exiting
+    if exporter:
+        exporter.close()
+    if journal:
+        journal.close()
+    if collab:
+        collab.close()
+
+    if RECORD_SESSION:
+        with open(RECORD_SESSION, "w") as f:
+            json.dump(engine.recording, f)
+
+    if profiler.enabled:
+        print(profiler.summary())
+    if TRACE_FILE:
+        profiler.export_trace(TRACE_FILE)
+        print(f"Trace written to {TRACE_FILE}")
+
+    pygame.quit()
+    sys.exit()
 
 
 
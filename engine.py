@@ -0,0 +1,596 @@
+"""
+Headless drawing core: the canvas, its tools, undo history and saving.
+
+Nothing here opens a window, so the engine can run against an offscreen surface
+(e.g. under SDL_VIDEODRIVER=dummy) for tests and benchmarks. drawingApp.py
+feeds it mouse input already converted to canvas coordinates and takes care of
+the toolbar, previews and presenting.
+
+Given a window_size smaller than the canvas, the canvas is tiled (see
+tiledcanvas.py) and self.surface is only the window being edited; positions
+and returned rects stay in canvas coordinates either way.
+
+Otherwise the canvas has layers (see layers.py): the tools draw on the active
+layer's surface, self.surface, and self.image is the flattened picture that is
+shown and saved. A tiled canvas has a single layer, self.image is its window.
+
+Every input is also a command, a plain list such as ["press", 120, 40] or
+["color", [255, 0, 0]], so a session can be recorded and replayed exactly:
+
+    engine = DrawingEngine((800, 600), record=True)
+    ...
+    commands = engine.recording
+    DrawingEngine((800, 600)).replay(commands)
+"""
+import pygame
+
+from brush import Brush
+from floodfill import flood_fill
+from history import TileHistory
+from layers import LayerStack
+from overlay import draw_shape
+from profiler import Profiler
+from selection import lasso_selection, paste, rect_selection, selection_from_state
+from stroke import StrokeBuffer
+from tiledcanvas import TiledCanvas
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+MIN_BRUSH_SIZE = 1
+MAX_BRUSH_SIZE = 20
+
+STROKE_MODES = ("pen", "eraser", "brush") # Tools that draw along the mouse path
+SELECT_MODES = ("select", "lasso")
+
+
+class DrawingEngine:
+    def __init__(self, size, background=WHITE, history_tile_size=64, history_max_bytes=32 * 1024 * 1024,
+                 fill_tolerance=0, fill_connectivity=4, stroke_spacing=2, stroke_smoothing=False, record=False,
+                 window_size=None, tile_size=256, max_resident_tiles=64):
+        self.background = background
+        if window_size and (window_size[0] < size[0] or window_size[1] < size[1]):
+            self.tiles = TiledCanvas(size, window_size, background, tile_size, max_resident_tiles)
+            self.surface = self.tiles.window
+            self.image = self.surface
+            self.size = self.tiles.size # Rounded up to whole tiles
+            self.layers = None
+            self.layer = None
+        else:
+            self.tiles = None
+            self.layers = LayerStack(size, background)
+            self.layer = self.layers.add() # The active layer
+            self.surface = self.layer.surface
+            self.image = self.layers.composite
+            self.size = tuple(size)
+
+        self.color = BLACK
+        self.mode = "pen"
+        self.brush_size = 2
+        self.brush_hardness = 100 # Soft brush: 100 = solid with an antialiased edge, 0 = fades out from the centre
+        self.brush_opacity = 255 # Soft brush: opacity of a whole stroke
+        self.fill_mode = "outline"
+        self.fill_tolerance = fill_tolerance
+        self.fill_connectivity = fill_connectivity
+
+        # State of the drag in progress
+        self.drawing = False
+        self.start_pos = None
+        self.current_pos = None
+        self.stroke = StrokeBuffer(stroke_spacing, stroke_smoothing)
+        self.stroke_rect = None # Canvas area touched by the current pen/eraser/brush stroke
+        self.unshared_rect = None # Part of stroke_rect drawn since the last take_changes
+        self.brush = Brush()
+        self.selection = None # selection.Selection of the select/lasso tools, in canvas coordinates
+        self.lasso = [] # Path of the lasso being drawn
+        self.floating = None # The selection's pixels, lifted off the canvas while it is dragged
+        self.clipboard = None # (pixels, Selection) from copy_selection
+
+        self.history = TileHistory(self.surface, history_tile_size, history_max_bytes)
+        if self.tiles:
+            self.history.write_outside = self.tiles.write_tile
+        self.recording = [] if record else None
+        self.journal = None # A journal.Journal that gets every command as well
+        self.profiler = Profiler() # Disabled; replace it with an enabled one to time the tools
+
+    def _record(self, *command):
+        if self.recording is not None:
+            self.recording.append(list(command))
+        if self.journal is not None:
+            self.journal.append(command)
+
+    # Tool settings
+
+    def set_color(self, color):
+        self.color = tuple(pygame.Color(color))[:3] # RGB; any alpha is dropped, strokes are opaque
+        self._record("color", list(self.color))
+
+    def set_mode(self, mode):
+        self._record("mode", mode)
+        self.mode = mode
+        if mode not in SELECT_MODES:
+            self.selection = None # The other tools don't keep to it, so don't suggest they do
+
+    # Values are clamped before they are recorded, so recordings and the journal only hold ones that fit
+
+    def set_brush_size(self, size):
+        self.brush_size = max(MIN_BRUSH_SIZE, min(int(size), MAX_BRUSH_SIZE))
+        self._record("size", self.brush_size)
+
+    def set_brush_hardness(self, hardness):
+        self.brush_hardness = max(0, min(int(hardness), 100))
+        self._record("hardness", self.brush_hardness)
+
+    def set_brush_opacity(self, opacity):
+        self.brush_opacity = max(0, min(int(opacity), 255))
+        self._record("brush_opacity", self.brush_opacity)
+
+    def set_fill_mode(self, fill_mode):
+        self._record("fill_mode", fill_mode)
+        self.fill_mode = fill_mode
+
+    @property
+    def origin(self):
+        """Canvas position of self.surface's top-left corner."""
+        return self.tiles.origin if self.tiles else (0, 0)
+
+    def _to_surface(self, pos):
+        origin = self.origin
+        return (pos[0] - origin[0], pos[1] - origin[1])
+
+    @property
+    def bounds(self):
+        """Canvas area of self.surface (on a tiled canvas, of the window being edited)."""
+        return pygame.Rect(self.origin, self.surface.get_size()).clip((0, 0), self.size)
+
+    def _changed(self, rect):
+        """Takes a Rect changed on self.surface (or None) and returns it in canvas coordinates."""
+        if not rect:
+            return None
+        with self.profiler.span("composite"):
+            if self.tiles:
+                self.tiles.mark_changed(rect)
+            else:
+                self.layers.changed(self.layer, rect) # Recomposite just the changed area
+        return rect.move(self.origin)
+
+    @property
+    def thickness(self):
+        """Outline width for rects and circles; 0 draws them filled."""
+        return self.brush_size if self.fill_mode == "outline" else 0
+
+    @property
+    def blank_color(self):
+        """What erased pixels become: transparent on a layer, the background on a tiled canvas."""
+        return (0, 0, 0, 0) if self.layers else self.background
+
+    @property
+    def stroke_color(self):
+        return self.color if self.mode == "pen" else self.blank_color
+
+    # Mouse input, in canvas coordinates. Each returns the canvas Rect it changed, or None.
+
+    def press(self, pos):
+        """Left button pressed on the canvas."""
+        self._record("press", *pos)
+        self.drawing = True
+        self.start_pos = pos
+        self.current_pos = pos
+
+        if self.mode in STROKE_MODES:
+            self.stroke.begin(self._to_surface(pos)) # The initial dot is drawn by the next flush()
+            if self.mode == "brush":
+                self.brush.begin(self.surface, self.brush_size, self.brush_hardness / 100, self.color, self.brush_opacity)
+        elif self.mode == "fill":
+            self.drawing = False # Fill is a single click action
+            # On a tiled canvas the fill stops at the edges of the window
+            with self.profiler.span("fill"):
+                filled_rect = flood_fill(self.surface, self._to_surface(pos), self.color, self.fill_tolerance, self.fill_connectivity)
+            if filled_rect:
+                self._commit(filled_rect)
+            return self._changed(filled_rect)
+        elif self.mode in SELECT_MODES:
+            if self.selection and self.selection.contains(pos):
+                # Dragging the selection: its pixels move into a buffer the size of the selection, nothing bigger
+                self.floating = self.selection.copy_pixels(self.surface, self.origin)
+                self.selection.erase(self.surface, self.blank_color, self.origin)
+                return self._changed(self.selection.rect.move(-self.origin[0], -self.origin[1]))
+            self.selection = None
+            self.lasso = [pos]
+        return None
+
+    def drag(self, pos):
+        """Mouse moved with the left button held."""
+        if not self.drawing:
+            return None
+        self._record("drag", *pos)
+        self.current_pos = pos
+        # Ensure drawing only on canvas area
+        if pos[1] > 0 and self.mode in STROKE_MODES:
+            self.stroke.add(self._to_surface(pos)) # Samples are only collected here, see flush()
+        elif self.mode == "lasso" and self.floating is None:
+            self.lasso.append(pos)
+        return None
+
+    def flush(self):
+        """Draws the pen/eraser/brush samples gathered since the last call; the app calls this once per frame."""
+        if not self.stroke.has_pending():
+            return None
+        self._record("flush") # How samples were batched affects the joins, so replay needs it
+        return self._draw_stroke()
+
+    def _commit(self, rect=None):
+        with self.profiler.span("history"):
+            self.history.commit(rect)
+
+    def _draw_stroke(self):
+        with self.profiler.span("stroke"):
+            if self.mode == "brush":
+                points = self.stroke.take()
+                rect = self.brush.stamp(points) if points else None
+            else:
+                rect = self.stroke.flush(self.surface, self.stroke_color, self.brush_size)
+        if rect:
+            self.stroke_rect = rect if self.stroke_rect is None else self.stroke_rect.union(rect)
+            self.unshared_rect = rect if self.unshared_rect is None else self.unshared_rect.union(rect)
+        return self._changed(rect)
+
+    def release(self, pos):
+        """Left button released; finishes the shape or stroke and saves it to history."""
+        if not self.drawing:
+            return None
+        self._record("release", *pos)
+        changed = None
+
+        if self.mode in STROKE_MODES:
+            self.stroke.end()
+            changed = self._draw_stroke()
+            if self.mode == "brush":
+                self.brush.end()
+            if self.stroke_rect:
+                self._commit(self.stroke_rect) # Strokes are saved once the mouse is released
+        elif self.mode in SELECT_MODES:
+            changed = self._release_selection(pos)
+        else:
+            # Clamp the end to the canvas if released outside it
+            width, height = self.size
+            end_pos = (min(max(pos[0], 0), width), min(max(pos[1], 0), height))
+            with self.profiler.span("shape"):
+                changed = draw_shape(self.surface, self.mode, self._to_surface(self.start_pos), self._to_surface(end_pos),
+                                     self.color, self.brush_size, self.thickness)
+            if changed:
+                self._commit(changed)
+            changed = self._changed(changed)
+
+        # Reset drawing state for all modes after mouse up
+        self.drawing = False
+        self.start_pos = None
+        self.current_pos = None
+        self.stroke_rect = None
+        self.unshared_rect = None # The commit has it
+        return changed
+
+    def _release_selection(self, pos):
+        if self.floating is None:
+            if self.mode == "select":
+                self.selection = rect_selection(self.start_pos, pos, self.bounds)
+            else:
+                self.selection = lasso_selection(self.lasso + [pos], self.bounds)
+            self.lasso = []
+            return None # Selecting doesn't change the canvas
+
+        # Drop the dragged pixels; only where they came from and where they land changed
+        source = self.selection.rect.move(-self.origin[0], -self.origin[1])
+        moved = self.selection.moved(pos[0] - self.start_pos[0], pos[1] - self.start_pos[1])
+        with self.profiler.span("selection"):
+            target = paste(self.floating, self.surface, self._to_surface(moved.rect.topleft))
+        self.floating = None
+        self.selection = moved.clipped(self.bounds)
+        self._commit([source, target] if target else [source])
+        return self._changed(target)
+
+    # Selection; each returns the canvas Rect it changed, or None
+
+    def delete_selection(self):
+        """Erases the selected pixels."""
+        if not self.selection or self.drawing:
+            return None
+        self._record("delete_selection")
+        self.selection.erase(self.surface, self.blank_color, self.origin)
+        rect = self.selection.rect.move(-self.origin[0], -self.origin[1])
+        self._commit(rect)
+        return self._changed(rect)
+
+    def deselect(self):
+        self._record("deselect")
+        self.selection = None
+        return None
+
+    def copy_selection(self):
+        """Copies the selected pixels of the active layer for paste()."""
+        if not self.selection:
+            return None
+        self._record("copy_selection")
+        self.clipboard = (self.selection.copy_pixels(self.surface, self.origin), self.selection)
+        return None
+
+    def paste(self, pos):
+        """Draws the copied pixels with their top-left at canvas position pos and selects them."""
+        if not self.clipboard or self.drawing:
+            return None
+        self._record("paste", *pos)
+        pixels, shape = self.clipboard
+        with self.profiler.span("selection"):
+            target = paste(pixels, self.surface, self._to_surface(pos))
+        if not target:
+            return None
+        self.selection = shape.moved(pos[0] - shape.rect.x, pos[1] - shape.rect.y).clipped(self.bounds)
+        self._commit(target)
+        return self._changed(target)
+
+    # Whole canvas actions
+
+    def clear(self):
+        self._record("clear")
+        if self.tiles:
+            # Every tile is dropped at once; recording that in the history would mean copying all of them
+            self.tiles.clear()
+            self.history.reset()
+        else:
+            self.surface.fill((0, 0, 0, 0)) # Only the active layer
+            self._commit()
+            self.layers.cleared(self.layer)
+        return pygame.Rect((0, 0), self.size)
+
+    def _restored(self, rect):
+        """Marks the part of an undone/redone canvas area that is in the window (or composite) as changed."""
+        if rect and self.tiles:
+            self.tiles.mark_changed(rect.move(-self.origin[0], -self.origin[1]))
+        elif rect:
+            layer = next(layer for layer in self.layers.layers if layer.surface is self.history.last_surface)
+            self.layers.changed(layer, rect)
+        return rect
+
+    def undo(self):
+        """Reverts the last action. Returns the restored canvas Rect, or None if there was nothing to undo."""
+        self._record("undo")
+        with self.profiler.span("undo"):
+            return self._restored(self.history.undo())
+
+    def redo(self):
+        """Reapplies the last undone action. Returns the restored canvas Rect, or None if there was nothing to redo."""
+        self._record("redo")
+        with self.profiler.span("redo"):
+            return self._restored(self.history.redo())
+
+    def move_window(self, rect):
+        """
+        On a tiled canvas, makes sure the canvas area rect (normally the part in view) is in the window being
+        edited. Returns True if the window moved. Does nothing in the middle of a stroke or shape.
+        """
+        if not self.tiles or self.drawing or not self.tiles.move_window(rect):
+            return False
+        self._record("window", *pygame.Rect(rect)) # Where the window is decides how far a fill can spread
+        self.history.rebase(self.tiles.origin)
+        self.selection = None # It has to stay inside the window
+        return True
+
+    def snapshot(self):
+        """
+        Returns a function that writes the canvas, as it is now, to an image file (format from the extension).
+        Later drawing doesn't affect it, so it can be called on another thread.
+        """
+        if self.tiles:
+            return self.tiles.snapshot().write_png # Streamed tile by tile; a tiled canvas is always saved as PNG
+        pixels = pygame.image.tobytes(self.image, "RGB")
+        size = self.image.get_size()
+        return lambda filename: pygame.image.save(pygame.image.frombytes(pixels, size, "RGB"), filename)
+
+    def save(self, filename):
+        """Writes the canvas to an image file (format from the extension)."""
+        self._record("save", filename)
+        if self.tiles:
+            self.snapshot()(filename)
+        else:
+            pygame.image.save(self.image, filename)
+
+    # Layers; these do nothing on a tiled canvas. Each returns the canvas Rect to repaint, or None.
+
+    def _select(self, layer):
+        self.layer = layer
+        self.surface = layer.surface
+        self.history.set_surface(self.surface)
+
+    def add_layer(self):
+        """Adds an empty layer above the active one and makes it active."""
+        if not self.layers:
+            return None
+        self._record("layer_add")
+        self._select(self.layers.add(self.layers.layers.index(self.layer) + 1))
+        return None # Nothing to see until something is drawn on it
+
+    def delete_layer(self):
+        """Deletes the active layer (not the last one left) and its history; the one below becomes active."""
+        if not self.layers or len(self.layers.layers) == 1:
+            return None
+        self._record("layer_delete")
+        index = self.layers.layers.index(self.layer)
+        old = self.layer
+        self.layers.remove(old)
+        self._select(self.layers.layers[max(index - 1, 0)])
+        self.history.forget(old.surface) # Deleting a layer can't be undone, so neither can what was drawn on it
+        return pygame.Rect((0, 0), self.size)
+
+    def select_layer(self, index):
+        """Makes layer index (0 = bottom) the one the tools draw on."""
+        if not self.layers:
+            return None
+        self._record("layer_select", index)
+        self._select(self.layers.layers[index])
+        return None
+
+    def set_layer_visible(self, index, visible):
+        if not self.layers:
+            return None
+        self._record("layer_visible", index, visible)
+        self.layers.set_visible(self.layers.layers[index], visible)
+        return pygame.Rect((0, 0), self.size)
+
+    def set_layer_opacity(self, index, opacity):
+        """opacity: 0 (invisible) to 255 (opaque)."""
+        if not self.layers:
+            return None
+        self._record("layer_opacity", index, opacity)
+        self.layers.set_opacity(self.layers.layers[index], opacity)
+        return pygame.Rect((0, 0), self.size)
+
+    def set_layer_blend(self, index, blend):
+        """blend: one of layers.BLEND_MODES."""
+        if not self.layers:
+            return None
+        self._record("layer_blend", index, blend)
+        self.layers.set_blend(self.layers.layers[index], blend)
+        return pygame.Rect((0, 0), self.size)
+
+    def move_layer(self, index, new_index):
+        """Moves layer index up or down the stack to new_index."""
+        if not self.layers:
+            return None
+        self._record("layer_move", index, new_index)
+        self.layers.move(self.layers.layers[index], new_index)
+        return pygame.Rect((0, 0), self.size)
+
+    # Sharing the canvas (see collab.py); not on a tiled canvas
+
+    def take_changes(self):
+        """
+        Returns what commits, undos and redos changed since the last call, per history tile, and forgets it: (layer
+        index, x, y, mask, pixels) with the tile's top-left in canvas coordinates, a (height, width) bool array of
+        the pixels that changed and an array of the tile's pixels. Collecting starts with the first call.
+        A stroke in progress is included as drawn so far (again each time it grows, and once more when committed).
+        """
+        if self.drawing and self.unshared_rect and self.history.changes is not None:
+            with self.profiler.span("history"):
+                self.history.share(self.unshared_rect)
+        self.unshared_rect = None
+        changes = self.history.changes or []
+        self.history.changes = []
+        positions = {layer.surface: i for i, layer in enumerate(self.layers.layers)}
+        return [(positions[surface], x, y, mask, pixels) for surface, x, y, mask, pixels in changes if surface in positions]
+
+    def write_tiles(self, tiles):
+        """
+        Writes pixels from elsewhere, e.g. another user's changes, given as take_changes returns them (only the
+        pixels in each mask). Nothing is recorded and they can't be undone, the history takes them as they are.
+        Tiles of layers this canvas doesn't have are skipped. Returns the canvas Rect changed, or None.
+        """
+        area = None
+        with self.profiler.span("remote"):
+            for index, x, y, mask, pixels in tiles:
+                if index >= len(self.layers.layers):
+                    continue
+                layer = self.layers.layers[index]
+                self.history.accept(layer.surface, x, y, mask, pixels)
+                rect = pygame.Rect((x, y), pixels.shape[::-1])
+                self.layers.changed(layer, rect)
+                area = rect if area is None else area.union(rect)
+        return area
+
+    # Checkpoints
+
+    def state(self):
+        """
+        Returns the tool settings, layers (pixels included), selection, clipboard and undo history as plain data,
+        e.g. for a journal checkpoint. Layer pixels are raw surface bytes, so a state only fits engines built the same way.
+        Not available on a tiled canvas.
+        """
+        layers = self.layers.layers
+        positions = {layer.surface: i for i, layer in enumerate(layers)}
+        undo, redo = self.history.entries()
+        return {
+            "tool": (tuple(self.color), self.mode, self.brush_size, self.fill_mode, self.brush_hardness, self.brush_opacity),
+            "active": layers.index(self.layer),
+            "created": self.layers.created,
+            "layers": [(layer.name, layer.visible, layer.opacity, layer.blend,
+                        tuple(layer.bounds) if layer.bounds else None, layer.surface.get_buffer().raw)
+                       for layer in layers],
+            "selection": self.selection.state() if self.selection else None,
+            "clipboard": (pygame.image.tobytes(self.clipboard[0], "RGBA"), self.clipboard[1].state()) if self.clipboard else None,
+            "undo": [(positions[surface], tiles) for surface, tiles in undo],
+            "redo": [(positions[surface], tiles) for surface, tiles in redo],
+        }
+
+    def restore(self, state):
+        """Puts back a state() taken earlier. Nothing is recorded, the state is where a replay would continue from."""
+        self.color, self.mode, self.brush_size, self.fill_mode, self.brush_hardness, self.brush_opacity = state["tool"]
+        self.drawing = False
+        self.floating = None
+        self.selection = selection_from_state(state["selection"]) if state["selection"] else None
+        self.clipboard = None
+        if state["clipboard"]:
+            pixels, shape = state["clipboard"]
+            shape = selection_from_state(shape)
+            buffer = pygame.Surface(shape.rect.size, pygame.SRCALPHA)
+            buffer.blit(pygame.image.frombytes(pixels, shape.rect.size, "RGBA"), (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.clipboard = (buffer, shape)
+        stack = self.layers
+        stack.layers = []
+        for name, visible, opacity, blend, bounds, pixels in state["layers"]:
+            layer = stack.add()
+            layer.name = name
+            layer.visible = visible
+            layer.opacity = opacity
+            layer.blend = blend
+            layer.bounds = pygame.Rect(bounds) if bounds else None
+            layer.surface.get_buffer().write(pixels)
+        stack.created = state["created"]
+
+        surfaces = [layer.surface for layer in stack.layers]
+        self.history.load([(surfaces[i], tiles) for i, tiles in state["undo"]],
+                          [(surfaces[i], tiles) for i, tiles in state["redo"]], surfaces)
+        self._select(stack.layers[state["active"]])
+        stack.refresh()
+
+    # Replay
+
+    COMMANDS = {
+        "color": "set_color",
+        "mode": "set_mode",
+        "size": "set_brush_size",
+        "hardness": "set_brush_hardness",
+        "brush_opacity": "set_brush_opacity",
+        "fill_mode": "set_fill_mode",
+        "press": "press",
+        "drag": "drag",
+        "flush": "flush",
+        "release": "release",
+        "clear": "clear",
+        "undo": "undo",
+        "redo": "redo",
+        "save": "save",
+        "window": "move_window",
+        "layer_add": "add_layer",
+        "layer_delete": "delete_layer",
+        "layer_select": "select_layer",
+        "layer_visible": "set_layer_visible",
+        "layer_opacity": "set_layer_opacity",
+        "layer_blend": "set_layer_blend",
+        "layer_move": "move_layer",
+        "delete_selection": "delete_selection",
+        "deselect": "deselect",
+        "copy_selection": "copy_selection",
+        "paste": "paste",
+    }
+
+    def run(self, command):
+        """Executes one command such as ["press", x, y] or ["mode", "rect"]."""
+        name, *args = command
+        method = getattr(self, self.COMMANDS[name])
+        if name in ("press", "drag", "release", "window", "paste"):
+            return method(tuple(args))
+        return method(*args)
+
+    def replay(self, commands):
+        """Executes a recorded list of commands in order."""
+        for command in commands:
+            self.run(command)
@@ -0,0 +1,217 @@
+"""
+Parallel export of a drawing to several files: the full picture, previews in
+other formats and thumbnails.
+
+One snapshot of the canvas pixels is copied into a block of shared memory
+(multiprocessing.shared_memory) and every output is encoded by a pool of
+worker processes that map that same block, so the pixels are neither pickled
+nor copied per output. Scaling and encoding run in parallel on all cores.
+Each output is written under a temporary name and renamed when complete.
+PNG and JPEG come from pygame; WebP needs Pillow and is left out without it.
+
+Run on its own, it exports a whole folder of saved sessions, the journals the
+app keeps (my_drawing.journal) and JSON recordings (RECORD_SESSION): each
+session is replayed in a worker, and its outputs are encoded by the same pool.
+
+    python exporter.py sessions/                 # into sessions/, next to each session
+    python exporter.py sessions/ -o exports/ --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, resource_tracker, shared_memory
+
+import pygame
+
+from engine import DrawingEngine
+from journal import decode_state, read_file
+
+try:
+    from PIL import Image # Only for WebP, which pygame can't write
+except ImportError:
+    Image = None
+
+SESSION_SIZE = (1000, 658) # Canvas size of JSON recordings, which don't store it; the app's canvas fits its window
+
+# (name suffix, extension, longest side or None for full size); the extension picks the format
+DEFAULT_OUTPUTS = (
+    ("", ".png", None),
+    ("_preview", ".jpg", 1024),
+    ("_thumb256", ".png", 256),
+    ("_thumb64", ".png", 64),
+)
+if Image is not None:
+    DEFAULT_OUTPUTS += (("_preview", ".webp", 1024),)
+
+
+def output_names(filename, outputs):
+    """File names for outputs, all based on filename (e.g. my_drawing.png -> my_drawing_thumb64.png)."""
+    root = os.path.splitext(filename)[0]
+    return [root + suffix + extension for suffix, extension, _ in outputs]
+
+
+def share_pixels(surface):
+    """Copies the surface's pixels into a new shared memory block as RGB rows (height, width, 3); returns the block."""
+    pixels = pygame.image.tobytes(surface, "RGB") # Faster than copying a transposed surfarray view, despite the extra copy
+    block = shared_memory.SharedMemory(create=True, size=len(pixels))
+    block.buf[:len(pixels)] = pixels
+    return block
+
+
+def _encode(block_name, size, filename, longest_side):
+    """Worker: writes the pixels in a shared memory block (see share_pixels) to filename, scaled down if needed."""
+    block = shared_memory.SharedMemory(block_name)
+    pixels = block.buf[:size[0] * size[1] * 3] # The block can be rounded up to whole pages
+    image = pygame.image.frombuffer(pixels, size, "RGB") # Reads the shared pixels in place
+    try:
+        if longest_side and max(size) > longest_side:
+            scale = longest_side / max(size)
+            image = pygame.transform.smoothscale(image, (max(round(size[0] * scale), 1), max(round(size[1] * scale), 1)))
+        root, ext = os.path.splitext(filename)
+        temp_name = f"{root}.saving{ext}" # Keep the extension, pygame picks the format from it
+        if ext.lower() == ".webp":
+            if Image is None:
+                raise RuntimeError("writing WebP needs Pillow (pip install pillow)")
+            Image.frombytes("RGB", image.get_size(), pygame.image.tobytes(image, "RGB")).save(temp_name)
+        else:
+            pygame.image.save(image, temp_name)
+        os.replace(temp_name, filename)
+    finally:
+        image = None # Lets go of the block's buffer so it can be closed
+        pixels.release()
+        block.close()
+    return filename
+
+
+def load_session(path, size=SESSION_SIZE):
+    """Returns an engine with a saved session replayed: a journal, or a JSON recording on a canvas of size."""
+    if path.endswith(".json"):
+        engine = DrawingEngine(size)
+        with open(path) as f:
+            engine.replay(json.load(f))
+        return engine
+    size, payload, commands = read_file(path)
+    engine = DrawingEngine(size)
+    if payload:
+        engine.restore(decode_state(payload))
+    engine.replay(commands)
+    return engine
+
+
+def _render_session(path, size):
+    """Worker: replays a session into a new shared memory block (see share_pixels); returns (block name, size)."""
+    image = load_session(path, size).image
+    block = share_pixels(image)
+    block.close() # Stays alive for the encoders; the parent removes it once they are done
+    return block.name, image.get_size()
+
+
+class Exporter:
+    def __init__(self, outputs=DEFAULT_OUTPUTS, workers=None):
+        self.outputs = outputs
+        self.workers = workers # None uses every core
+        self._pool = None # Started on first use
+
+    def _executor(self):
+        if self._pool is None:
+            resource_tracker.ensure_running() # Shared by the workers, or blocks they create would seem leaked
+            os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1") # Or every worker greets on import
+            # Spawned, not forked: a fork would copy the app's window and threads, which can deadlock or crash (macOS).
+            # The app's main script only runs under if __name__ == "__main__", so the workers just import it
+            self._pool = ProcessPoolExecutor(self.workers, get_context("spawn"))
+        return self._pool
+
+    def _encode_all(self, block_name, size, filename):
+        """Encodes every output of the pixels in a block in parallel. Returns the file names; raises if one failed."""
+        names = output_names(filename, self.outputs)
+        jobs = [self._executor().submit(_encode, block_name, size, name, longest_side)
+                for name, (_, _, longest_side) in zip(names, self.outputs)]
+        for job in jobs:
+            job.result()
+        return names
+
+    def snapshot(self, surface):
+        """
+        Takes the surface's pixels as they are now and returns write(filename), which writes every output (names
+        based on filename) and removes the snapshot. Later drawing doesn't affect it, so it can be called on
+        another thread, as in BackgroundSaver.save(..., atomic=False).
+        """
+        block = share_pixels(surface)
+        size = surface.get_size()
+
+        def write(filename):
+            try:
+                self._encode_all(block.name, size, filename)
+            finally:
+                block.close()
+                block.unlink()
+        return write
+
+    def export_sessions(self, paths, folder=None, size=SESSION_SIZE):
+        """
+        Exports saved sessions (journals or JSON recordings), replaying them in parallel. The outputs go into folder,
+        or next to each session, named after it. Yields (path, file names or the exception) as sessions finish.
+        """
+        pool = self._executor()
+        renders = {pool.submit(_render_session, path, size): path for path in paths}
+        for render in as_completed(renders):
+            path = renders[render]
+            stem = os.path.splitext(os.path.basename(path))[0]
+            filename = os.path.join(folder or os.path.dirname(path), stem + ".png")
+            try:
+                block_name, image_size = render.result()
+            except Exception as e:
+                yield path, e
+                continue
+            try:
+                result = self._encode_all(block_name, image_size, filename)
+            except Exception as e:
+                result = e
+            finally:
+                block = shared_memory.SharedMemory(block_name)
+                block.close()
+                block.unlink()
+            yield path, result
+
+    def close(self):
+        """Waits for exports in progress and stops the workers."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export saved drawing sessions to PNG, JPEG and WebP files and thumbnails.")
+    parser.add_argument("folder", help="folder with the sessions: *.journal files and *.json recordings")
+    parser.add_argument("-o", "--output", help="folder to write to (default: next to each session)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--size", type=int, nargs=2, default=SESSION_SIZE, metavar=("WIDTH", "HEIGHT"),
+                        help="canvas size of JSON recordings (journals store their own)")
+    args = parser.parse_args()
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"{args.folder} is not a folder")
+    paths = sorted(os.path.join(args.folder, name) for name in os.listdir(args.folder)
+                   if name.endswith((".journal", ".json")))
+    if not paths:
+        parser.error(f"no sessions in {args.folder}")
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    exporter = Exporter(workers=args.workers)
+    failed = 0
+    for path, result in exporter.export_sessions(paths, args.output, tuple(args.size)):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"{path}: failed, {result}")
+        else:
+            print(f"{path}: {', '.join(result)}")
+    exporter.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Scanline flood fill for the drawing canvas.
+
+Instead of pushing one stack entry per pixel and calling get_at/set_at, the
+canvas is read once through pygame.surfarray and every row is split into runs
+(spans) of matching pixels. Runs on neighbouring rows that touch are linked,
+the run graph is labelled with a vectorised union-find, and the runs sharing
+the clicked run's label are painted with a single NumPy assignment.
+"""
+import sys
+
+import numpy as np
+import pygame
+
+
+def _match_mask(surface, seed, tolerance):
+    """Returns a (height, width) bool array of pixels that count as the seed colour."""
+    x, y = seed
+    if tolerance <= 0:
+        # Compare the mapped pixel values directly, ignoring any unused byte (the alpha mask is 0 without SRCALPHA)
+        color_mask = sum(surface.get_masks())
+        pixels = pygame.surfarray.pixels2d(surface).T # Rows first; this view is contiguous
+        mask = (pixels & color_mask) == (pixels[y, x] & color_mask)
+        del pixels # Release the surface lock
+    else:
+        # Each channel is a byte of the mapped pixel, compared in place; nothing wider than a byte is made
+        pixels = pygame.surfarray.pixels2d(surface).T
+        channels = pixels.view(np.uint8).reshape(pixels.shape + (pixels.itemsize,))
+        mask = None
+        for shift, channel_mask in zip(surface.get_shifts(), surface.get_masks()):
+            if not channel_mask:
+                continue # The unused byte, or alpha without SRCALPHA; on layers how transparent a pixel is counts too
+            channel = channels[..., shift // 8 if sys.byteorder == "little" else pixels.itemsize - 1 - shift // 8]
+            low = max(int(channel[y, x]) - tolerance, 0)
+            high = min(int(channel[y, x]) + tolerance, 255)
+            # Values below low wrap around to big ones, so one unsigned comparison checks low <= value <= high
+            matches = channel - np.uint8(low) <= np.uint8(high - low)
+            mask = matches if mask is None else np.logical_and(mask, matches, out=mask)
+        del pixels, channels, channel # Release the surface lock
+    return mask
+
+
+def _find_runs(mask):
+    """Splits every row of the mask into runs, returning (rows, starts, ends) sorted row by row."""
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=bool)
+    padded[:, 1:-1] = mask
+    # Each row is padded with False on both sides, so its changes alternate start, end, start, ...
+    rows, cols = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    return rows[0::2], cols[0::2], cols[1::2]
+
+
+def _link_runs(rows, starts, ends, width, reach):
+    """Returns (a, b) index arrays of runs that touch a run on the next row down."""
+    # With row * stride added, start and end keys are sorted across the whole canvas
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+
+    next_row = (rows + 1) * stride
+    first = np.searchsorted(end_keys, next_row + starts - reach, side="right")
+    last = np.searchsorted(start_keys, next_row + ends + reach, side="left")
+    counts = np.maximum(last - first, 0)
+
+    a = np.repeat(np.arange(len(rows)), counts)
+    # Position of each link within its run's [first, last) range
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = np.repeat(first, counts) + within
+    return a, b
+
+
+def _label_runs(count, a, b):
+    """Labels the run graph with hooking and pointer jumping; returns each run's component root."""
+    labels = np.arange(count)
+    while True:
+        root_a = labels[a]
+        root_b = labels[b]
+        pending = root_a != root_b
+        if not pending.any():
+            return labels
+        low = np.minimum(root_a[pending], root_b[pending])
+        high = np.maximum(root_a[pending], root_b[pending])
+        np.minimum.at(labels, high, low) # Hook the larger root under the smaller one
+        while True:
+            jumped = labels[labels]
+            if np.array_equal(jumped, labels):
+                break
+            labels = jumped
+
+
+def flood_fill(surface, start_point, fill_color, tolerance=0, connectivity=4):
+    """
+    Fills the region around start_point (canvas coordinates) with fill_color.
+    tolerance: maximum per-channel difference from the clicked colour that still gets filled.
+    connectivity: 4 to spread only through edges, 8 to also spread through corners.
+    Returns the pygame.Rect that was changed, or None if nothing was filled.
+    """
+    x, y = start_point
+    width, height = surface.get_size()
+    if not (0 <= x < width and 0 <= y < height):
+        return None
+
+    fill_color = tuple(fill_color)[:3]
+    if tolerance <= 0 and tuple(surface.get_at((x, y))) == fill_color + (255,):
+        return None # Already the fill colour, nothing would change
+
+    mask = _match_mask(surface, (x, y), tolerance)
+    rows, starts, ends = _find_runs(mask)
+
+    # Run containing the start pixel
+    row_first = np.searchsorted(rows, y)
+    row_last = np.searchsorted(rows, y, side="right")
+    seed = row_first + np.searchsorted(starts[row_first:row_last], x, side="right") - 1
+
+    reach = 1 if connectivity == 8 else 0
+    a, b = _link_runs(rows, starts, ends, width, reach)
+    labels = _label_runs(len(rows), a, b)
+    selected = labels == labels[seed]
+
+    if selected.all():
+        region_rows, region_starts, region_ends = rows, starts, ends
+    else:
+        region_rows, region_starts, region_ends = rows[selected], starts[selected], ends[selected]
+
+    top, bottom = int(region_rows[0]), int(region_rows[-1]) + 1
+    left, right = int(region_starts.min()), int(region_ends.max())
+
+    if selected.all():
+        # The whole match mask is one region, so it can be painted as is
+        region = mask[top:bottom, left:right]
+    else:
+        # Rebuild the filled area: +1 at each run start, -1 at each run end, then a running sum
+        coverage = np.zeros((bottom - top, right - left + 1), dtype=np.int16)
+        np.add.at(coverage, (region_rows - top, region_starts - left), 1)
+        np.add.at(coverage, (region_rows - top, region_ends - left), -1)
+        region = np.cumsum(coverage, axis=1, dtype=np.int16)[:, :-1] > 0
+
+    pixels = pygame.surfarray.pixels2d(surface).T
+    fill_value = surface.map_rgb(fill_color) & 0xFFFFFFFF # map_rgb is signed, negative for opaque SRCALPHA colours
+    np.copyto(pixels[top:bottom, left:right], fill_value, where=region, casting="unsafe")
+    del pixels
+
+    return pygame.Rect(left, top, right - left, bottom - top)
@@ -0,0 +1,266 @@
+"""
+Tile-based undo/redo history for the drawing canvas.
+
+Rather than copying the whole surface for every action, the canvas is split
+into square tiles and each history entry keeps only the tiles that action
+changed (their pixels before and after). Identical tile contents are stored
+once and shared between entries, and old entries are dropped when the stored
+bytes go over a budget instead of after a fixed number of actions.
+
+The surface can also be a window onto a bigger tiled canvas (see
+tiledcanvas.py): entries are kept in canvas coordinates, and tiles that are
+outside the window when they are undone are handed to write_outside.
+
+With layers, every layer surface is tracked separately (see set_surface) but
+they share one undo order and one memory budget.
+
+The pixels that commits, undos and redos change can also be collected (see
+changes), e.g. to send them to other users of a shared canvas (collab.py),
+and so can those of an action still in progress (see share).
+While they are collected, undo and redo only write back the pixels their
+action changed, so whatever others drew next to them on the same tile stays.
+"""
+from collections import deque
+
+import numpy as np
+import pygame
+
+
+class TileHistory:
+    def __init__(self, surface, tile_size=64, max_bytes=32 * 1024 * 1024):
+        self.surface = surface # Commits are taken from this surface, see set_surface
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.version = 0 # Goes up whenever the canvas content changes through commit/undo/redo
+        self._undo = deque() # Oldest entry on the left so it can be dropped cheaply
+        self._redo = []
+        self._blobs = {} # Tile bytes -> [stored bytes object, number of uses]
+        self._references = {surface: self._pixels(surface).copy()} # Each tracked surface as of its last commit
+        self.origin = (0, 0) # Canvas position of the surface's top-left corner
+        self.last_surface = None # Surface changed by the last undo/redo
+        self.write_outside = None # Called as write_outside(x, y, width, height, pixels) for tiles outside the surface
+        self.changes = None # A list to add (surface, x, y, changed mask, new pixels) to for every tile written; None doesn't collect
+
+    def _pixels(self, surface):
+        """Returns a (height, width) view of the surface pixels; the surface stays locked while it lives."""
+        return pygame.surfarray.pixels2d(surface).T
+
+    @property
+    def index(self):
+        """Number of actions that can currently be undone."""
+        return len(self._undo)
+
+    def _intern(self, blob):
+        """Returns the shared copy of these tile bytes, storing them if they are new."""
+        stored = self._blobs.get(blob)
+        if stored is None:
+            stored = self._blobs[blob] = [blob, 0]
+            self.bytes_used += len(blob)
+        stored[1] += 1
+        return stored[0]
+
+    def _release_entry(self, entry):
+        for _, _, _, _, before, after in entry[1]:
+            for blob in (before, after):
+                stored = self._blobs[blob]
+                stored[1] -= 1
+                if stored[1] == 0:
+                    del self._blobs[blob]
+                    self.bytes_used -= len(blob)
+
+    def _changed_tiles(self, pixels, reference, rect):
+        """Yields (x, y, width, height) of every tile inside rect whose pixels differ from the reference."""
+        size = self.tile_size
+        canvas_height, canvas_width = pixels.shape
+
+        # Widen the rect out to whole tiles
+        left = max(rect.left, 0) // size * size
+        top = max(rect.top, 0) // size * size
+        right = min(-(-rect.right // size) * size, canvas_width)
+        bottom = min(-(-rect.bottom // size) * size, canvas_height)
+        if right <= left or bottom <= top:
+            return
+
+        changed = pixels[top:bottom, left:right] != reference[top:bottom, left:right]
+        row_starts = np.arange(0, bottom - top, size)
+        col_starts = np.arange(0, right - left, size)
+        # Collapse every tile to one flag: did any of its pixels change?
+        per_tile = np.logical_or.reduceat(np.logical_or.reduceat(changed, row_starts, axis=0), col_starts, axis=1)
+
+        for tile_row, tile_col in zip(*np.nonzero(per_tile)):
+            x = left + int(col_starts[tile_col])
+            y = top + int(row_starts[tile_row])
+            yield x, y, min(size, canvas_width - x), min(size, canvas_height - y)
+
+    def commit(self, rect=None):
+        """
+        Records the tiles changed since the last commit as one history entry.
+        rect: area the action touched (surface coordinates), or a list of areas (e.g. where a selection was moved
+        from and to); the whole surface is checked if None.
+        Returns True if anything had changed.
+        """
+        if rect is None:
+            rect = self.surface.get_rect()
+
+        pixels = self._pixels(self.surface)
+        reference = self._references[self.surface]
+        tiles = []
+        for area in rect if isinstance(rect, list) else [rect]:
+            # A tile in two areas is only found once, it matches the reference after the first
+            for x, y, width, height in self._changed_tiles(pixels, reference, pygame.Rect(area)):
+                before = reference[y:y + height, x:x + width]
+                after = pixels[y:y + height, x:x + width]
+                if self.changes is not None:
+                    self.changes.append((self.surface, x + self.origin[0], y + self.origin[1], before != after, after.copy()))
+                tiles.append((x + self.origin[0], y + self.origin[1], width, height,
+                              self._intern(before.tobytes()), self._intern(after.tobytes())))
+                before[...] = after
+        del pixels
+
+        if not tiles:
+            return False
+
+        # A new action makes the undone ones unreachable
+        for old in self._redo:
+            self._release_entry(old)
+        self._redo.clear()
+
+        self._undo.append((self.surface, tiles))
+        self.version += 1
+        # Drop the oldest actions once over budget, but always keep the newest one
+        while self.bytes_used > self.max_bytes and len(self._undo) > 1:
+            self._release_entry(self._undo.popleft())
+        return True
+
+    def share(self, rect):
+        """
+        Adds the tiles inside rect (surface coordinates) that differ from the last commit to changes, without
+        committing them, e.g. so others see a stroke while it is drawn. The commit adds them again.
+        """
+        if self.changes is None:
+            return
+        pixels = self._pixels(self.surface)
+        reference = self._references[self.surface]
+        for x, y, width, height in self._changed_tiles(pixels, reference, pygame.Rect(rect)):
+            after = pixels[y:y + height, x:x + width]
+            changed = after != reference[y:y + height, x:x + width]
+            self.changes.append((self.surface, x + self.origin[0], y + self.origin[1], changed, after.copy()))
+        pixels = after = None # Views of the surface keep it locked
+
+    def _apply(self, entry, use_before):
+        """Writes the before or after tiles of an entry back into the surface; returns the area restored."""
+        self.version += 1
+        surface, tiles = entry
+        self.last_surface = surface
+        pixels = self._pixels(surface)
+        reference = self._references[surface]
+        surface_height, surface_width = pixels.shape
+        area = None
+        for x, y, width, height, before, after in tiles:
+            tile = np.frombuffer(before if use_before else after, dtype=pixels.dtype).reshape(height, width)
+            left = x - self.origin[0]
+            top = y - self.origin[1]
+            if 0 <= left < surface_width and 0 <= top < surface_height:
+                target = pixels[top:top + height, left:left + width]
+                if self.changes is None:
+                    target[...] = tile
+                else:
+                    # Only the pixels the action changed, so pixels accepted from elsewhere since then (see accept) stay
+                    changed = np.frombuffer(before, dtype=pixels.dtype) != np.frombuffer(after, dtype=pixels.dtype)
+                    changed = changed.reshape(height, width)
+                    np.copyto(target, tile, where=changed)
+                    self.changes.append((surface, x, y, changed, target.copy()))
+                reference[top:top + height, left:left + width] = target
+            else:
+                self.write_outside(x, y, width, height, tile) # Scrolled out of the window since
+            tile_rect = pygame.Rect(x, y, width, height)
+            area = tile_rect if area is None else area.union(tile_rect)
+        pixels = target = None # Views of the surface keep it locked
+        return area
+
+    def accept(self, surface, x, y, mask, tile):
+        """
+        Writes the pixels of tile (a (height, width) array, top-left at canvas x, y) where mask is True into a tracked
+        surface as if they had been there all along: no entry gets them and the next commit doesn't count them as a
+        change. For pixels from elsewhere, e.g. another user.
+        """
+        self.version += 1
+        pixels = self._pixels(surface)
+        left = x - self.origin[0]
+        top = y - self.origin[1]
+        height, width = tile.shape
+        target = pixels[top:top + height, left:left + width]
+        np.copyto(target, tile, where=mask)
+        self._references[surface][top:top + height, left:left + width] = target
+        del pixels, target
+
+    def rebase(self, origin):
+        """The surface now shows the canvas from origin on (tile aligned); takes its current pixels as the reference."""
+        self.origin = origin
+        self._references[self.surface] = self._pixels(self.surface).copy()
+
+    def set_surface(self, surface):
+        """Makes later commits come from surface (e.g. the active layer), starting to track it if it is new."""
+        self.surface = surface
+        if surface not in self._references:
+            self._references[surface] = self._pixels(surface).copy()
+
+    def forget(self, surface):
+        """Stops tracking surface (e.g. a deleted layer) and drops the entries that changed it."""
+        for entries in (self._undo, self._redo):
+            kept = [entry for entry in entries if entry[0] is not surface]
+            for entry in entries:
+                if entry[0] is surface:
+                    self._release_entry(entry)
+            entries.clear()
+            entries.extend(kept)
+        self._references.pop(surface, None)
+        self.version += 1
+
+    def reset(self):
+        """Forgets every entry, e.g. after a change that can't be recorded."""
+        for entry in self._undo:
+            self._release_entry(entry)
+        for entry in self._redo:
+            self._release_entry(entry)
+        self._undo.clear()
+        self._redo.clear()
+        for surface in self._references:
+            self._references[surface] = self._pixels(surface).copy()
+        self.version += 1
+
+    def entries(self):
+        """Returns the (undo, redo) lists of (surface, tiles) entries, e.g. to save them; the next undo/redo is last."""
+        return list(self._undo), list(self._redo)
+
+    def load(self, undo, redo, surfaces):
+        """Replaces everything with saved entries (as from entries()); surfaces are the ones to track, as they are now."""
+        self._undo.clear()
+        self._redo.clear()
+        self._blobs.clear()
+        self.bytes_used = 0
+        self._references = {surface: self._pixels(surface).copy() for surface in surfaces}
+        for saved, entries in ((undo, self._undo), (redo, self._redo)):
+            for surface, tiles in saved:
+                entries.append((surface, [(x, y, width, height, self._intern(before), self._intern(after))
+                                          for x, y, width, height, before, after in tiles]))
+        if self.surface not in self._references:
+            self.set_surface(surfaces[0])
+        self.version += 1
+
+    def undo(self):
+        """Restores the tiles changed by the last action. Returns the area restored, or None if there is nothing to undo."""
+        if not self._undo:
+            return None
+        entry = self._undo.pop()
+        self._redo.append(entry)
+        return self._apply(entry, use_before=True)
+
+    def redo(self):
+        """Reapplies the last undone action. Returns the area restored, or None if there is nothing to redo."""
+        if not self._redo:
+            return None
+        entry = self._redo.pop()
+        self._undo.append(entry)
+        return self._apply(entry, use_before=False)
@@ -0,0 +1,373 @@
+"""
+Append-only binary journal of engine commands, for crash recovery and reloading
+the last session.
+
+Every command the engine records (see engine.py) is appended as a small record:
+a struct header (opcode, payload length) and a struct packed payload, e.g. 13
+bytes for a press. Pen/eraser motion samples between two other commands are
+collected in an array and written as one record of points. Every
+checkpoint_every actions a checkpoint record holds the whole engine state (see
+DrawingEngine.state), zlib-compressed: layer pixels, tool settings and the undo
+history.
+
+On startup the journal is memory-mapped, the headers are scanned to find the
+last checkpoint, and only the commands after it are replayed, so reloading
+takes about as long as the last few actions did. A record cut short by a crash
+is dropped, and so is everything from the first record that doesn't make sense
+(e.g. zeros left by a power loss). A file that can't be restored from is moved
+aside to .old. All writing happens on a background thread.
+
+    journal = Journal("my_drawing.journal", engine) # Restores the engine from the file, if there is one
+    engine.journal = journal # ...then appends every new command to it
+"""
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+from array import array
+
+from layers import BLEND_MODES
+
+MAGIC = b"DRWJ"
+FILE_HEADER = struct.Struct("<4sHII") # Magic, format version, canvas width, height
+RECORD_HEADER = struct.Struct("<BI") # Opcode, payload length
+VERSION = 3
+
+MODES = ("pen", "line", "rect", "circle", "eraser", "fill", "brush", "select", "lasso")
+FILL_MODES = ("outline", "fill")
+
+# Engine command -> (opcode, payload format). Enum arguments (modes, blends) are stored as indexes
+COMMANDS = {
+    "color": (1, "<3B"),
+    "mode": (2, "<B"),
+    "size": (3, "<B"),
+    "fill_mode": (4, "<B"),
+    "press": (5, "<2i"),
+    "flush": (6, ""),
+    "release": (7, "<2i"),
+    "clear": (8, ""),
+    "undo": (9, ""),
+    "redo": (10, ""),
+    "window": (11, "<4i"),
+    "layer_add": (12, ""),
+    "layer_delete": (13, ""),
+    "layer_select": (14, "<H"),
+    "layer_visible": (15, "<HB"),
+    "layer_opacity": (16, "<HB"),
+    "layer_blend": (17, "<HB"),
+    "layer_move": (18, "<HH"),
+    "hardness": (19, "<B"),
+    "brush_opacity": (20, "<B"),
+    "delete_selection": (21, ""),
+    "deselect": (22, ""),
+    "copy_selection": (23, ""),
+    "paste": (24, "<2i"),
+}
+POINTS = 30 # Drag samples, x, y pairs as int32
+CHECKPOINT = 31
+NAMES = {opcode: name for name, (opcode, _) in COMMANDS.items()}
+PAYLOAD_SIZES = {opcode: struct.calcsize(fmt) for opcode, fmt in COMMANDS.values()}
+ACTIONS = {"press", "release", "clear", "undo", "redo", "layer_add", "layer_delete", "layer_move", "delete_selection", "paste"} # Counted for checkpoints
+
+
+def _pack_args(name, args):
+    if name == "color":
+        return tuple(args[0])
+    if name == "mode":
+        return (MODES.index(args[0]),)
+    if name == "fill_mode":
+        return (FILL_MODES.index(args[0]),)
+    if name == "layer_blend":
+        return (args[0], BLEND_MODES.index(args[1]))
+    return tuple(int(arg) for arg in args) # Also turns the visible flag into 0/1
+
+
+def _unpack_args(name, values):
+    if name == "color":
+        return [list(values)]
+    if name == "mode":
+        return [MODES[values[0]]]
+    if name == "fill_mode":
+        return [FILL_MODES[values[0]]]
+    if name == "layer_blend":
+        return [values[0], BLEND_MODES[values[1]]]
+    if name == "layer_visible":
+        return [values[0], bool(values[1])]
+    return list(values)
+
+
+def _record(opcode, payload=b""):
+    return RECORD_HEADER.pack(opcode, len(payload)) + payload
+
+
+def _encode_tiles(entries, blob_ids, parts):
+    parts.append(struct.pack("<I", len(entries)))
+    for layer, tiles in entries:
+        parts.append(struct.pack("<HI", layer, len(tiles)))
+        for x, y, width, height, before, after in tiles:
+            parts.append(struct.pack("<4i2I", x, y, width, height, blob_ids[before], blob_ids[after]))
+
+
+def _encode_selection(selection, parts):
+    """Packs a Selection.state(), or None."""
+    if not selection:
+        parts.append(struct.pack("<B", 0))
+        return
+    rect, mask, outline = selection
+    parts.append(struct.pack("<B4i2BI", 1, *rect, mask is not None, outline is not None, len(outline or ())))
+    if mask is not None:
+        parts.append(mask) # One byte per pixel of rect
+    for point in outline or ():
+        parts.append(struct.pack("<2i", *point))
+
+
+def _decode_selection(reader):
+    if not reader.unpack("<B")[0]:
+        return None
+    *rect, has_mask, has_outline, point_count = reader.unpack("<4i2BI")
+    mask = reader.take(rect[2] * rect[3]) if has_mask else None
+    outline = [reader.unpack("<2i") for _ in range(point_count)] if has_outline else None
+    return (tuple(rect), mask, outline)
+
+
+def encode_state(state):
+    """Packs a DrawingEngine.state() into compressed checkpoint bytes."""
+    color, mode, brush_size, fill_mode, hardness, opacity = state["tool"]
+    parts = [struct.pack("<3B5B", *color, MODES.index(mode), brush_size, FILL_MODES.index(fill_mode), hardness, opacity),
+             struct.pack("<3H", len(state["layers"]), state["active"], state["created"])]
+    for name, visible, opacity, blend, bounds, pixels in state["layers"]:
+        encoded_name = name.encode()
+        parts.append(struct.pack("<H", len(encoded_name)) + encoded_name)
+        parts.append(struct.pack("<4B4i", visible, opacity, BLEND_MODES.index(blend), bounds is not None, *(bounds or (0, 0, 0, 0))))
+        parts.append(struct.pack("<I", len(pixels)) + pixels)
+    _encode_selection(state["selection"], parts)
+    clipboard = state["clipboard"]
+    _encode_selection(clipboard and clipboard[1], parts)
+    if clipboard:
+        parts.append(clipboard[0]) # RGBA, the size of its selection's rect
+
+    # Tile contents are shared between entries, so store each once and refer to it by number
+    blob_ids = {}
+    blobs = []
+    for _, tiles in state["undo"] + state["redo"]:
+        for tile in tiles:
+            for blob in tile[4:]:
+                if blob not in blob_ids:
+                    blob_ids[blob] = len(blobs)
+                    blobs.append(blob)
+    parts.append(struct.pack("<I", len(blobs)))
+    for blob in blobs:
+        parts.append(struct.pack("<I", len(blob)) + blob)
+    _encode_tiles(state["undo"], blob_ids, parts)
+    _encode_tiles(state["redo"], blob_ids, parts)
+    return zlib.compress(b"".join(parts), 1)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def take(self, length):
+        chunk = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return chunk
+
+
+def decode_state(payload):
+    """Unpacks checkpoint bytes from encode_state() back into a state for DrawingEngine.restore()."""
+    reader = _Reader(zlib.decompress(payload))
+    red, green, blue, mode, brush_size, fill_mode, hardness, opacity = reader.unpack("<3B5B")
+    layer_count, active, created = reader.unpack("<3H")
+    layers = []
+    for _ in range(layer_count):
+        name = reader.take(reader.unpack("<H")[0]).decode()
+        visible, layer_opacity, blend, has_bounds, *bounds = reader.unpack("<4B4i")
+        pixels = reader.take(reader.unpack("<I")[0])
+        layers.append((name, bool(visible), layer_opacity, BLEND_MODES[blend], tuple(bounds) if has_bounds else None, pixels))
+    selection = _decode_selection(reader)
+    clipboard = _decode_selection(reader)
+    if clipboard:
+        width, height = clipboard[0][2:]
+        clipboard = (reader.take(width * height * 4), clipboard)
+
+    blobs = [reader.take(reader.unpack("<I")[0]) for _ in range(reader.unpack("<I")[0])]
+    history = []
+    for _ in range(2): # Undo, then redo entries
+        entries = []
+        for _ in range(reader.unpack("<I")[0]):
+            layer, tile_count = reader.unpack("<HI")
+            tiles = []
+            for _ in range(tile_count):
+                x, y, width, height, before, after = reader.unpack("<4i2I")
+                tiles.append((x, y, width, height, blobs[before], blobs[after]))
+            entries.append((layer, tiles))
+        history.append(entries)
+
+    return {"tool": ((red, green, blue), MODES[mode], brush_size, FILL_MODES[fill_mode], hardness, opacity), "active": active,
+            "created": created, "layers": layers, "selection": selection, "clipboard": clipboard, "undo": history[0], "redo": history[1]}
+
+
+def read_journal(data):
+    """
+    Scans journal bytes (after the file header). Returns (checkpoint payload or None, commands after it, end offset
+    of the last complete record).
+    """
+    offset = FILE_HEADER.size
+    checkpoint = None
+    records = [] # (opcode, payload start, length) since the last checkpoint
+    while offset + RECORD_HEADER.size <= len(data):
+        opcode, length = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > len(data):
+            break # Cut short by a crash
+        if opcode == CHECKPOINT:
+            checkpoint = (start, length)
+            records = []
+        elif opcode == POINTS and length % 8 == 0 or PAYLOAD_SIZES.get(opcode) == length:
+            records.append((opcode, start, length))
+        else:
+            break # Not a record, e.g. zeros after a power loss; nothing after it can be trusted
+        offset = start + length
+
+    commands = []
+    for opcode, start, length in records:
+        if opcode == POINTS:
+            points = array("i")
+            points.frombytes(data[start:start + length])
+            commands.extend(["drag", points[i], points[i + 1]] for i in range(0, len(points), 2))
+        else:
+            name = NAMES[opcode]
+            values = struct.unpack_from(COMMANDS[name][1], data, start) if length else ()
+            commands.append([name] + _unpack_args(name, values))
+    payload = bytes(data[checkpoint[0]:checkpoint[0] + checkpoint[1]]) if checkpoint else None
+    return payload, commands, offset
+
+
+def read_file(path):
+    """Reads a journal file without changing it. Returns ((width, height), checkpoint payload or None, commands after it)."""
+    with open(path, "rb") as f:
+        header = f.read(FILE_HEADER.size)
+        magic, version, width, height = FILE_HEADER.unpack(header) if len(header) == FILE_HEADER.size else (b"", 0, 0, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"not a version {VERSION} drawing journal")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            payload, commands, _ = read_journal(data)
+    return (width, height), payload, commands
+
+
+class Journal:
+    def __init__(self, path, engine, checkpoint_every=100, compact_bytes=64 * 1024 * 1024):
+        """Opens the journal at path, first restoring engine (which must be freshly made) from it if there is one."""
+        self.path = path
+        self.checkpoint_every = checkpoint_every # Actions (presses, undos, ...) between checkpoints
+        self.compact_bytes = compact_bytes # Past this size the file is rewritten to start at the newest checkpoint
+        self.recovered = 0 # Commands replayed on top of the checkpoint when opening
+        self.error = None # Why the file couldn't be restored from, if it couldn't; it was moved to path + ".old"
+        self._actions = 0
+        self._points = array("i") # Drag samples not written yet
+        self._header = FILE_HEADER.pack(MAGIC, VERSION, *engine.size)
+
+        end = self._recover(engine)
+        self._file = open(path, "r+b" if end else "wb")
+        if end:
+            self._file.truncate(end) # Drop a record cut short by a crash
+            self._file.seek(end)
+        else:
+            self._file.write(self._header)
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def _recover(self, engine):
+        """Restores engine from the file; returns the offset to append at, or 0 to start a new file."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= FILE_HEADER.size:
+            return 0
+        blank = engine.state() # To go back to if the file turns out to be unusable
+        with open(self.path, "rb") as f:
+            if f.read(FILE_HEADER.size) == self._header:
+                try:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        payload, commands, end = read_journal(data)
+                    if payload:
+                        engine.restore(decode_state(payload))
+                    engine.replay(commands)
+                    self.recovered = len(commands)
+                    self._actions = sum(command[0] in ACTIONS for command in commands)
+                    return end
+                except Exception as e: # Whatever is wrong with the file, it mustn't keep the app from starting
+                    self.error = f"{type(e).__name__}: {e}"
+                    engine.restore(blank)
+        # Another canvas size or format, or damaged; keep it, but start over
+        os.replace(self.path, self.path + ".old")
+        return 0
+
+    def append(self, command):
+        """Queues one engine command (a list such as ["press", 10, 20]) to be written."""
+        name, *args = command
+        if name == "drag":
+            self._points.extend(args)
+            return
+        if name not in COMMANDS:
+            return # e.g. saves, they don't change the canvas
+        self._write_points()
+        opcode, fmt = COMMANDS[name]
+        self._jobs.put(_record(opcode, struct.pack(fmt, *_pack_args(name, args)) if fmt else b""))
+        if name in ACTIONS:
+            self._actions += 1
+
+    def _write_points(self):
+        if self._points:
+            self._jobs.put(_record(POINTS, self._points.tobytes()))
+            self._points = array("i")
+
+    def checkpoint_due(self):
+        return self._actions >= self.checkpoint_every
+
+    def checkpoint(self, engine):
+        """Writes a checkpoint of engine's current state; call it between strokes."""
+        self._write_points()
+        self._actions = 0
+        state = engine.state() # Bytes and tuples only, so it can be encoded on the writer thread
+        self._jobs.put(lambda: self._write_checkpoint(_record(CHECKPOINT, encode_state(state))))
+
+    def _write_checkpoint(self, record):
+        self._file.write(record)
+        if self._file.tell() > self.compact_bytes:
+            # Everything before the newest checkpoint is no longer needed to recover
+            temp_name = self.path + ".compacting"
+            with open(temp_name, "wb") as f:
+                f.write(self._header)
+                f.write(record)
+            self._file.close()
+            os.replace(temp_name, self.path)
+            self._file = open(self.path, "r+b")
+            self._file.seek(0, os.SEEK_END)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if callable(job):
+                job()
+            else:
+                self._file.write(job)
+            if self._jobs.empty():
+                self._file.flush() # Pushed to the OS, so a crash of the app itself loses nothing
+            self._jobs.task_done()
+        self._jobs.task_done()
+
+    def close(self):
+        """Writes everything still queued and closes the file."""
+        self._write_points()
+        self._jobs.put(None)
+        self._thread.join()
+        self._file.close()
@@ -0,0 +1,114 @@
+"""
+Layers and their cached composite.
+
+Each layer is a transparent SRCALPHA surface with its own visibility, opacity
+and blend mode. The flattened picture is kept in one opaque composite surface
+that the app displays and saves. When a layer changes, only the changed area
+of the composite is rebuilt from the layers; nothing recomposites the whole
+stack unless a whole layer changed (shown, hidden, moved, new opacity...).
+Each layer also knows the area it has been drawn on, and is skipped outside
+it, so empty or mostly empty layers cost next to nothing.
+
+Normal layers are blended by SDL's blitter; multiply, screen and add layers
+are blended with NumPy over just the area being rebuilt.
+"""
+import numpy as np
+import pygame
+
+BLEND_MODES = ("normal", "multiply", "screen", "add")
+
+
+class Layer:
+    def __init__(self, size, name):
+        self.name = name
+        self.surface = pygame.Surface(size, pygame.SRCALPHA) # Starts fully transparent
+        self.visible = True
+        self.opacity = 255
+        self.blend = "normal"
+        self.bounds = None # Area that may hold non-transparent pixels; None while the layer is empty
+
+
+class LayerStack:
+    def __init__(self, size, background):
+        self.size = tuple(size)
+        self.background = background # Shows wherever every layer is transparent
+        self.layers = [] # Bottom layer first
+        self.composite = pygame.Surface(size)
+        self.composite.fill(background)
+        self.created = 0 # Layers made so far, for naming new ones
+
+    def add(self, index=None):
+        """Adds a new empty layer at index (default: on top) and returns it."""
+        self.created += 1
+        layer = Layer(self.size, f"Layer {self.created}")
+        self.layers.insert(len(self.layers) if index is None else index, layer)
+        return layer # Empty, so the composite doesn't change
+
+    def remove(self, layer):
+        self.layers.remove(layer)
+        self.refresh()
+
+    def move(self, layer, index):
+        self.layers.remove(layer)
+        self.layers.insert(index, layer)
+        self.refresh()
+
+    def set_visible(self, layer, visible):
+        layer.visible = visible
+        self.refresh()
+
+    def set_opacity(self, layer, opacity):
+        layer.opacity = max(0, min(int(opacity), 255))
+        self.refresh()
+
+    def set_blend(self, layer, blend):
+        if blend not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode: {blend}")
+        layer.blend = blend
+        self.refresh()
+
+    def changed(self, layer, rect):
+        """Call after drawing on layer inside rect: updates the composite there."""
+        rect = pygame.Rect(rect)
+        layer.bounds = rect if layer.bounds is None else layer.bounds.union(rect)
+        self.refresh(rect)
+
+    def cleared(self, layer):
+        """Call after making the whole layer transparent."""
+        layer.bounds = None
+        self.refresh()
+
+    def refresh(self, rect=None):
+        """Rebuilds the composite inside rect (the whole canvas if None) from the visible layers."""
+        rect = pygame.Rect(rect if rect is not None else ((0, 0), self.size)).clip(self.composite.get_rect())
+        if not (rect.width and rect.height):
+            return
+        self.composite.fill(self.background, rect)
+        for layer in self.layers:
+            if not layer.visible or layer.opacity == 0 or layer.bounds is None:
+                continue
+            area = rect.clip(layer.bounds)
+            if not (area.width and area.height):
+                continue # Transparent here
+            if layer.blend == "normal":
+                layer.surface.set_alpha(layer.opacity) # Combined with each pixel's own alpha
+                self.composite.blit(layer.surface, area, area)
+            else:
+                self._blend(layer, area)
+
+    def _blend(self, layer, rect):
+        """Blends a multiply/screen/add layer onto the composite inside rect."""
+        area = (slice(rect.left, rect.right), slice(rect.top, rect.bottom))
+        target = pygame.surfarray.pixels3d(self.composite)[area]
+        source = pygame.surfarray.pixels3d(layer.surface)[area].astype(np.int32)
+        alpha = pygame.surfarray.pixels_alpha(layer.surface)[area].astype(np.int32) * layer.opacity // 255
+        below = target.astype(np.int32)
+
+        if layer.blend == "multiply":
+            blended = below * source // 255
+        elif layer.blend == "screen":
+            blended = 255 - (255 - below) * (255 - source) // 255
+        else:
+            blended = np.minimum(below + source, 255)
+        target[...] = below + (blended - below) * alpha[..., None] // 255
+        del target # Release the surface locks
@@ -0,0 +1,162 @@
+"""
+Load test for the shared canvas server (collab.py).
+
+Simulated clients connect at once and all draw: every frame each one sends a
+few tile deltas, taken from real pen strokes, to random spots on the canvas,
+so they keep painting over each other. It reports how long the server took to
+take a client's message into an update (until the update acknowledging it
+arrived), how much went in and out, and how much the server merged, throttled
+and resynced. The simulated clients don't decode what they receive, so the
+numbers are the server's, not pygame's.
+
+    python loadtest.py                          # 50 clients for 10 s, against a server started here
+    python loadtest.py --clients 200 --tiles 8
+    python loadtest.py --connect 127.0.0.1:8765 # against a running server (its stats aren't shown then)
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+
+import pygame
+
+from collab import ACK, CANVAS_SIZE, DELTA, HELLO_BODY, SEQ, TILES, CollabServer, encode_delta, frame, read_frame
+from engine import DrawingEngine
+
+
+def stroke_tiles(size, count=40, seed=1234):
+    """Returns (width, height, payload) deltas of the whole tiles that some random pen strokes changed."""
+    rng = random.Random(seed)
+    engine = DrawingEngine(size)
+    engine.take_changes()
+    engine.set_brush_size(6)
+    for _ in range(count):
+        engine.set_color((rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        engine.press((x, y))
+        for _ in range(30):
+            x = min(max(x + rng.randrange(-12, 13), 0), size[0] - 1)
+            y = min(max(y + rng.randrange(-12, 13), 0), size[1] - 1)
+            engine.drag((x, y))
+        engine.release((x, y))
+    return [(mask.shape[1], mask.shape[0], encode_delta(mask, pixels)) for _, _, _, mask, pixels in engine.take_changes()
+            if mask.shape[0] == mask.shape[1]]
+
+
+async def simulate_client(host, port, rng, tiles, tiles_per_frame, fps, seconds, results):
+    """One client drawing for seconds; adds its latencies (seconds) and byte counts to results."""
+    reader, writer = await asyncio.open_connection(host, port)
+    _, body = await read_frame(reader)
+    _, width, height, tile_size = HELLO_BODY.unpack(body)
+    sent = deque() # (sequence number, time sent) of each message, oldest first
+
+    async def receive():
+        while True:
+            _, body = await read_frame(reader)
+            ack, = ACK.unpack_from(body)
+            now = time.perf_counter()
+            while sent and sent[0][0] <= ack:
+                results["latencies"].append(now - sent.popleft()[1])
+            results["bytes_in"] += len(body)
+
+    receiver = asyncio.create_task(receive())
+    seq = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        seq += 1
+        records = []
+        for _ in range(tiles_per_frame):
+            tile_width, tile_height, payload = rng.choice(tiles)
+            x = rng.randrange(0, width - tile_size + 1, tile_size) # Whole tiles only, edge tiles are smaller
+            y = rng.randrange(0, height - tile_size + 1, tile_size)
+            records.append(DELTA.pack(0, x, y, tile_width, tile_height, len(payload)) + payload)
+        message = frame(TILES, SEQ.pack(seq) + b"".join(records))
+        sent.append((seq, time.perf_counter()))
+        writer.write(message)
+        results["bytes_out"] += len(message)
+        await writer.drain() # Here the server's rate limit pushes back
+        await asyncio.sleep(1 / fps)
+    await asyncio.sleep(0.5) # For the last updates
+    results["unacknowledged"] += len(sent)
+    receiver.cancel()
+    writer.close()
+
+
+def _serve(size, ports, stop, stats):
+    """Runs a server in its own process, so it doesn't share a core (and the GIL) with the simulated clients."""
+    async def serve():
+        server = CollabServer(size)
+        ports.put(await server.start("127.0.0.1", 0))
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        stats.put(server.stats)
+        await server.close()
+    asyncio.run(serve())
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else math.nan
+
+
+async def run(host, port, args, tiles):
+    results = {"latencies": [], "bytes_in": 0, "bytes_out": 0, "unacknowledged": 0}
+    rng = random.Random(args.seed)
+    await asyncio.gather(*(simulate_client(host, port, random.Random(rng.random()), tiles, args.tiles, args.fps,
+                                           args.seconds, results) for _ in range(args.clients)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the shared canvas server with simulated clients.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--fps", type=float, default=30, help="messages per second per client")
+    parser.add_argument("--tiles", type=int, default=4, help="tile deltas per message")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--connect", metavar="HOST:PORT", help="use a running server instead of starting one")
+    args = parser.parse_args()
+
+    pygame.init()
+    tiles = stroke_tiles(CANVAS_SIZE)
+    server = None
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        port = int(port)
+    else:
+        context = multiprocessing.get_context("spawn")
+        ports, stats, stop = context.Queue(), context.Queue(), context.Event()
+        server = context.Process(target=_serve, args=(CANVAS_SIZE, ports, stop, stats))
+        server.start()
+        host, port = "127.0.0.1", ports.get()
+
+    start = time.perf_counter()
+    results = asyncio.run(run(host, port, args, tiles))
+    elapsed = time.perf_counter() - start
+    latencies = [latency * 1000 for latency in results["latencies"]]
+    print(f"{args.clients} clients, {args.seconds:g} s, {args.fps:g} messages/s of {args.tiles} tiles each "
+          f"({sum(len(payload) for _, _, payload in tiles) / len(tiles) / 1024:.1f} KB a tile)")
+    print(f"sent      {results['bytes_out'] / 2**20:9.1f} MB   {results['bytes_out'] / elapsed / 2**20:7.1f} MB/s")
+    print(f"received  {results['bytes_in'] / 2**20:9.1f} MB   {results['bytes_in'] / elapsed / 2**20:7.1f} MB/s")
+    print(f"taken in  p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms, "
+          f"max {max(latencies, default=math.nan):.1f} ms; {results['unacknowledged']} messages never acknowledged")
+
+    if server:
+        stop.set()
+        server_stats = stats.get()
+        server.join()
+        merged = 1 - server_stats["tiles_out"] / max(server_stats["tiles_in"], 1)
+        print(f"server    {server_stats['tiles_in']} tiles in, {server_stats['tiles_out']} out in "
+              f"{server_stats['updates']} updates ({merged:.0%} merged), "
+              f"throttled {server_stats['throttled_s']:.1f} s, {server_stats['resyncs']} resyncs")
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Live preview overlay for the line, rect and circle tools.
+
+The semi-transparent preview is drawn into one persistent SRCALPHA buffer that
+only grows when a bigger shape needs it. Each update clears and redraws just
+the shape's bounding box, and reports the screen area that needs repainting
+(where the old preview was plus where the new one is).
+"""
+import pygame
+
+
+def shape_bounds(shape, start, end, width):
+    """Returns the area a line/rect/circle dragged from start to end can cover, including its thickness."""
+    if shape == "circle":
+        center_x = (start[0] + end[0]) // 2
+        center_y = (start[1] + end[1]) // 2
+        radius = int(max(abs(end[0] - center_x), abs(end[1] - center_y)))
+        rect = pygame.Rect(center_x - radius, center_y - radius, radius * 2 + 1, radius * 2 + 1)
+    else:
+        rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]),
+                           abs(start[0] - end[0]) + 1, abs(start[1] - end[1]) + 1)
+    return rect.inflate(width * 2, width * 2) # Room for the line thickness
+
+
+def draw_shape(surface, shape, start, end, color, width, thickness):
+    """Draws a line (width wide) or a rect/circle (thickness 0 = filled) dragged from start to end."""
+    if shape == "line":
+        return pygame.draw.line(surface, color, start, end, width)
+    if shape == "rect":
+        rect_x = min(start[0], end[0])
+        rect_y = min(start[1], end[1])
+        rect_width = abs(start[0] - end[0])
+        rect_height = abs(start[1] - end[1])
+        return pygame.draw.rect(surface, color, (rect_x, rect_y, rect_width, rect_height), thickness)
+    if shape == "circle":
+        center_x = (start[0] + end[0]) // 2
+        center_y = (start[1] + end[1]) // 2
+        radius = int(max(abs(end[0] - center_x), abs(end[1] - center_y)))
+        if radius > 0: # Avoid drawing zero-radius circles
+            return pygame.draw.circle(surface, color, (center_x, center_y), radius, thickness)
+    return None
+
+
+class PreviewOverlay:
+    def __init__(self, clip_rect, grow_step=64):
+        self.clip_rect = pygame.Rect(clip_rect) # The preview never shows outside this area
+        self.grow_step = grow_step
+        self.rect = None # Screen area of the preview currently shown
+        self._buffer = None
+        self._params = None
+
+    def show(self, shape, start, end, color, width, thickness):
+        """
+        Updates the preview (positions in screen coordinates, color with alpha).
+        Returns the screen area that needs repainting, or None if nothing changed.
+        """
+        params = (shape, start, end, color, width, thickness)
+        if params == self._params:
+            return None
+        self._params = params
+
+        bounds = shape_bounds(shape, start, end, width).clip(self.clip_rect)
+        if not (bounds.width and bounds.height):
+            return self.hide()
+
+        if self._buffer is None or self._buffer.get_width() < bounds.width or self._buffer.get_height() < bounds.height:
+            # Grow in steps so a shape being dragged bigger doesn't reallocate every frame
+            old_width, old_height = self._buffer.get_size() if self._buffer else (0, 0)
+            step = self.grow_step
+            size = (max(old_width, -(-bounds.width // step) * step), max(old_height, -(-bounds.height // step) * step))
+            self._buffer = pygame.Surface(size, pygame.SRCALPHA)
+
+        local = pygame.Rect((0, 0), bounds.size)
+        self._buffer.set_clip(local)
+        self._buffer.fill((0, 0, 0, 0), local)
+        offset_start = (start[0] - bounds.x, start[1] - bounds.y)
+        offset_end = (end[0] - bounds.x, end[1] - bounds.y)
+        draw_shape(self._buffer, shape, offset_start, offset_end, color, width, thickness)
+
+        damaged = bounds if self.rect is None else bounds.union(self.rect)
+        self.rect = bounds
+        return damaged
+
+    def hide(self):
+        """Removes the preview. Returns the screen area that needs repainting, or None."""
+        damaged = self.rect
+        self.rect = None
+        self._params = None
+        return damaged
+
+    def draw(self, surface):
+        """Blends the preview onto surface (normally the screen)."""
+        if self.rect:
+            surface.blit(self._buffer, self.rect, pygame.Rect((0, 0), self.rect.size))
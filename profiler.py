@@ -0,0 +1,136 @@
+"""
+Timing for the hot paths: per-operation totals, frame-time percentiles for a
+HUD, and a timeline that can be exported as a Chrome trace.
+
+Instrumented code wraps each step in a span:
+
+    with profiler.span("fill"):
+        flood_fill(...)
+
+or, where a with block doesn't fit, start = profiler.now() ... profiler.add("events", start).
+A disabled profiler hands out one shared span that does nothing and now()/add()
+return straight away, so the instrumentation can stay in the hot paths.
+
+Enabled, every span adds to a count/total/longest per name. With trace set it
+also goes on a timeline that export_trace() writes in the Chrome trace event
+format, for chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan() # What a disabled profiler hands out
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, self.start)
+        return False
+
+
+class Profiler:
+    def __init__(self, enabled=False, trace=False, frames=600, max_events=1000000):
+        self.enabled = enabled
+        self.trace = trace # Keep every span for export_trace(), not just the totals
+        self.frame_times = deque(maxlen=frames) # Work per presented frame in ms, the most recent last
+        self.totals = {} # Span name -> [count, total seconds, longest seconds]
+        self.max_events = max_events # Timeline entries kept at most, about 100 bytes each
+        self.dropped = 0 # Timeline entries past max_events
+        self._events = [] # (name, start, duration or None for a frame, thread id or frame ms)
+        self._epoch = time.perf_counter()
+
+    def span(self, name):
+        """Returns a context manager that times its block under name."""
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, name)
+
+    def now(self):
+        """Start time to hand to add() later (0 when disabled)."""
+        return time.perf_counter() if self.enabled else 0.0
+
+    def add(self, name, start):
+        """Records a span from start (as from now()) until now."""
+        if not self.enabled:
+            return
+        duration = time.perf_counter() - start
+        totals = self.totals.get(name)
+        if totals is None:
+            totals = self.totals[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += duration
+        if duration > totals[2]:
+            totals[2] = duration
+        if self.trace:
+            self._log((name, start, duration, threading.get_ident()))
+
+    def frame(self, work_ms):
+        """Records the time the last presented frame took (see FrameScheduler.last_frame_ms)."""
+        if not self.enabled:
+            return
+        self.frame_times.append(work_ms)
+        if self.trace:
+            self._log(("frame", time.perf_counter(), None, work_ms))
+
+    def _log(self, event):
+        if len(self._events) < self.max_events:
+            self._events.append(event)
+        else:
+            self.dropped += 1
+
+    def percentile(self, percent):
+        """Frame time in ms that percent of the recent frames stayed under (0 before any frame)."""
+        if not self.frame_times:
+            return 0.0
+        ordered = sorted(self.frame_times)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def hud_lines(self, fps, history_bytes):
+        """Short lines of text for an on-screen overlay."""
+        return [f"{fps:.0f} FPS",
+                f"frame p50 {self.percentile(50):.1f} ms, p99 {self.percentile(99):.1f} ms",
+                f"history {history_bytes / 2**20:.1f} MB"]
+
+    def summary(self):
+        """Table of the spans, the most total time first."""
+        lines = [f"{'span':<12}{'count':>9}{'total ms':>12}{'mean ms':>10}{'max ms':>10}"]
+        for name, (count, total, longest) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<12}{count:>9}{total * 1000:>12.1f}{total * 1000 / count:>10.3f}{longest * 1000:>10.3f}")
+        if self.frame_times:
+            lines.append(f"frames: p50 {self.percentile(50):.2f} ms, p99 {self.percentile(99):.2f} ms "
+                         f"over the last {len(self.frame_times)}")
+        return "\n".join(lines)
+
+    def export_trace(self, filename):
+        """Writes the timeline as Chrome trace JSON (times in microseconds since the profiler was made)."""
+        pid = os.getpid()
+        events = []
+        for name, start, duration, extra in self._events:
+            timestamp = (start - self._epoch) * 1e6
+            if duration is None:
+                events.append({"name": name, "ph": "C", "ts": timestamp, "pid": pid, "args": {"ms": extra}})
+            else:
+                events.append({"name": name, "ph": "X", "ts": timestamp, "dur": duration * 1e6, "pid": pid, "tid": extra})
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped": self.dropped}}, f)
@@ -0,0 +1,79 @@
+"""
+Dirty-rectangle rendering for the main window.
+
+Parts of the app report the screen areas they changed (a stroke segment, the
+old and new shape preview, the brush cursor, a toolbar highlight) and only
+those areas are redrawn and pushed to the display with pygame.display.update.
+With full_redraw set, every frame repaints and flips the whole window instead.
+Either way, a frame is only drawn when something reported a change.
+"""
+import pygame
+
+from profiler import Profiler
+
+
+class DirtyRectRenderer:
+    def __init__(self, screen, full_redraw=False, max_rects=24, profiler=None):
+        self.screen = screen
+        self.full_redraw = full_redraw
+        self.max_rects = max_rects # Past this many separate areas, one bounding area is cheaper
+        self.profiler = profiler or Profiler() # Times drawing ("draw") and pushing to the display ("present")
+        self._dirty = []
+        self._everything = True # The first frame always paints the whole window
+
+    def invalidate(self, rect=None):
+        """Marks a screen area as needing a redraw; None marks the whole window."""
+        if rect is None:
+            self._everything = True
+            return
+        rect = pygame.Rect(rect).clip(self.screen.get_rect())
+        if rect.width and rect.height:
+            self._dirty.append(rect)
+
+    def has_damage(self):
+        """True if some area is waiting to be redrawn."""
+        return self._everything or bool(self._dirty)
+
+    def _merged(self):
+        """Returns the dirty areas with overlapping ones combined."""
+        merged = []
+        for rect in sorted(self._dirty, key=lambda r: r.width * r.height, reverse=True):
+            # Keep folding rects into this one while it overlaps any that are already merged
+            while True:
+                hit = rect.collidelist(merged)
+                if hit == -1:
+                    break
+                rect = rect.union(merged.pop(hit))
+            merged.append(rect)
+
+        if len(merged) > self.max_rects:
+            return [merged[0].unionall(merged[1:])]
+        return merged
+
+    def present(self, draw):
+        """
+        Redraws the dirty areas by calling draw(area) with the screen clipped to each one,
+        then pushes them to the display. Returns the list of rects that were updated.
+        """
+        if not self.has_damage():
+            return [] # Nothing changed, the display already shows the right picture
+        if self.full_redraw or self._everything:
+            rects = [self.screen.get_rect()]
+        else:
+            rects = self._merged()
+
+        with self.profiler.span("draw"):
+            for rect in rects:
+                self.screen.set_clip(rect)
+                draw(rect)
+            self.screen.set_clip(None)
+
+        with self.profiler.span("present"):
+            if len(rects) == 1 and rects[0] == self.screen.get_rect():
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+
+        self._dirty.clear()
+        self._everything = False
+        return rects
@@ -0,0 +1,111 @@
+"""
+Background saving and autosave.
+
+The UI thread only takes a snapshot of the canvas (see DrawingEngine.snapshot);
+encoding and writing the image happens on a worker thread, so the window
+keeps responding while a PNG is written. Files are written under a temporary
+name and renamed when complete, so a crash never leaves a half-written image.
+"""
+import os
+import queue
+import re
+import threading
+import time
+
+import pygame
+
+
+class BackgroundSaver:
+    def __init__(self, notify_event=None, status_seconds=3):
+        self.notify_event = notify_event # Posted when a save finishes, to wake up an idle main loop
+        self.status_seconds = status_seconds # How long the "Saved ..." message stays up
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._status = None
+        self._status_until = 0
+        self._versions = {} # Last version number handed out per base name
+        threading.Thread(target=self._run, name="saver", daemon=True).start()
+
+    def make_filename(self, base, naming="overwrite", ext=".png"):
+        """
+        Returns the file name for the next save.
+        naming: "overwrite" (base.png), "timestamp" (base_20250101-120000.png) or "versioned" (base_001.png, base_002.png, ...).
+        """
+        if naming == "timestamp":
+            return f"{base}_{time.strftime('%Y%m%d-%H%M%S')}{ext}"
+        if naming == "versioned":
+            folder, prefix = os.path.split(base)
+            pattern = re.compile(re.escape(prefix) + r"_(\d+)" + re.escape(ext) + "$")
+            existing = [int(match.group(1)) for match in map(pattern.match, os.listdir(folder or ".")) if match]
+            # Also count versions still waiting in the queue, they aren't on disk yet
+            version = max(existing + [self._versions.get(base, 0)]) + 1
+            self._versions[base] = version
+            return f"{base}_{version:03d}{ext}"
+        return f"{base}{ext}"
+
+    def save(self, write, filename, atomic=True):
+        """
+        Queues a canvas snapshot to be written to filename; write(path) writes the image, as from DrawingEngine.snapshot.
+        atomic=False passes write the final name, for writers that take care of temporary files themselves.
+        """
+        with self._lock:
+            self._pending += 1
+            self._status = f"Saving {os.path.basename(filename)}..."
+        self._jobs.put((write, filename, atomic))
+
+    def status_text(self):
+        """Short progress/result message for the toolbar, or None when there is nothing to show."""
+        with self._lock:
+            if self._status and not self._pending and time.monotonic() > self._status_until:
+                self._status = None
+            return self._status
+
+    def wait(self):
+        """Blocks until every queued save has been written."""
+        self._jobs.join()
+
+    def _run(self):
+        while True:
+            write, filename, atomic = self._jobs.get()
+            root, ext = os.path.splitext(filename)
+            temp_name = f"{root}.saving{ext}" if atomic else filename # Keep the extension, pygame picks the format from it
+            try:
+                write(temp_name)
+                if atomic:
+                    os.replace(temp_name, filename)
+                status = f"Saved {os.path.basename(filename)}"
+                print(f"Drawing saved as {filename}")
+            except Exception as e:
+                status = "Save failed"
+                print(f"Error saving drawing: {e}")
+
+            with self._lock:
+                self._pending -= 1
+                if not self._pending:
+                    self._status = status
+                    self._status_until = time.monotonic() + self.status_seconds
+            self._jobs.task_done()
+            if self.notify_event is not None and pygame.display.get_init():
+                pygame.event.post(pygame.event.Event(self.notify_event))
+
+
+class AutoSaver:
+    def __init__(self, interval, version=0):
+        self.interval = interval # Seconds between autosaves, 0 turns it off
+        self._saved_version = version # Canvas version as of the last save, see TileHistory.version
+        self._next = time.monotonic() + interval
+
+    def mark_saved(self, version):
+        """Records that the canvas was saved at this version (e.g. by the user)."""
+        self._saved_version = version
+
+    def due(self, version):
+        """True if the interval has passed and the canvas changed since the last save."""
+        if not self.interval or time.monotonic() < self._next:
+            return False
+        self._next = time.monotonic() + self.interval
+        if version == self._saved_version:
+            return False # Nothing new, skip writing the same picture again
+        self._saved_version = version
+        return True
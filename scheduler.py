@@ -0,0 +1,67 @@
+"""
+Event-driven frame pacing for the main loop.
+
+When nothing is waiting to be drawn the loop blocks in pygame.event.wait, so an
+idle window uses no CPU. While input keeps producing changes (drawing, shape
+previews, the brush cursor) frames are presented at most target_fps times a
+second; input that arrives between frames is still handled straight away and
+just lands in the next present. A frame is never held back once its budget has
+passed, so the first motion event after a pause is shown immediately.
+"""
+import time
+
+import pygame
+
+
+class FrameScheduler:
+    def __init__(self, target_fps=60, idle_timeout_ms=1000):
+        self.target_fps = target_fps
+        self.idle_timeout_ms = idle_timeout_ms # Longest block while idle, so timers still get a chance to run
+        self.frame_time_ms = 0.0 # Smoothed time spent handling events and drawing per presented frame
+        self.last_frame_ms = 0.0 # The same for just the last presented frame
+        self.fps = 0.0 # Smoothed number of presented frames per second
+        self._last_present = 0.0
+        self._busy_since = time.perf_counter()
+        self._busy_ms = 0.0 # Work done since the last present, not counting time blocked on input
+
+    def _until_next_frame_ms(self):
+        elapsed_ms = (time.perf_counter() - self._last_present) * 1000
+        return max(0.0, 1000 / self.target_fps - elapsed_ms)
+
+    def wait_events(self, pending):
+        """
+        Returns the next batch of events.
+        pending: True if changes are waiting to be presented; then this only waits until the next frame
+        is due, otherwise it blocks until input arrives (or idle_timeout_ms passes).
+        """
+        self._busy_ms += (time.perf_counter() - self._busy_since) * 1000
+
+        timeout = self._until_next_frame_ms() if pending else self.idle_timeout_ms
+        if timeout >= 1 and not pygame.event.peek():
+            event = pygame.event.wait(int(timeout))
+            events = [] if event.type == pygame.NOEVENT else [event]
+            events.extend(pygame.event.get())
+        else:
+            events = pygame.event.get()
+
+        self._busy_since = time.perf_counter()
+        return events
+
+    def frame_due(self):
+        """True if enough time has passed since the last present to stay under target_fps."""
+        return self._until_next_frame_ms() < 1
+
+    def presented(self):
+        """Records that a frame went out; call right after presenting it."""
+        now = time.perf_counter()
+        work_ms = self._busy_ms + (now - self._busy_since) * 1000
+        interval = now - self._last_present
+
+        self.last_frame_ms = work_ms
+        self.frame_time_ms = self.frame_time_ms * 0.9 + work_ms * 0.1
+        if interval < 1: # Ignore the gap after an idle period
+            self.fps = self.fps * 0.9 + (1 / max(interval, 1e-6)) * 0.1
+
+        self._last_present = now
+        self._busy_since = now
+        self._busy_ms = 0.0
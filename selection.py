@@ -0,0 +1,129 @@
+"""
+Rectangle and lasso selections.
+
+A selection is only an area: a Rect in canvas coordinates plus, for a lasso,
+a mask of which pixels inside it are selected. Its pixels are read through a
+subsurface view of the layer, so selecting copies nothing. Pixels are copied
+once they have to be, into a buffer the size of the selection: when a move
+lifts them off the canvas, or for the clipboard. Moving therefore costs the
+pixels of the selection, not of the canvas.
+"""
+import numpy as np
+import pygame
+
+
+class Selection:
+    def __init__(self, rect, mask=None, outline=None):
+        self.rect = pygame.Rect(rect) # Canvas coordinates
+        self.mask = mask # Selected pixels inside rect as a bool array indexed [x, y]; None selects all of rect
+        self.outline = outline # Lasso path relative to rect's top-left, for drawing; None for a rectangle
+
+    def state(self):
+        """The selection as plain data, e.g. for a journal checkpoint; selection_from_state() turns it back."""
+        mask = None if self.mask is None else self.mask.tobytes()
+        outline = None if self.outline is None else [tuple(point) for point in self.outline]
+        return (tuple(self.rect), mask, outline)
+
+    def contains(self, pos):
+        """True if the canvas position pos is a selected pixel."""
+        if not self.rect.collidepoint(pos):
+            return False
+        return self.mask is None or bool(self.mask[pos[0] - self.rect.x, pos[1] - self.rect.y])
+
+    def moved(self, dx, dy):
+        """The same selection shape, dx, dy further on."""
+        return Selection(self.rect.move(dx, dy), self.mask, self.outline)
+
+    def clipped(self, bounds):
+        """The part of the selection inside bounds, or None if nothing is left."""
+        rect = self.rect.clip(bounds)
+        if not (rect.width and rect.height):
+            return None
+        if rect == self.rect:
+            return self
+        if self.mask is None:
+            return Selection(rect)
+        left, top = rect.x - self.rect.x, rect.y - self.rect.y
+        mask = self.mask[left:left + rect.width, top:top + rect.height]
+        if not mask.any():
+            return None
+        return Selection(rect, np.ascontiguousarray(mask), [(x - left, y - top) for x, y in self.outline])
+
+    def view(self, surface, origin=(0, 0)):
+        """A subsurface sharing the pixels of surface under the selection (surface's top-left is at canvas origin)."""
+        return surface.subsurface(self.rect.move(-origin[0], -origin[1]))
+
+    def copy_pixels(self, surface, origin=(0, 0)):
+        """Returns a copy of the selected pixels as a transparent-backed buffer the size of the selection."""
+        buffer = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        buffer.blit(self.view(surface, origin), (0, 0), special_flags=pygame.BLEND_RGBA_MAX) # A plain copy, alpha included
+        if self.mask is not None:
+            alpha = pygame.surfarray.pixels_alpha(buffer)
+            alpha[~self.mask] = 0
+            del alpha # Release the surface lock
+        return buffer
+
+    def erase(self, surface, color, origin=(0, 0)):
+        """Sets the selected pixels of surface to color (transparent on a layer, the background otherwise)."""
+        view = self.view(surface, origin)
+        if self.mask is None:
+            view.fill(color)
+            return
+        pixels = pygame.surfarray.pixels2d(view)
+        pixels[self.mask] = view.map_rgb(color) & 0xFFFFFFFF
+        del pixels
+
+
+def selection_from_state(state):
+    """The Selection a Selection.state() was taken from."""
+    rect, mask, outline = state
+    rect = pygame.Rect(rect)
+    if mask is not None:
+        mask = np.frombuffer(mask, dtype=bool).reshape(rect.size).copy()
+    return Selection(rect, mask, outline)
+
+
+def rect_selection(start, end, bounds):
+    """The rectangle between two canvas positions (either corner first), clipped to bounds; None if empty."""
+    rect = pygame.Rect(min(start[0], end[0]), min(start[1], end[1]), abs(end[0] - start[0]), abs(end[1] - start[1]))
+    return Selection(rect).clipped(bounds)
+
+
+def lasso_selection(points, bounds):
+    """The area inside the closed path through points (canvas positions), clipped to bounds; None if empty."""
+    if len(points) < 3:
+        return None
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    rect = pygame.Rect(min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+    outline = [(x - rect.x, y - rect.y) for x, y in points]
+    shape = pygame.Surface(rect.size, pygame.SRCALPHA)
+    pygame.draw.polygon(shape, (255, 255, 255), outline)
+    return Selection(rect, pygame.surfarray.array_alpha(shape) > 0, outline).clipped(bounds)
+
+
+def paste(buffer, surface, pos):
+    """
+    Draws buffer (as from Selection.copy_pixels) onto surface with its top-left at pos, like a blit, but on a
+    transparent layer the result is exact (SDL's blend darkens partly transparent pixels there). Returns the
+    changed Rect, or None.
+    """
+    rect = pygame.Rect(pos, buffer.get_size()).clip(surface.get_rect())
+    if not (rect.width and rect.height):
+        return None
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return surface.blit(buffer, pos)
+
+    source = buffer.subsurface(rect.move(-pos[0], -pos[1]))
+    target = surface.subsurface(rect)
+    colors = pygame.surfarray.pixels3d(source).astype(np.float32)
+    alpha = pygame.surfarray.pixels_alpha(source)[..., None] / np.float32(255)
+    target_colors = pygame.surfarray.pixels3d(target)
+    target_alpha = pygame.surfarray.pixels_alpha(target)
+    below = target_colors.astype(np.float32)
+    below_alpha = target_alpha[..., None] / np.float32(255)
+    out_alpha = alpha + below_alpha * (1 - alpha)
+    target_colors[...] = (colors * alpha + below * below_alpha * (1 - alpha)) / np.maximum(out_alpha, 1e-6) + 0.5
+    target_alpha[...] = out_alpha[..., 0] * 255 + 0.5
+    del target_colors, target_alpha # Release the surface locks
+    return rect
@@ -0,0 +1,138 @@
+"""
+Coalesced stroke rasterisation for the pen and eraser.
+
+Mouse motion samples are only collected while events are handled; once per
+frame the new part of the stroke is drawn as a single pygame.draw.lines call,
+with round caps and round joins at the corners. Samples closer together than
+min_distance are merged, so a high polling rate mouse adds no extra draw calls,
+and the path can optionally be smoothed with a Catmull-Rom spline.
+"""
+import math
+
+import pygame
+
+
+def _catmull_rom(p0, p1, p2, p3, steps):
+    """Returns the points after p1 up to and including p2 on the spline through p0..p3."""
+    points = []
+    for i in range(1, steps + 1):
+        t = i / steps
+        t2 = t * t
+        t3 = t2 * t
+        points.append(tuple(
+            0.5 * (2 * b + (c - a) * t + (2 * a - 5 * b + 4 * c - d) * t2 + (3 * b - a - 3 * c + d) * t3)
+            for a, b, c, d in zip(p0, p1, p2, p3)))
+    return points
+
+
+class StrokeBuffer:
+    def __init__(self, min_distance=2.0, smooth=False, smooth_step=4.0, join_angle=20):
+        self.min_distance = min_distance # Samples closer than this to the last kept one are merged
+        self.smooth = smooth
+        self.smooth_step = smooth_step # Spacing of the points generated along a smoothed segment
+        self._join_cos = math.cos(math.radians(join_angle)) # Turns sharper than join_angle get a round join
+        self.active = False
+        self._controls = [] # Kept samples; with smoothing the last one isn't rasterised yet
+        self._pending = [] # Points waiting for the next flush
+        self._latest = None # Newest sample, even if it was merged away
+        self._last_drawn = None # Where the previous flush ended, so the next one continues from it
+        self._direction = None # Direction of the last drawn segment
+
+    def begin(self, pos):
+        """Starts a new stroke at pos (canvas coordinates); the first flush draws a dot there."""
+        self.active = True
+        self._controls = [pos]
+        self._pending = [pos]
+        self._latest = pos
+        self._last_drawn = None
+        self._direction = None
+
+    def add(self, pos):
+        """Adds a motion sample to the stroke."""
+        if not self.active:
+            return
+        self._latest = pos
+        last = self._controls[-1]
+        if math.hypot(pos[0] - last[0], pos[1] - last[1]) < self.min_distance:
+            return
+        self._keep(pos)
+
+    def end(self):
+        """Finishes the stroke; call flush() afterwards to draw what is left."""
+        if not self.active:
+            return
+        if self._latest != self._controls[-1]:
+            self._keep(self._latest) # The stroke should still end exactly under the mouse
+        if self.smooth and len(self._controls) >= 2:
+            p0 = self._controls[-3] if len(self._controls) >= 3 else self._controls[-2]
+            p1, p2 = self._controls[-2], self._controls[-1]
+            self._pending.extend(_catmull_rom(p0, p1, p2, p2, self._steps(p1, p2)))
+        if not self._pending:
+            self._pending.append(self._latest) # Still flush once so the end gets its round cap
+        self.active = False
+
+    def _keep(self, pos):
+        self._controls.append(pos)
+        if not self.smooth:
+            self._pending.append(pos)
+        elif len(self._controls) >= 3:
+            # The segment into the newest sample needs the one after it, so smooth the one before
+            p0 = self._controls[-4] if len(self._controls) >= 4 else self._controls[-3]
+            p1, p2, p3 = self._controls[-3], self._controls[-2], self._controls[-1]
+            self._pending.extend(_catmull_rom(p0, p1, p2, p3, self._steps(p1, p2)))
+        del self._controls[:-4] # Smoothing only ever looks back four samples
+
+    def _steps(self, p1, p2):
+        return max(1, int(math.hypot(p2[0] - p1[0], p2[1] - p1[1]) / self.smooth_step))
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    def take(self):
+        """
+        Returns the path gathered since the last call, starting where the previous one ended, for drawing it some
+        other way (see brush.py). Returns None if there is nothing new.
+        """
+        if not self._pending:
+            return None
+        points = self._pending if self._last_drawn is None else [self._last_drawn] + self._pending
+        self._pending = []
+        self._last_drawn = points[-1]
+        return points
+
+    def flush(self, surface, color, width):
+        """Draws the samples gathered since the last flush. Returns the changed Rect, or None."""
+        points = self.take()
+        if not points:
+            return None
+        radius = width // 2
+
+        if len(points) == 1:
+            return pygame.draw.circle(surface, color, points[0], radius) # A dot, like a single click
+
+        rect = pygame.draw.lines(surface, color, False, points, width)
+        if width > 2:
+            # Thick segments leave notches at corners and square ends, round those off
+            for point in self._round_points(points):
+                rect.union_ip(pygame.draw.circle(surface, color, point, radius))
+        return rect
+
+    def _round_points(self, points):
+        """Returns the points that need a round cap or join: the stroke's ends and its sharp turns."""
+        rounded = []
+        direction = self._direction
+        for start, end in zip(points, points[1:]):
+            dx = end[0] - start[0]
+            dy = end[1] - start[1]
+            length = math.hypot(dx, dy)
+            if length == 0:
+                continue
+            outgoing = (dx / length, dy / length)
+            if direction is None or direction[0] * outgoing[0] + direction[1] * outgoing[1] < self._join_cos:
+                rounded.append(start)
+            direction = outgoing
+        self._direction = direction
+
+        if not self.active:
+            rounded.append(points[-1]) # End cap
+        return rounded
@@ -0,0 +1,94 @@
+"""
+Tests for the soft brush: dab masks, and strokes whose opacity caps the whole stroke.
+
+    python -m pytest -q
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+import pytest
+
+from brush import stamp_mask
+from engine import DrawingEngine
+
+SIZE = (160, 120)
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def brush_engine(hardness, opacity):
+    engine = DrawingEngine(SIZE)
+    engine.set_mode("brush")
+    engine.set_color((0, 0, 0))
+    engine.set_brush_size(20)
+    engine.set_brush_hardness(hardness)
+    engine.set_brush_opacity(opacity)
+    return engine
+
+
+def stroke(engine, points, flush_every=1):
+    engine.press(points[0])
+    for i, pos in enumerate(points[1:], 1):
+        engine.drag(pos)
+        if i % flush_every == 0:
+            engine.flush()
+    engine.release(points[-1])
+
+
+def darkness(engine):
+    """How far each pixel went from white towards black, 0..255, indexed [x, y]."""
+    return 255 - pygame.surfarray.array3d(engine.image)[..., 0].astype(int)
+
+
+@pytest.mark.parametrize("hardness", [0, 0.5, 1])
+def test_stamp_mask(hardness):
+    mask = stamp_mask(21, hardness)
+    half = mask.shape[0] // 2
+    assert mask.shape[0] % 2 == 1 # Centres on a pixel
+    assert mask[half, half] == 1
+    assert mask.min() >= 0 and mask.max() <= 1
+    assert np.array_equal(mask, mask.T) and np.array_equal(mask, mask[::-1])
+    assert mask[0, 0] == 0 # Round, the corners are outside it
+
+
+def test_softer_masks_fade_sooner():
+    hard, soft = stamp_mask(21, 1), stamp_mask(21, 0)
+    assert (soft <= hard).all()
+    assert soft.sum() < hard.sum()
+
+
+def test_overlapping_dabs_do_not_build_up():
+    once = brush_engine(100, 128)
+    stroke(once, [(80, 60)])
+    scribbled = brush_engine(100, 128)
+    stroke(scribbled, [(80, 60), (90, 60), (70, 60), (80, 65), (80, 55), (80, 60)] * 5)
+    assert darkness(scribbled)[80, 60] == darkness(once)[80, 60]
+    assert darkness(scribbled).max() == darkness(once).max() == 128 # The opacity, however often it went over
+
+
+def test_frame_batching_does_not_change_the_stroke():
+    points = [(20 + i * 7, 60 + (i % 5) * 6) for i in range(18)]
+    every_sample, all_at_once = brush_engine(30, 200), brush_engine(30, 200)
+    stroke(every_sample, points, flush_every=1)
+    stroke(all_at_once, points, flush_every=len(points))
+    assert np.array_equal(darkness(every_sample), darkness(all_at_once))
+
+
+def test_brush_on_a_layer_keeps_to_the_opacity():
+    engine = brush_engine(0, 100)
+    engine.add_layer()
+    stroke(engine, [(30, 30), (120, 90), (30, 90), (120, 30)])
+    alpha = pygame.surfarray.array_alpha(engine.layer.surface)
+    assert alpha.max() == 100
+    assert 0 < alpha[alpha > 0].min() < 100 # Soft edges
+    engine.undo()
+    assert not pygame.surfarray.array_alpha(engine.layer.surface).any()
@@ -0,0 +1,107 @@
+"""
+Tests for sharing a canvas through collab.py: two engines, each with a client of one local server.
+
+    python -m pytest -q
+"""
+import asyncio
+import os
+import threading
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from collab import CollabClient, CollabServer
+from engine import DrawingEngine
+
+SIZE = (320, 240)
+TILE_SIZE = 64
+
+
+@pytest.fixture
+def port():
+    pygame.init()
+    server = CollabServer(SIZE, TILE_SIZE)
+    loop = asyncio.new_event_loop()
+    started = loop.run_until_complete(server.start("127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield started
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    pygame.quit()
+
+
+@pytest.fixture
+def users(port):
+    engines = [DrawingEngine(SIZE, history_tile_size=TILE_SIZE) for _ in range(2)]
+    clients = [CollabClient("127.0.0.1", port, SIZE, TILE_SIZE) for _ in range(2)]
+    for engine, client in zip(engines, clients):
+        assert client.error is None
+        engine.take_changes() # Start collecting
+    yield list(zip(engines, clients))
+    for client in clients:
+        client.close()
+
+
+def pixels(engine):
+    return pygame.image.tobytes(engine.image, "RGB")
+
+
+def sync(users, until, timeout=5):
+    """Trades changes the way the app does every frame until until() holds; False if it never did."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        for engine, client in users:
+            client.send(engine.take_changes())
+            if not engine.drawing:
+                engine.write_tiles(client.receive())
+        if until():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_clients_converge(users):
+    (first, _), (second, _) = users
+    first.set_mode("rect")
+    first.set_fill_mode("fill")
+    first.set_color((0, 200, 0))
+    first.press((40, 40))
+    first.release((200, 160))
+    second.set_color((200, 0, 0))
+    second.set_brush_size(6)
+    second.press((20, 100)) # Across the rectangle, at the same time
+    second.drag((300, 100))
+    second.flush()
+    second.release((300, 100))
+    assert sync(users, lambda: pixels(first) == pixels(second))
+
+    second.set_mode("rect")
+    second.press((150, 20)) # An outline on the same tiles as the filled rectangle
+    second.release((300, 220))
+    assert sync(users, lambda: pixels(first) == pixels(second))
+    second.undo() # Takes back only the outline, the rest of those tiles stays
+    assert sync(users, lambda: pixels(first) == pixels(second))
+    assert first.image.get_at((150, 40))[:3] == (0, 200, 0)
+    assert first.image.get_at((250, 100))[:3] == (200, 0, 0)
+    assert first.image.get_at((150, 200))[:3] == (255, 255, 255)
+
+
+def test_stroke_in_progress_is_shared(users):
+    (first, _), (second, _) = users
+    first.set_color((0, 0, 200))
+    first.set_brush_size(4)
+    first.press((30, 30))
+    first.drag((150, 120))
+    first.flush()
+    assert first.drawing
+    assert sync(users, lambda: second.image.get_at((90, 75))[:3] == (0, 0, 200))
+
+    first.drag((290, 30))
+    first.release((290, 30))
+    assert sync(users, lambda: pixels(first) == pixels(second))
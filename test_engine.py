@@ -0,0 +1,124 @@
+"""
+Regression tests for engine checkpoints and the journal.
+
+    python -m pytest -q
+"""
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from engine import DrawingEngine
+from journal import Journal, decode_state, encode_state
+
+SIZE = (160, 120)
+
+
+def pixels(engine):
+    return pygame.image.tobytes(engine.image, "RGB")
+
+
+def draw_session(engine, seed=1):
+    """Some strokes, shapes, brush settings and layers, drawn through the engine's public methods."""
+    rng = random.Random(seed)
+    engine.set_brush_size(4)
+    engine.set_brush_opacity(128)
+    engine.set_brush_hardness(50)
+    for mode in ("pen", "rect", "brush", "line", "circle", "fill", "eraser"):
+        engine.set_mode(mode)
+        engine.set_color((rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        x, y = rng.randrange(SIZE[0]), rng.randrange(SIZE[1])
+        engine.press((x, y))
+        for _ in range(5):
+            x, y = rng.randrange(SIZE[0]), rng.randrange(SIZE[1])
+            engine.drag((x, y))
+        engine.release((x, y))
+        if mode == "line":
+            engine.add_layer()
+            engine.set_layer_opacity(1, 191)
+            engine.set_layer_blend(1, "multiply")
+    engine.undo()
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def test_state_round_trip():
+    engine = DrawingEngine(SIZE)
+    draw_session(engine)
+    restored = DrawingEngine(SIZE)
+    restored.restore(decode_state(encode_state(engine.state())))
+    assert restored.state() == engine.state()
+    assert restored.brush_opacity == 128 # Not the last layer's opacity
+    assert pixels(restored) == pixels(engine)
+
+
+def test_journal_restores_drawing(tmp_path):
+    path = str(tmp_path / "drawing.journal")
+    engine = DrawingEngine(SIZE)
+    engine.journal = Journal(path, engine, checkpoint_every=3)
+    draw_session(engine)
+    engine.journal.checkpoint(engine)
+    engine.set_mode("pen")
+    engine.press((10, 10))
+    engine.drag((50, 60))
+    engine.release((50, 60))
+    engine.journal.close()
+
+    reopened = DrawingEngine(SIZE)
+    journal = Journal(path, reopened)
+    journal.close()
+    assert journal.error is None
+    assert journal.recovered > 0 # The stroke after the checkpoint was replayed
+    assert reopened.state() == engine.state()
+
+
+def test_journal_survives_garbage_tail(tmp_path):
+    path = str(tmp_path / "drawing.journal")
+    engine = DrawingEngine(SIZE)
+    engine.journal = Journal(path, engine)
+    draw_session(engine)
+    engine.journal.close()
+    with open(path, "ab") as f:
+        f.write(bytes(4096)) # What a power loss can leave
+
+    reopened = DrawingEngine(SIZE)
+    Journal(path, reopened).close()
+    assert pixels(reopened) == pixels(engine)
+
+
+@pytest.mark.parametrize("mode", ["select", "lasso"])
+def test_checkpoint_keeps_selection_and_clipboard(tmp_path, mode):
+    path = str(tmp_path / "drawing.journal")
+    engine = DrawingEngine(SIZE)
+    engine.journal = Journal(path, engine)
+    engine.set_mode("rect")
+    engine.set_fill_mode("fill")
+    engine.set_color((200, 30, 30))
+    engine.press((20, 20))
+    engine.release((70, 60))
+    engine.set_mode(mode)
+    engine.press((10, 10))
+    for pos in ((50, 15), (45, 50)):
+        engine.drag(pos)
+    engine.release((45, 50))
+    engine.copy_selection()
+    engine.journal.checkpoint(engine)
+    engine.delete_selection()
+    engine.paste((90, 40))
+    engine.journal.close()
+
+    reopened = DrawingEngine(SIZE)
+    journal = Journal(path, reopened)
+    journal.close()
+    assert journal.recovered > 0 # The delete and paste were replayed from the checkpoint's selection and clipboard
+    assert pixels(reopened) == pixels(engine)
+    assert reopened.state() == engine.state()
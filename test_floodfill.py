@@ -0,0 +1,80 @@
+"""
+Tests for the scanline flood fill against a pixel by pixel one.
+
+    python -m pytest -q
+"""
+import os
+import random
+from collections import deque
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from floodfill import flood_fill
+
+SIZE = (160, 120)
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def reference_fill(surface, start, color, tolerance=0, connectivity=4):
+    """Pixel by pixel fill of the pixels within tolerance of the start pixel's colour, in every channel."""
+    width, height = surface.get_size()
+    target = surface.get_at(start)
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    if connectivity == 8:
+        steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        x, y = queue.popleft()
+        surface.set_at((x, y), color)
+        for dx, dy in steps:
+            neighbour = (x + dx, y + dy)
+            if (neighbour not in seen and 0 <= neighbour[0] < width and 0 <= neighbour[1] < height
+                    and max(abs(a - b) for a, b in zip(surface.get_at(neighbour), target)) <= tolerance):
+                seen.add(neighbour)
+                queue.append(neighbour)
+
+
+@pytest.mark.parametrize("tolerance, connectivity", [(0, 4), (0, 8), (24, 4), (24, 8)])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_flood_fill_matches_reference(seed, tolerance, connectivity):
+    rng = random.Random(seed)
+    surface = pygame.Surface(SIZE)
+    surface.fill((255, 255, 255))
+    for _ in range(40): # Patches of nearly the background colour, which only a tolerance takes in
+        shade = tuple(rng.randrange(220, 256) for _ in range(3))
+        corner = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        pygame.draw.rect(surface, shade, (corner, (rng.randrange(4, 30), rng.randrange(4, 30))))
+    for _ in range(25): # Walls, with gaps and diagonal-only contacts
+        start = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        end = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        pygame.draw.line(surface, (0, 0, 0), start, end)
+    start = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+    expected = surface.copy()
+    reference_fill(expected, start, (255, 0, 0), tolerance, connectivity)
+
+    flood_fill(surface, start, (255, 0, 0), tolerance, connectivity)
+    assert pygame.image.tobytes(surface, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+
+@pytest.mark.parametrize("tolerance", [0, 40])
+def test_flood_fill_on_a_layer_counts_transparency(tolerance):
+    surface = pygame.Surface(SIZE, pygame.SRCALPHA)
+    surface.fill((0, 0, 0, 0))
+    pygame.draw.rect(surface, (0, 0, 0, 30), (40, 30, 60, 50)) # Faint, but not transparent
+    pygame.draw.rect(surface, (0, 0, 0, 90), (60, 40, 20, 20))
+    expected = surface.copy()
+    reference_fill(expected, (5, 5), (255, 0, 0), tolerance)
+
+    flood_fill(surface, (5, 5), (255, 0, 0), tolerance)
+    assert pygame.image.tobytes(surface, "RGBA") == pygame.image.tobytes(expected, "RGBA")
@@ -0,0 +1,97 @@
+"""
+Tests for the tile history: exact undo and redo, shared tile contents and the byte budget.
+
+    python -m pytest -q
+"""
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from engine import DrawingEngine
+from history import TileHistory
+from test_engine import SIZE, draw_session, pixels
+
+TILE = 64 * 64 * 4 # Bytes of one full tile of a 32-bit surface
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def stored_bytes(history):
+    """What the entries hold, counting each distinct tile content once."""
+    undo, redo = history.entries()
+    blobs = {blob for _, tiles in undo + redo for tile in tiles for blob in tile[4:]}
+    return sum(len(blob) for blob in blobs)
+
+
+def test_undo_to_blank_and_redo():
+    engine = DrawingEngine(SIZE)
+    blank = pixels(engine)
+    draw_session(engine)
+    engine.redo() # The session ends with an undo
+    drawn = pixels(engine)
+    while engine.undo():
+        pass
+    assert pixels(engine) == blank
+    while engine.redo():
+        pass
+    assert pixels(engine) == drawn
+
+
+def test_identical_tiles_are_stored_once():
+    surface = pygame.Surface((256, 256))
+    surface.fill((255, 255, 255))
+    history = TileHistory(surface, 64)
+    for i in range(20): # The same two colours over and over on one tile
+        surface.fill((255, 0, 0) if i % 2 else (0, 0, 255), (0, 0, 64, 64))
+        history.commit((0, 0, 64, 64))
+    assert history.bytes_used == 3 * TILE # White, red and blue
+    surface.fill((255, 255, 255))
+    history.commit()
+    assert history.bytes_used == 3 * TILE
+    assert history.bytes_used == stored_bytes(history)
+
+
+def test_budget_drops_oldest_entries():
+    surface = pygame.Surface((256, 256))
+    surface.fill((255, 255, 255))
+    history = TileHistory(surface, 64, max_bytes=20 * TILE)
+    rng = random.Random(1)
+    states = []
+    for _ in range(40): # Noise never repeats, so every tile is new
+        noise = pygame.image.frombytes(rng.randbytes(64 * 64 * 3), (64, 64), "RGB")
+        surface.blit(noise, (rng.randrange(0, 256, 64), rng.randrange(0, 256, 64)))
+        history.commit()
+        states.append(pygame.image.tobytes(surface, "RGB"))
+        assert history.bytes_used <= history.max_bytes
+        assert history.bytes_used == stored_bytes(history)
+    assert 0 < history.index < 40
+
+    for state in reversed(states[-history.index:]): # What is kept undoes exactly
+        assert pygame.image.tobytes(surface, "RGB") == state
+        history.undo()
+    assert history.undo() is None
+
+    history.redo()
+    surface.fill((0, 0, 0), (0, 0, 64, 64))
+    history.commit() # Drops the undone entries, and the tiles only they used
+    assert history.bytes_used == stored_bytes(history)
+
+
+def test_newest_entry_is_kept_over_budget():
+    surface = pygame.Surface((256, 256))
+    history = TileHistory(surface, 64, max_bytes=TILE)
+    surface.fill((255, 0, 0))
+    history.commit()
+    assert history.index == 1 # A black and a red tile, twice the budget, but still undoable
+    history.undo()
+    assert pygame.image.tobytes(surface, "RGB") == bytes(256 * 256 * 3)
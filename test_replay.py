@@ -0,0 +1,44 @@
+"""
+Tests that recorded engine commands replay to the same drawing, the benchmark workloads included.
+
+    python -m pytest -q
+"""
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from benchmarks import CANVAS_SIZE, WORKLOADS
+from engine import DrawingEngine
+from test_engine import SIZE, draw_session
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def test_replay_matches_recording():
+    engine = DrawingEngine(SIZE, record=True)
+    draw_session(engine)
+    replayed = DrawingEngine(SIZE)
+    replayed.replay(engine.recording)
+    assert replayed.state() == engine.state()
+
+
+@pytest.mark.parametrize("name", ["pen", "brush", "fill", "undo", "save"]) # Not tiled, it needs a 20000 px canvas
+def test_workload_replays_the_same(name, tmp_path):
+    setup, timed, _, _ = WORKLOADS[name](random.Random(1234), str(tmp_path))
+    assert WORKLOADS[name](random.Random(1234), str(tmp_path))[:2] == (setup, timed) # Runs are comparable
+    engine = DrawingEngine(CANVAS_SIZE, record=True)
+    engine.replay(setup + timed)
+
+    replayed = DrawingEngine(CANVAS_SIZE)
+    replayed.replay(engine.recording)
+    assert pygame.image.tobytes(replayed.image, "RGB") == pygame.image.tobytes(engine.image, "RGB")
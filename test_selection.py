@@ -0,0 +1,117 @@
+"""
+Tests for rectangle and lasso selections: moving, copying and pasting through the engine.
+
+    python -m pytest -q
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+import pytest
+
+from engine import DrawingEngine
+from selection import lasso_selection, selection_from_state
+
+SIZE = (200, 150)
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def pixels(engine):
+    return pygame.image.tobytes(engine.image, "RGB")
+
+
+def drawn_engine(record=False):
+    engine = DrawingEngine(SIZE, record=record)
+    engine.set_mode("brush")
+    engine.set_brush_size(12)
+    engine.set_brush_hardness(0)
+    engine.set_color((200, 40, 40))
+    engine.press((20, 20))
+    engine.drag((90, 70))
+    engine.release((90, 70))
+    engine.set_mode("rect")
+    engine.set_fill_mode("fill")
+    engine.set_color((40, 40, 200))
+    engine.press((50, 30))
+    engine.release((80, 60))
+    return engine
+
+
+def select(engine, mode):
+    engine.set_mode(mode)
+    if mode == "select":
+        engine.press((30, 25))
+        engine.release((85, 65))
+    else:
+        engine.press((30, 25))
+        for pos in ((85, 25), (85, 65)):
+            engine.drag(pos)
+        engine.release((30, 65))
+    assert engine.selection
+
+
+@pytest.mark.parametrize("mode", ["select", "lasso"])
+def test_move_away_and_back(mode):
+    engine = drawn_engine(record=True)
+    before = pixels(engine)
+    select(engine, mode)
+    engine.press((60, 45)) # Inside the selection: drags it
+    engine.drag((150, 110))
+    engine.release((150, 110))
+    moved = pixels(engine)
+    assert moved != before
+    engine.press((150, 110))
+    engine.release((60, 45))
+    assert pixels(engine) == before
+
+    engine.undo()
+    assert pixels(engine) == moved
+    engine.undo()
+    assert pixels(engine) == before
+    replayed = DrawingEngine(SIZE)
+    replayed.replay(engine.recording)
+    assert pixels(replayed) == before
+
+
+@pytest.mark.parametrize("mode", ["select", "lasso"])
+def test_copy_and_paste_on_a_layer(mode):
+    engine = DrawingEngine(SIZE)
+    engine.add_layer()
+    engine.set_mode("brush")
+    engine.set_brush_size(20)
+    engine.set_brush_hardness(0)
+    engine.set_brush_opacity(160)
+    engine.press((40, 40))
+    engine.drag((70, 50))
+    engine.release((70, 50))
+    select(engine, mode)
+    engine.copy_selection()
+    engine.paste((110, 80))
+
+    pasted = engine.selection # The pasted copy is selected
+    source = pasted.moved(30 - 110, 25 - 80) # Where it was copied from
+    copied = source.copy_pixels(engine.layer.surface)
+    result = pasted.copy_pixels(engine.layer.surface)
+    alpha = pygame.surfarray.array_alpha(copied)
+    assert alpha.any()
+    # Onto transparent pixels the copy is exact, alpha included
+    assert np.array_equal(pygame.surfarray.array_alpha(result), alpha)
+    assert np.array_equal(pygame.surfarray.array3d(result)[alpha > 0], pygame.surfarray.array3d(copied)[alpha > 0])
+
+
+def test_selection_state_round_trip():
+    shape = lasso_selection([(10, 10), (60, 12), (40, 50)], pygame.Rect((0, 0), SIZE))
+    restored = selection_from_state(shape.state())
+    assert restored.rect == shape.rect
+    assert np.array_equal(restored.mask, shape.mask)
+    assert restored.outline == shape.outline
+    assert restored.state() == shape.state()
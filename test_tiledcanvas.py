@@ -0,0 +1,51 @@
+"""
+Tests for the tiled canvas's tile store.
+
+    python -m pytest -q
+"""
+import os
+import random
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # No window needed
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+import pytest
+
+from tiledcanvas import TileStore
+
+
+@pytest.fixture(autouse=True, scope="module")
+def pygame_initialised():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def test_tile_file_is_compacted(tmp_path):
+    window = pygame.Surface((64, 64))
+    store = TileStore((256, 256), 32, (255, 255, 255), window, max_resident=2, compact_bytes=4096)
+    rng = random.Random(1)
+    noise = pygame.image.frombytes(rng.randbytes(64 * 64 * 3), (64, 64), "RGB") # Doesn't compress
+    snapshot = None
+    for i in range(200): # Draw all over it, with only two tiles in memory
+        window.blit(noise, (0, 0), (i % 7, i % 5, 64, 64))
+        store.write(window, (i * 32 % 192, i * 64 % 192, 64, 64))
+        if i == 20:
+            snapshot, expected = store.snapshot(), pygame.Surface((256, 256))
+            store.read((0, 0, 256, 256), expected)
+    final = pygame.Surface((256, 256))
+    store.read((0, 0, 256, 256), final)
+
+    store.snapshot()
+    assert store._file_end <= 2 * max(store.compact_bytes, 256 * 256 * 3) # Not every version written
+    # The snapshot reads the file it was taken from, even though the store moved on to another one
+    snapshot.write_png(str(tmp_path / "snapshot.png"))
+    saved = pygame.image.load(str(tmp_path / "snapshot.png"))
+    assert pygame.image.tobytes(saved, "RGB") == pygame.image.tobytes(expected, "RGB")
+    after = pygame.Surface((256, 256))
+    store.read((0, 0, 256, 256), after)
+    assert pygame.image.tobytes(after, "RGB") == pygame.image.tobytes(final, "RGB")
+
+    store.clear()
+    assert store._file_end == 0
@@ -0,0 +1,339 @@
+"""
+Tiled backing store for canvases bigger than the window (and than memory).
+
+The canvas is cut into square tiles. A bounded number of recently used tiles
+stay in memory as surfaces; the rest are zlib-compressed into an append-only
+temporary file and loaded again when needed. Once most of the file is old
+versions of tiles, the current ones are copied into a new file. Tiles that
+were never drawn on aren't stored at all and read as the background colour.
+
+Editing happens on a window surface: a tile aligned part of the canvas around
+the viewport, so the tools, fill and history work on it exactly as on a small
+canvas. When the view moves out of it, the changed part is written back and
+the window is reloaded around the new view. Zoomed out views are drawn from
+cached mip tiles, each level half the resolution of the one below.
+"""
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+
+def _round_up(value, step):
+    return -(-value // step) * step
+
+
+class TileStore:
+    def __init__(self, size, tile_size, background, tile_format, max_resident=64, max_mips=24,
+                 compact_bytes=16 * 1024 * 1024):
+        self.size = size
+        self.tile_size = tile_size
+        self.background = background
+        self.max_resident = max_resident
+        self.max_mips = max_mips
+        self.compact_bytes = compact_bytes # Old tile versions in the file past which it is compacted (if more than half)
+        self._format = tile_format # Tiles share this surface's pixel format, so blits to and from it are plain copies
+        self._resident = OrderedDict() # (tx, ty) -> [surface, changed since last stored]; least recently used first
+        self._index = {} # (tx, ty) -> (offset, length) of the tile's compressed pixels in the file
+        self._mips = {} # level -> OrderedDict of (mx, my) -> surface, least recently used first
+        self._blank_mips = set() # (level, mx, my) of mip tiles whose whole area is blank
+        self._file = tempfile.TemporaryFile() # Deleted automatically when closed
+        self._file_end = 0
+        self._dead_bytes = 0 # Bytes of the file no index entry points at any more
+        self._lock = threading.Lock() # The file is also read by snapshots being saved on another thread
+
+    def _tiles_in(self, rect):
+        """Yields ((tx, ty), canvas Rect of the tile) for every tile overlapping rect."""
+        size = self.tile_size
+        rect = pygame.Rect(rect).clip((0, 0) + tuple(self.size))
+        for ty in range(rect.top // size, -(-rect.bottom // size)):
+            for tx in range(rect.left // size, -(-rect.right // size)):
+                yield (tx, ty), pygame.Rect(tx * size, ty * size, size, size)
+
+    def _has(self, key):
+        return key in self._resident or key in self._index
+
+    def _tile(self, key):
+        """Returns the tile's surface, loading it from the file (or creating it blank) if it isn't in memory."""
+        entry = self._resident.get(key)
+        if entry is not None:
+            self._resident.move_to_end(key)
+            return entry[0]
+
+        tile = pygame.Surface((self.tile_size, self.tile_size), 0, self._format)
+        if key in self._index:
+            offset, length = self._index[key]
+            with self._lock:
+                self._file.seek(offset)
+                data = self._file.read(length)
+            tile.blit(pygame.image.frombytes(zlib.decompress(data), tile.get_size(), "RGB"), (0, 0))
+        else:
+            tile.fill(self.background)
+        self._resident[key] = [tile, False]
+
+        # Make room, least recently used first; only tiles drawn on since they were stored need writing out
+        while len(self._resident) > self.max_resident:
+            old_key, (old_tile, changed) = self._resident.popitem(last=False)
+            if changed:
+                self._store(old_key, old_tile)
+        return tile
+
+    def _store(self, key, tile):
+        data = zlib.compress(pygame.image.tobytes(tile, "RGB"), 1)
+        with self._lock:
+            self._file.seek(self._file_end)
+            self._file.write(data)
+        # Old versions stay in the file, a snapshot being saved may still point at them
+        if key in self._index:
+            self._dead_bytes += self._index[key][1]
+        self._index[key] = (self._file_end, len(data))
+        self._file_end += len(data)
+        if self._dead_bytes > max(self.compact_bytes, self._file_end // 2):
+            self._compact()
+
+    def _compact(self):
+        """
+        Copies the current version of every stored tile into a new file. Snapshots keep the old file open, and read
+        from it, until they are done; it is deleted when the last one lets go of it.
+        """
+        new_file = tempfile.TemporaryFile()
+        index = {}
+        with self._lock:
+            for key, (offset, length) in self._index.items():
+                self._file.seek(offset)
+                index[key] = (new_file.tell(), length)
+                new_file.write(self._file.read(length))
+        self._file = new_file
+        self._index = index
+        self._file_end = new_file.tell()
+        self._dead_bytes = 0
+
+    def read(self, rect, target, dest=(0, 0)):
+        """Copies the canvas area rect into target at dest."""
+        rect = pygame.Rect(rect)
+        for key, tile_rect in self._tiles_in(rect):
+            part = tile_rect.clip(rect)
+            position = (dest[0] + part.x - rect.x, dest[1] + part.y - rect.y)
+            if self._has(key):
+                target.blit(self._tile(key), position, part.move(-tile_rect.x, -tile_rect.y))
+            else:
+                target.fill(self.background, pygame.Rect(position, part.size))
+
+    def write(self, source, rect, source_pos=(0, 0)):
+        """Copies source, starting at source_pos, into the canvas area rect."""
+        rect = pygame.Rect(rect)
+        for key, tile_rect in self._tiles_in(rect):
+            part = tile_rect.clip(rect)
+            area = pygame.Rect(source_pos[0] + part.x - rect.x, source_pos[1] + part.y - rect.y, part.width, part.height)
+            self._tile(key).blit(source, part.move(-tile_rect.x, -tile_rect.y), area)
+            self._resident[key][1] = True
+            # Every mip tile above this one is out of date now
+            for level, cache in self._mips.items():
+                mip_key = (key[0] >> level, key[1] >> level)
+                cache.pop(mip_key, None)
+                self._blank_mips.discard((level,) + mip_key)
+
+    def clear(self):
+        """Makes the whole canvas blank again."""
+        self._resident.clear()
+        self._index.clear()
+        self._mips.clear()
+        self._blank_mips.clear()
+        self._file = tempfile.TemporaryFile() # The old one goes once no snapshot reads from it
+        self._file_end = 0
+        self._dead_bytes = 0
+
+    def mip(self, level, mx, my):
+        """
+        Returns tile (mx, my) of a mip level: the canvas area of 2**level by 2**level tiles, scaled down to one
+        tile. Returns None if that area is blank.
+        """
+        if level == 0:
+            return self._tile((mx, my)) if self._has((mx, my)) else None
+        if (level, mx, my) in self._blank_mips:
+            return None
+
+        # Each level has its own cache, so building a zoomed out view doesn't push out the tiles of the view itself
+        cache = self._mips.setdefault(level, OrderedDict())
+        key = (mx, my)
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        half = self.tile_size // 2
+        mip = None
+        for dy in (0, 1):
+            for dx in (0, 1):
+                child = self.mip(level - 1, mx * 2 + dx, my * 2 + dy)
+                if child is None:
+                    continue
+                if mip is None:
+                    mip = pygame.Surface((self.tile_size, self.tile_size), 0, self._format)
+                    mip.fill(self.background)
+                mip.blit(pygame.transform.smoothscale(child, (half, half)), (dx * half, dy * half))
+
+        if mip is None:
+            self._blank_mips.add((level, mx, my))
+            return None
+        cache[key] = mip
+        while len(cache) > self.max_mips:
+            cache.popitem(last=False)
+        return mip
+
+    def snapshot(self):
+        """Stores every changed tile and returns a TileSnapshot of the canvas as it is now."""
+        for key, entry in self._resident.items():
+            if entry[1]:
+                self._store(key, entry[0])
+                entry[1] = False
+        with self._lock:
+            self._file.flush()
+        return TileSnapshot(self._file, self._lock, dict(self._index), self.size, self.tile_size, self.background)
+
+
+class TileSnapshot:
+    """The canvas at one point in time. Drawing can go on meanwhile, so it can be saved on another thread."""
+
+    def __init__(self, file, lock, index, size, tile_size, background):
+        self._file = file
+        self._lock = lock
+        self._index = index
+        self.size = size
+        self.tile_size = tile_size
+        self.background = background
+
+    def _tile_pixels(self, key):
+        """Returns the tile's (tile_size, tile_size, 3) RGB pixels, or None if it is blank."""
+        if key not in self._index:
+            return None
+        offset, length = self._index[key]
+        with self._lock:
+            self._file.seek(offset)
+            data = self._file.read(length)
+        return np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(self.tile_size, self.tile_size, 3)
+
+    def write_png(self, filename):
+        """Writes the canvas as a PNG, one row of tiles at a time, so memory use doesn't grow with the canvas."""
+        width, height = self.size
+        size = self.tile_size
+        compressor = zlib.compressobj(1) # Big canvases are mostly blank, the fastest level still compresses them well
+        # One row of tiles as PNG scanlines: a filter type byte (0, none) then the RGB pixels
+        band = np.empty((size, 1 + width * 3), dtype=np.uint8)
+        band[:, 0] = 0
+        blank_row = np.tile(np.array(self.background[:3], dtype=np.uint8), width)
+
+        with open(filename, "wb") as out:
+            out.write(b"\x89PNG\r\n\x1a\n")
+            _write_chunk(out, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            for ty in range(-(-height // size)):
+                rows = min(size, height - ty * size)
+                band[:rows, 1:] = blank_row
+                for tx in range(-(-width // size)):
+                    pixels = self._tile_pixels((tx, ty))
+                    if pixels is not None:
+                        columns = min(size, width - tx * size)
+                        target = band[:rows, 1 + tx * size * 3:1 + (tx * size + columns) * 3].reshape(rows, columns, 3)
+                        target[...] = pixels[:rows, :columns]
+                data = compressor.compress(band[:rows].tobytes())
+                if data:
+                    _write_chunk(out, b"IDAT", data)
+            _write_chunk(out, b"IDAT", compressor.flush())
+            _write_chunk(out, b"IEND", b"")
+
+
+def _write_chunk(out, kind, data):
+    out.write(struct.pack(">I", len(data)))
+    out.write(kind)
+    out.write(data)
+    out.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+class TiledCanvas:
+    def __init__(self, size, window_size, background=(255, 255, 255), tile_size=256, max_resident=64, max_mips=24):
+        # The canvas and window are whole tiles, so the window always lines up with the tile grid
+        self.size = (_round_up(size[0], tile_size), _round_up(size[1], tile_size))
+        self.tile_size = tile_size
+        self.background = background
+        window_size = (min(_round_up(window_size[0], tile_size), self.size[0]),
+                       min(_round_up(window_size[1], tile_size), self.size[1]))
+        self.window = pygame.Surface(window_size) # The part of the canvas being edited
+        self.origin = (0, 0) # Canvas position of the window's top-left corner
+        self.store = TileStore(self.size, tile_size, background, self.window, max_resident, max_mips)
+        self._changed = None # Window area drawn on since it was last written back to the store
+        self.store.read(self.window_rect, self.window)
+
+    @property
+    def window_rect(self):
+        """Canvas area the window holds."""
+        return pygame.Rect(self.origin, self.window.get_size())
+
+    def mark_changed(self, rect):
+        """Records that the window area rect (window coordinates) was drawn on."""
+        rect = pygame.Rect(rect).clip(self.window.get_rect())
+        if rect.width and rect.height:
+            self._changed = rect if self._changed is None else self._changed.union(rect)
+
+    def write_back(self):
+        """Copies what was drawn in the window into the tiles."""
+        if self._changed:
+            self.store.write(self.window, self._changed.move(self.origin), self._changed.topleft)
+            self._changed = None
+
+    def move_window(self, rect):
+        """Moves the window so it holds the canvas area rect, centred as far as possible. Returns True if it moved."""
+        rect = pygame.Rect(rect)
+        if self.window_rect.contains(rect):
+            return False
+        width, height = self.window.get_size()
+        size = self.tile_size
+        x = min(max((rect.centerx - width // 2) // size * size, 0), self.size[0] - width)
+        y = min(max((rect.centery - height // 2) // size * size, 0), self.size[1] - height)
+        if (x, y) == self.origin:
+            return False # rect is bigger than the window, it already covers as much as it can
+
+        self.write_back()
+        self.origin = (x, y)
+        self.store.read(self.window_rect, self.window)
+        return True
+
+    def write_tile(self, x, y, width, height, pixels):
+        """Writes (height, width) surface pixels to the canvas at x, y; for history tiles outside the window."""
+        tile = pygame.Surface((width, height), 0, self.window)
+        view = pygame.surfarray.pixels2d(tile)
+        view[...] = pixels.T
+        del view
+        self.store.write(tile, (x, y, width, height))
+
+    def clear(self):
+        self.store.clear()
+        self.window.fill(self.background)
+        self._changed = None
+
+    def draw_zoomed(self, target, dest, rect, level):
+        """
+        Draws the canvas area rect, scaled down by 2**level, into target at dest. rect must lie on the canvas and
+        its corners on multiples of 2**level.
+        """
+        self.write_back() # The mips are built from the tiles
+        scale = 1 << level
+        span = self.tile_size * scale # Canvas pixels covered by one mip tile
+        for my in range(rect.top // span, -(-rect.bottom // span)):
+            for mx in range(rect.left // span, -(-rect.right // span)):
+                part = pygame.Rect(mx * span, my * span, span, span).clip(rect)
+                position = (dest[0] + (part.x - rect.x) // scale, dest[1] + (part.y - rect.y) // scale)
+                area = pygame.Rect((part.x - mx * span) // scale, (part.y - my * span) // scale,
+                                   part.width // scale, part.height // scale)
+                mip = self.store.mip(level, mx, my)
+                if mip is None:
+                    target.fill(self.background, pygame.Rect(position, area.size))
+                else:
+                    target.blit(mip, position, area)
+
+    def snapshot(self):
+        """Returns a TileSnapshot of the whole canvas, including what is in the window."""
+        self.write_back()
+        return self.store.snapshot()
@@ -0,0 +1,36 @@
+"""
+Cached toolbar rendering.
+
+The toolbar is drawn once into its own surface and reused every frame; it is
+only redrawn when the state it displays changes. Text goes through a shared
+cache so fonts are created once and each label is rendered once per colour.
+"""
+from functools import lru_cache
+
+import pygame
+
+
+@lru_cache(maxsize=None)
+def get_font(size=24):
+    """Returns the shared default font at the given size."""
+    return pygame.font.Font(None, size)
+
+
+@lru_cache(maxsize=256)
+def render_text(text, color, size=24):
+    """Returns a rendered (antialiased) label. The surface is shared, so don't draw onto it."""
+    return get_font(size).render(text, True, color)
+
+
+class ToolbarCache:
+    def __init__(self, size, draw):
+        self.surface = pygame.Surface(size)
+        self._draw = draw # Called as draw(surface) to paint the whole toolbar
+        self._state = None
+
+    def get(self, state):
+        """Returns the toolbar surface, redrawing it first if state differs from the last call."""
+        if state != self._state:
+            self._draw(self.surface)
+            self._state = state
+        return self.surface
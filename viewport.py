@@ -0,0 +1,100 @@
+"""
+Viewport onto the canvas: which part of it the canvas area of the window shows,
+and at what zoom.
+
+Zoom steps are powers of two. Zoomed in, every canvas pixel is a whole block
+of screen pixels; zoomed out, every screen pixel is a whole block of canvas
+pixels (drawn from mip tiles, see tiledcanvas.py). Either way positions map
+exactly, so separately redrawn areas never show seams.
+"""
+import pygame
+
+
+class Viewport:
+    def __init__(self, view_rect, canvas_size, min_level=0, max_level=3):
+        self.rect = pygame.Rect(view_rect) # Screen area showing the canvas
+        self.canvas_size = canvas_size
+        self.min_level = min_level
+        self.max_level = max_level
+        self.level = 0 # Zoom is 2**level: 0 = 1:1, 1 = 200%, -1 = 50%, ...
+        self.offset = (0, 0) # Canvas position shown at the view's top-left corner
+        self._pan_rest = (0.0, 0.0) # Fractions of a canvas pixel panned but not applied yet
+        self._clamp()
+
+    @property
+    def zoom(self):
+        return 2.0 ** self.level
+
+    def _to_canvas_length(self, length):
+        return length >> self.level if self.level >= 0 else length << -self.level
+
+    def _to_screen_length(self, length):
+        return length << self.level if self.level >= 0 else length >> -self.level
+
+    def to_canvas(self, pos):
+        """Converts a screen position to the canvas pixel under it."""
+        return (self.offset[0] + self._to_canvas_length(pos[0] - self.rect.x),
+                self.offset[1] + self._to_canvas_length(pos[1] - self.rect.y))
+
+    def to_screen(self, pos):
+        """Converts a canvas position to the screen position of its pixel's top-left corner."""
+        return (self.rect.x + self._to_screen_length(pos[0] - self.offset[0]),
+                self.rect.y + self._to_screen_length(pos[1] - self.offset[1]))
+
+    def rect_to_canvas(self, rect):
+        """Returns the canvas area shown in the screen area rect (rounded outwards to whole pixels)."""
+        rect = pygame.Rect(rect)
+        left, top = self.to_canvas(rect.topleft)
+        # Negate around the shift to round the far edge up instead of down
+        right = self.offset[0] - self._to_canvas_length(self.rect.x - rect.right)
+        bottom = self.offset[1] - self._to_canvas_length(self.rect.y - rect.bottom)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def rect_to_screen(self, rect):
+        """Returns the screen area showing the canvas area rect (rounded outwards to whole pixels)."""
+        rect = pygame.Rect(rect)
+        left, top = self.to_screen(rect.topleft)
+        right = self.rect.x - self._to_screen_length(self.offset[0] - rect.right)
+        bottom = self.rect.y - self._to_screen_length(self.offset[1] - rect.bottom)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def visible_rect(self):
+        """The canvas area currently in view (part of it may be off the canvas)."""
+        return self.rect_to_canvas(self.rect)
+
+    def pan(self, dx, dy):
+        """Scrolls the view by a mouse movement of (dx, dy) screen pixels. Returns True if it moved."""
+        old = self.offset
+        # Zoomed in, a small movement is less than a canvas pixel; keep the rest so it adds up
+        move_x = self._pan_rest[0] - dx / self.zoom
+        move_y = self._pan_rest[1] - dy / self.zoom
+        self._pan_rest = (move_x - int(move_x), move_y - int(move_y))
+        self.offset = (self.offset[0] + int(move_x), self.offset[1] + int(move_y))
+        self._clamp()
+        return self.offset != old
+
+    def zoom_at(self, pos, steps):
+        """Zooms in (steps > 0) or out by whole zoom levels, keeping the canvas point under pos in place."""
+        level = min(max(self.level + steps, self.min_level), self.max_level)
+        if level == self.level:
+            return False
+        anchor = self.to_canvas(pos)
+        self.level = level
+        self.offset = (anchor[0] - self._to_canvas_length(pos[0] - self.rect.x),
+                       anchor[1] - self._to_canvas_length(pos[1] - self.rect.y))
+        self._clamp()
+        return True
+
+    def _clamp(self):
+        """Keeps the canvas in view (centred when it is smaller than the view), on whole screen pixels."""
+        offset = []
+        for position, view_length, canvas_length in zip(self.offset, self.rect.size, self.canvas_size):
+            visible = self._to_canvas_length(view_length)
+            if visible >= canvas_length:
+                position = (canvas_length - visible) // 2
+            else:
+                position = min(max(position, 0), canvas_length - visible)
+            if self.level < 0:
+                position = position >> -self.level << -self.level # A screen pixel starts on a whole block
+            offset.append(position)
+        self.offset = tuple(offset)